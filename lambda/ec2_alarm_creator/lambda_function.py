@@ -1,11 +1,25 @@
 import boto3
 from alarm_config import ALARM_CONFIGS
 import os
+import sys
 import json
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib'))
+try:
+    from config import get_client
+except ImportError:
+    # Deployed without lib/: fall back to a per-process client cache
+    _clients = {}
+
+    def get_client(service, region=None, profile=None):
+        key = (profile, region, service)
+        if key not in _clients:
+            _clients[key] = boto3.client(service, region_name=region)
+        return _clients[key]
+
 # Initialize AWS clients
-ec2_client = boto3.client('ec2')
-cloudwatch_client = boto3.client('cloudwatch')
+ec2_client = get_client('ec2')
+cloudwatch_client = get_client('cloudwatch')
 
 def create_cloudwatch_alarm(resource_id, metric_category, metric_type, threshold):
     """
@@ -17,8 +17,23 @@ GP3 EBS IOPS 监控告警脚本
 import boto3
 import botocore.exceptions
 import logging
+import os
+import sys
 import time
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib'))
+try:
+    from config import get_client
+except ImportError:
+    # Lambda 单文件部署时没有 lib/，退化为进程内缓存的客户端
+    _clients = {}
+
+    def get_client(service, region=None, profile=None):
+        key = (profile, region, service)
+        if key not in _clients:
+            _clients[key] = boto3.client(service, region_name=region)
+        return _clients[key]
+
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -33,7 +48,7 @@ VOLUME_TAG_VALUE = "yes"
 
 def get_aws_account_id():
     """获取当前 AWS 账户 ID"""
-    sts_client = boto3.client('sts')
+    sts_client = get_client('sts')
     account_id = sts_client.get_caller_identity()["Account"]
     logging.info(f"检测到 AWS 账户 ID: {account_id}")
     return account_id
@@ -98,8 +113,8 @@ def get_gp3_volumes(ec2_client, use_tags=False, tag_key=None, tag_value=None):
 
 def create_gp3_iops_alarms(region, sns_topic_arn, iops_threshold, use_tags=False, tag_key=None, tag_value=None):
     """为所有 GP3 卷创建 IOPS 监控告警"""
-    ec2_client = boto3.client('ec2', region_name=region)
-    cloudwatch_client = boto3.client('cloudwatch', region_name=region)
+    ec2_client = get_client('ec2', region)
+    cloudwatch_client = get_client('cloudwatch', region)
     
     # 获取所有 GP3 卷
     gp3_volumes = get_gp3_volumes(ec2_client, use_tags, tag_key, tag_value)
@@ -4,18 +4,39 @@ AWS 工具脚本配置文件
 """
 
 import os
+import threading
 
-# 默认输出目录
-DEFAULT_OUTPUT_DIR = "/Users/rj/SyncSpace/WorkSpace/aws_tool_scripts/output"
+import boto3
+from botocore.config import Config
+
+# 默认输出目录（可通过环境变量 AWS_TOOLS_OUTPUT_DIR 覆盖）
+DEFAULT_OUTPUT_DIR = os.getenv('AWS_TOOLS_OUTPUT_DIR', "/Users/rj/SyncSpace/WorkSpace/aws_tool_scripts/output")
+
+# 本地实例库存快照的最大复用时间（秒），0 表示每次都实时调用 describe_instances
+INVENTORY_MAX_AGE = int(os.getenv('INVENTORY_MAX_AGE', '0'))
 
 # 默认 AWS 区域
 DEFAULT_REGIONS = [
     'us-east-1',
-    'ap-southeast-1', 
+    'ap-southeast-1',
     'ap-northeast-1',
     'eu-west-1'
 ]
 
+# boto3 客户端公共配置：加大连接池，开启自适应重试和 TCP keepalive
+BOTO_CONFIG = Config(
+    max_pool_connections=50,
+    retries={'max_attempts': 10, 'mode': 'adaptive'},
+    tcp_keepalive=True,
+    connect_timeout=5,
+    read_timeout=60
+)
+
+# 进程内的 Session / 客户端缓存，键分别为 profile 和 (profile, region, service)
+_sessions = {}
+_clients = {}
+_cache_lock = threading.Lock()
+
 # 确保输出目录存在
 def ensure_output_dir():
     """确保输出目录存在"""
@@ -28,4 +49,56 @@ def ensure_output_dir():
 def get_output_path(filename):
     """获取完整的输出文件路径"""
     output_dir = ensure_output_dir()
-    return os.path.join(output_dir, filename)
\ No newline at end of file
+    return os.path.join(output_dir, filename)
+
+# 获取共享的 boto3 Session
+def get_session(profile=None):
+    """获取指定 profile 的 boto3 Session，同一 profile 在进程内只创建一次"""
+    session = _sessions.get(profile)
+    if session is None:
+        with _cache_lock:
+            session = _sessions.get(profile)
+            if session is None:
+                session = boto3.Session(profile_name=profile) if profile else boto3.Session()
+                _sessions[profile] = session
+    return session
+
+# 注册预先构造的 Session
+def register_session(name, session):
+    """
+    注册一个预先构造的 boto3 Session（如 AssumeRole 得到的跨账号会话），
+    之后可以把 name 当作 profile 传给 get_session / get_client 以及各脚本的 profile 参数。
+    """
+    with _cache_lock:
+        _sessions[name] = session
+
+# 获取共享的 boto3 客户端
+def get_client(service, region=None, profile=None):
+    """
+    获取按 (profile, region, service) 缓存的 boto3 客户端（线程安全）。
+
+    客户端的创建和 endpoint 解析开销较大，脚本和 Lambda 应统一通过此函数获取客户端，
+    botocore 客户端本身可在多线程间共享使用。
+    """
+    key = (profile, region, service)
+    client = _clients.get(key)
+    if client is None:
+        with _cache_lock:
+            client = _clients.get(key)
+            if client is None:
+                session = _sessions.get(profile)
+                if session is None:
+                    session = boto3.Session(profile_name=profile) if profile else boto3.Session()
+                    _sessions[profile] = session
+                client = session.client(service, region_name=region, config=BOTO_CONFIG)
+                _clients[key] = client
+    return client
+
+# 获取区域所属的 ARN 分区
+def get_partition(region):
+    """根据区域返回 ARN 分区：cn-* 为 aws-cn，us-gov-* 为 aws-us-gov，其余为 aws"""
+    if region and region.startswith('cn-'):
+        return 'aws-cn'
+    if region and region.startswith('us-gov-'):
+        return 'aws-us-gov'
+    return 'aws'
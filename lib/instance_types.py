@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+EC2 实例类型规格表（vCPU / 内存 / 架构）
+
+每个区域的 describe_instance_types 结果缓存在进程内，并落盘到 DEFAULT_OUTPUT_DIR，
+默认 7 天内直接复用，避免每次运行都重新分页拉取全部实例类型。
+"""
+
+import json
+import os
+import threading
+import time
+
+from config import get_client, get_output_path
+
+# 规格表磁盘缓存有效期（秒）
+SPEC_CACHE_TTL = 7 * 86400
+
+_tables = {}
+_tables_lock = threading.Lock()
+
+
+def instance_family(instance_type):
+    """实例类型所属的系列，如 m5.large -> m5"""
+    return instance_type.split('.', 1)[0]
+
+
+def _fetch_instance_type_table(region, profile=None):
+    ec2 = get_client('ec2', region, profile)
+    paginator = ec2.get_paginator('describe_instance_types')
+    table = {}
+    for page in paginator.paginate():
+        for item in page['InstanceTypes']:
+            table[item['InstanceType']] = {
+                'vcpus': item['VCpuInfo']['DefaultVCpus'],
+                'memory_mib': item['MemoryInfo']['SizeInMiB'],
+                'architectures': item.get('ProcessorInfo', {}).get('SupportedArchitectures', []),
+                'family': instance_family(item['InstanceType'])
+            }
+    return table
+
+
+def get_instance_type_table(region, profile=None, max_age=SPEC_CACHE_TTL):
+    """
+    获取区域内所有实例类型的规格表 {实例类型: {'vcpus', 'memory_mib', 'architectures', 'family'}}。
+
+    优先使用进程内缓存，其次使用未过期的磁盘缓存，最后才调用 describe_instance_types。
+    """
+    key = (profile, region)
+    with _tables_lock:
+        table = _tables.get(key)
+        if table is not None:
+            return table
+
+        path = get_output_path(f"instance_types_{profile or 'default'}_{region}.json")
+        if os.path.exists(path) and time.time() - os.path.getmtime(path) < max_age:
+            with open(path, encoding='utf-8') as f:
+                table = json.load(f)
+        else:
+            table = _fetch_instance_type_table(region, profile)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(table, f)
+
+        _tables[key] = table
+        return table
+
+
+def family_members(table, family):
+    """同一系列的实例类型，按 vCPU、内存从小到大排序，返回 [(实例类型, 规格), ...]"""
+    members = [(name, spec) for name, spec in table.items() if spec['family'] == family]
+    members.sort(key=lambda item: (item[1]['vcpus'], item[1]['memory_mib']))
+    return members
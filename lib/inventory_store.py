@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+"""
+本地 EC2 实例库存快照（SQLite）
+
+多个脚本连续运行时共享同一份 describe_instances 结果：快照按区域记录刷新时间，
+读取时只重新扫描超过 max_age 的区域，其余区域直接走本地索引查询。
+
+增量模式：apply_state_change() / apply_events() 把 EventBridge 的
+"EC2 Instance State-change Notification" 事件直接应用到快照上，快照中不存在的实例
+记为待补充，之后只按实例 ID 定向 describe；全量扫描只用于定期对账。
+
+快照文件位于 DEFAULT_OUTPUT_DIR 下，每个 AWS profile 一个文件。
+"""
+
+import json
+import sqlite3
+import time
+from datetime import datetime
+
+from config import INVENTORY_MAX_AGE, get_client, get_output_path
+from region_fanout import fan_out
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS instances (
+    instance_id TEXT PRIMARY KEY,
+    region TEXT NOT NULL,
+    name TEXT,
+    instance_type TEXT,
+    state TEXT,
+    private_ip TEXT,
+    public_ip TEXT,
+    vpc_id TEXT,
+    subnet_id TEXT,
+    availability_zone TEXT,
+    launch_time TEXT,
+    architecture TEXT,
+    platform TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_instances_region_state ON instances (region, state);
+CREATE INDEX IF NOT EXISTS idx_instances_type ON instances (instance_type);
+
+CREATE TABLE IF NOT EXISTS instance_tags (
+    instance_id TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT,
+    PRIMARY KEY (instance_id, key)
+);
+CREATE INDEX IF NOT EXISTS idx_instance_tags_kv ON instance_tags (key, value);
+
+CREATE TABLE IF NOT EXISTS regions (
+    region TEXT PRIMARY KEY,
+    refreshed_at REAL NOT NULL
+);
+
+-- 每个实例最近一次已应用的状态变更事件；pending = 1 表示快照中还没有该实例
+CREATE TABLE IF NOT EXISTS state_events (
+    instance_id TEXT PRIMARY KEY,
+    region TEXT NOT NULL,
+    state TEXT NOT NULL,
+    event_time REAL NOT NULL,
+    pending INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_state_events_pending ON state_events (pending, region);
+
+-- 区域最近一次完成增量同步（事件队列已消费完）的时间
+CREATE TABLE IF NOT EXISTS region_sync (
+    region TEXT PRIMARY KEY,
+    synced_at REAL NOT NULL
+);
+"""
+
+STATE_CHANGE_DETAIL_TYPE = 'EC2 Instance State-change Notification'
+
+INSTANCE_COLUMNS = (
+    'instance_id', 'region', 'name', 'instance_type', 'state', 'private_ip', 'public_ip',
+    'vpc_id', 'subnet_id', 'availability_zone', 'launch_time', 'architecture', 'platform'
+)
+
+
+def instance_record(instance, region_name):
+    """把 describe_instances 返回的实例转换为扁平记录（字段与 get_account_info 一致）"""
+    tags = {tag['Key']: tag['Value'] for tag in instance.get('Tags', [])}
+    launch_time = 'N/A'
+    if instance.get('LaunchTime'):
+        launch_time = instance['LaunchTime'].strftime('%Y-%m-%d %H:%M:%S')
+    return {
+        'name': tags.get('Name', 'N/A'),
+        'instance_id': instance['InstanceId'],
+        'instance_type': instance['InstanceType'],
+        'state': instance['State']['Name'],
+        'private_ip': instance.get('PrivateIpAddress', 'N/A'),
+        'public_ip': instance.get('PublicIpAddress', 'N/A'),
+        'vpc_id': instance.get('VpcId', 'N/A'),
+        'subnet_id': instance.get('SubnetId', 'N/A'),
+        'availability_zone': instance.get('Placement', {}).get('AvailabilityZone', 'N/A'),
+        'launch_time': launch_time,
+        'architecture': instance.get('Architecture', 'N/A'),
+        'platform': instance.get('PlatformDetails', 'N/A'),
+        'region': region_name,
+        'tags': tags
+    }
+
+
+def describe_region_instances(region_name, profile=None, filters=None):
+    """分页获取指定区域的全部实例，返回扁平记录列表"""
+    ec2 = get_client('ec2', region_name, profile)
+    paginator = ec2.get_paginator('describe_instances')
+    records = []
+    for page in paginator.paginate(Filters=filters or []):
+        for reservation in page['Reservations']:
+            for instance in reservation['Instances']:
+                records.append(instance_record(instance, region_name))
+    return records
+
+
+def _parse_event_time(value):
+    """把事件中的 ISO 8601 时间（如 2025-03-13T08:00:00Z）转换为时间戳"""
+    if not value:
+        return time.time()
+    return datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp()
+
+
+def parse_state_change_events(event):
+    """
+    从事件中提取实例状态变更，返回 [(instance_id, region, state, event_time), ...]。
+
+    支持 EventBridge 原始事件，以及经 SNS（Records[].Sns.Message）或
+    SQS（Records[].body，可再嵌套 SNS 通知）转发的事件；其他事件被忽略。
+    """
+    if isinstance(event, str):
+        try:
+            event = json.loads(event)
+        except ValueError:
+            return []
+    if not isinstance(event, dict):
+        return []
+
+    if 'Records' in event:
+        changes = []
+        for record in event['Records']:
+            if 'Sns' in record:
+                changes.extend(parse_state_change_events(record['Sns'].get('Message')))
+            elif 'body' in record:
+                changes.extend(parse_state_change_events(record['body']))
+        return changes
+    # SNS 通知投递到 SQS 时，原始消息在 Message 字段中
+    if event.get('Type') == 'Notification' and 'Message' in event:
+        return parse_state_change_events(event['Message'])
+
+    detail = event.get('detail') or {}
+    if event.get('detail-type') != STATE_CHANGE_DETAIL_TYPE or 'instance-id' not in detail:
+        return []
+    return [(detail['instance-id'], event.get('region'), detail['state'], _parse_event_time(event.get('time')))]
+
+
+class InventoryStore:
+    """EC2 实例库存快照"""
+
+    def __init__(self, path=None, profile=None):
+        self.path = path or get_output_path(f"inventory_{profile or 'default'}.db")
+        self.profile = profile
+        self.conn = sqlite3.connect(self.path)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def sweep_age(self, region):
+        """返回区域最近一次全量扫描距今的秒数，从未扫描过返回 None"""
+        row = self.conn.execute('SELECT refreshed_at FROM regions WHERE region = ?', (region,)).fetchone()
+        return None if row is None else time.time() - row['refreshed_at']
+
+    def region_age(self, region):
+        """返回区域快照的年龄（秒，取全量扫描和增量同步中较新者），从未扫描过返回 None"""
+        sweep_age = self.sweep_age(region)
+        if sweep_age is None:
+            return None
+        row = self.conn.execute('SELECT synced_at FROM region_sync WHERE region = ?', (region,)).fetchone()
+        return sweep_age if row is None else min(sweep_age, time.time() - row['synced_at'])
+
+    def mark_synced(self, regions, synced_at=None):
+        """记录区域已完成一次增量同步（事件已全部应用）"""
+        synced_at = synced_at or time.time()
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO region_sync (region, synced_at) VALUES (?, ?)',
+                [(region, synced_at) for region in regions]
+            )
+
+    def stale_regions(self, regions, max_age):
+        """返回快照不存在或超过 max_age 秒的区域"""
+        stale = []
+        for region in regions:
+            age = self.region_age(region)
+            if age is None or age > max_age:
+                stale.append(region)
+        return stale
+
+    def replace_region(self, region, records, refreshed_at=None):
+        """用一次完整扫描的结果替换区域快照（refreshed_at 应为扫描开始时间）"""
+        refreshed_at = refreshed_at or time.time()
+        with self.conn:
+            self.conn.execute(
+                'DELETE FROM instance_tags WHERE instance_id IN (SELECT instance_id FROM instances WHERE region = ?)',
+                (region,)
+            )
+            self.conn.execute('DELETE FROM instances WHERE region = ?', (region,))
+            self._upsert(records)
+            # 扫描开始前的事件已经体现在扫描结果中
+            self.conn.execute('DELETE FROM state_events WHERE region = ? AND event_time < ?', (region, refreshed_at))
+            self.conn.execute(
+                'UPDATE state_events SET pending = 0 WHERE region = ? AND instance_id IN '
+                '(SELECT instance_id FROM instances WHERE region = ?)',
+                (region, region)
+            )
+            self.conn.execute(
+                'INSERT OR REPLACE INTO regions (region, refreshed_at) VALUES (?, ?)',
+                (region, refreshed_at)
+            )
+
+    def apply_state_change(self, instance_id, region, state, event_time):
+        """
+        把一条实例状态变更应用到快照上。
+
+        早于该区域最近一次全量扫描、或早于该实例已应用事件的乱序事件会被丢弃。
+
+        Returns:
+            bool: 事件是否被应用
+        """
+        row = self.conn.execute('SELECT refreshed_at FROM regions WHERE region = ?', (region,)).fetchone()
+        if row is not None and event_time < row['refreshed_at']:
+            return False
+        row = self.conn.execute('SELECT event_time FROM state_events WHERE instance_id = ?', (instance_id,)).fetchone()
+        if row is not None and event_time <= row['event_time']:
+            return False
+
+        with self.conn:
+            updated = self.conn.execute(
+                'UPDATE instances SET state = ? WHERE instance_id = ?', (state, instance_id)
+            ).rowcount
+            self.conn.execute(
+                'INSERT OR REPLACE INTO state_events (instance_id, region, state, event_time, pending) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (instance_id, region, state, event_time, 0 if updated else 1)
+            )
+        return True
+
+    def apply_events(self, events):
+        """批量应用事件（格式见 parse_state_change_events），返回已应用的条数"""
+        applied = 0
+        for event in events:
+            for instance_id, region, state, event_time in parse_state_change_events(event):
+                if self.apply_state_change(instance_id, region, state, event_time):
+                    applied += 1
+        return applied
+
+    def pending_instances(self):
+        """返回快照中尚不存在、需要补充 describe 的实例 {region: [instance_id, ...]}"""
+        pending = {}
+        for row in self.conn.execute('SELECT region, instance_id FROM state_events WHERE pending = 1'):
+            pending.setdefault(row['region'], []).append(row['instance_id'])
+        return pending
+
+    def refresh_instances(self, region, instance_ids):
+        """按实例 ID 定向 describe 并写入快照（用于补充新实例），返回写入的记录数"""
+        records = []
+        for start in range(0, len(instance_ids), 200):
+            # 使用 instance-id 过滤器而非 InstanceIds，已不存在的实例不会导致整批报错
+            chunk = instance_ids[start:start + 200]
+            records.extend(describe_region_instances(
+                region, self.profile, [{'Name': 'instance-id', 'Values': chunk}]
+            ))
+        with self.conn:
+            self._upsert(records)
+            self.conn.executemany(
+                'UPDATE state_events SET pending = 0 WHERE instance_id = ?',
+                [(instance_id,) for instance_id in instance_ids]
+            )
+        return len(records)
+
+    def _upsert(self, records):
+        placeholders = ', '.join('?' for _ in INSTANCE_COLUMNS)
+        self.conn.executemany(
+            f"INSERT OR REPLACE INTO instances ({', '.join(INSTANCE_COLUMNS)}) VALUES ({placeholders})",
+            [tuple(record[col] for col in INSTANCE_COLUMNS) for record in records]
+        )
+        self.conn.executemany(
+            'DELETE FROM instance_tags WHERE instance_id = ?',
+            [(record['instance_id'],) for record in records]
+        )
+        self.conn.executemany(
+            'INSERT INTO instance_tags (instance_id, key, value) VALUES (?, ?, ?)',
+            [(record['instance_id'], key, value) for record in records for key, value in record['tags'].items()]
+        )
+
+    def query(self, regions=None, states=None, tags=None, instance_types=None):
+        """
+        按条件查询快照中的实例。
+
+        Args:
+            regions: 区域列表
+            states: 实例状态列表（如 ['running']）
+            tags: {标签键: 标签值} 字典，值为 None 时只要求存在该标签键
+            instance_types: 实例类型列表
+
+        Returns:
+            list: 扁平实例记录（含 tags 字典）
+        """
+        where, params = [], []
+        for column, values in (('region', regions), ('state', states), ('instance_type', instance_types)):
+            if values:
+                where.append(f"i.{column} IN ({', '.join('?' for _ in values)})")
+                params.extend(values)
+        for key, value in (tags or {}).items():
+            if value is None:
+                where.append('EXISTS (SELECT 1 FROM instance_tags t WHERE t.instance_id = i.instance_id AND t.key = ?)')
+                params.append(key)
+            else:
+                where.append(
+                    'EXISTS (SELECT 1 FROM instance_tags t WHERE t.instance_id = i.instance_id AND t.key = ? AND t.value = ?)'
+                )
+                params.extend([key, value])
+
+        sql = f"SELECT {', '.join('i.' + col for col in INSTANCE_COLUMNS)} FROM instances i"
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        records = {row['instance_id']: dict(row, tags={}) for row in self.conn.execute(sql, params)}
+
+        # 分批回填标签，避免超出 SQLite 的变量个数上限
+        ids = list(records)
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            rows = self.conn.execute(
+                f"SELECT instance_id, key, value FROM instance_tags WHERE instance_id IN ({', '.join('?' for _ in chunk)})",
+                chunk
+            )
+            for row in rows:
+                records[row['instance_id']]['tags'][row['key']] = row['value']
+        return list(records.values())
+
+    def refresh(self, regions, max_age=0):
+        """并发重新扫描过期区域（增量同步也算作新鲜），返回实际刷新的区域列表"""
+        return self._sweep(self.stale_regions(regions, max_age))
+
+    def reconcile(self, regions, max_sweep_age):
+        """对距上次全量扫描超过 max_sweep_age 秒的区域做全量对账，返回对账的区域列表"""
+        due = []
+        for region in regions:
+            age = self.sweep_age(region)
+            if age is None or age > max_sweep_age:
+                due.append(region)
+        return self._sweep(due)
+
+    def _sweep(self, regions):
+        refreshed = []
+        started_at = time.time()
+        for region, records, error in fan_out(lambda r: describe_region_instances(r, self.profile), regions):
+            if error is not None:
+                print(f"区域 {region} 刷新库存失败: {error}")
+                continue
+            self.replace_region(region, records, started_at)
+            refreshed.append(region)
+        return refreshed
+
+
+def sync_from_queue(store, queue_url, queue_region=None, max_messages=100000):
+    """
+    消费 SQS 队列中的实例状态变更事件并应用到快照，返回 (收到的消息数, 应用的变更数)。
+
+    队列由 EventBridge 规则（detail-type 为 EC2 Instance State-change Notification）直接投递，
+    或订阅 ec2_alarm_creator 使用的 SNS 主题。消息应用后即从队列删除。
+    """
+    sqs = get_client('sqs', queue_region, store.profile)
+    received = applied = 0
+    while received < max_messages:
+        response = sqs.receive_message(QueueUrl=queue_url, MaxNumberOfMessages=10, WaitTimeSeconds=1)
+        messages = response.get('Messages', [])
+        if not messages:
+            break
+        received += len(messages)
+        applied += store.apply_events(message['Body'] for message in messages)
+        sqs.delete_message_batch(
+            QueueUrl=queue_url,
+            Entries=[{'Id': str(i), 'ReceiptHandle': message['ReceiptHandle']} for i, message in enumerate(messages)]
+        )
+    return received, applied
+
+
+def _build_filters(states=None, tags=None, instance_types=None):
+    """把查询条件转换为 describe_instances 的服务端 Filters"""
+    filters = []
+    if states:
+        filters.append({'Name': 'instance-state-name', 'Values': list(states)})
+    if instance_types:
+        filters.append({'Name': 'instance-type', 'Values': list(instance_types)})
+    for key, value in (tags or {}).items():
+        if value is None:
+            filters.append({'Name': 'tag-key', 'Values': [key]})
+        else:
+            filters.append({'Name': f'tag:{key}', 'Values': [value]})
+    return filters
+
+
+def get_instances(regions, max_age=None, profile=None, states=None, tags=None, instance_types=None):
+    """
+    获取实例记录：max_age > 0 时复用本地快照（只刷新过期区域），否则实时 describe。
+
+    Args:
+        regions: 区域列表
+        max_age: 快照最大复用时间（秒），默认取 config.INVENTORY_MAX_AGE
+        profile: AWS profile
+        states / tags / instance_types: 过滤条件，含义同 InventoryStore.query()
+    """
+    if max_age is None:
+        max_age = INVENTORY_MAX_AGE
+
+    if max_age <= 0:
+        filters = _build_filters(states, tags, instance_types)
+        records = []
+        for region, region_records, error in fan_out(
+                lambda r: describe_region_instances(r, profile, filters), regions):
+            if error is not None:
+                print(f"区域 {region} 获取实例失败: {error}")
+                continue
+            records.extend(region_records)
+        return records
+
+    with InventoryStore(profile=profile) as store:
+        store.refresh(regions, max_age)
+        return store.query(regions=regions, states=states, tags=tags, instance_types=instance_types)
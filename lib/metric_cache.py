@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+CloudWatch 指标数据点本地缓存（SQLite）
+
+记录每条指标序列（按 MetricStat 区分）已缓存的连续时间范围，再次查询时只对缺口
+（通常是上次运行之后的新时间段）调用 GetMetricData，缺口相同的序列合并成同一批请求。
+最近尚未稳定的数据点每次都重新获取，不写入缓存。
+"""
+
+import hashlib
+import json
+import sqlite3
+import time
+from array import array
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from config import get_output_path
+from metrics import MetricSeries, get_metric_data
+
+# 最近这段时间内的数据点可能还会被 CloudWatch 补齐，不写入缓存（秒）
+SETTLE_SECONDS = 900
+
+# 缓存数据点保留时间（秒），与 CloudWatch 1 小时粒度数据的保留期一致
+RETENTION_SECONDS = 455 * 86400
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS datapoints (
+    series_key TEXT NOT NULL,
+    ts REAL NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (series_key, ts)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS coverage (
+    series_key TEXT PRIMARY KEY,
+    start_ts REAL NOT NULL,
+    end_ts REAL NOT NULL
+);
+"""
+
+
+def series_key(stat):
+    """MetricStat 的稳定标识（命名空间、指标、维度、统计方式和粒度都相同才视为同一序列）"""
+    canonical = dict(stat, Metric=dict(
+        stat['Metric'], Dimensions=sorted(stat['Metric'].get('Dimensions', []), key=lambda d: d['Name'])
+    ))
+    return hashlib.sha1(json.dumps(canonical, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _to_datetime(ts):
+    return datetime.fromtimestamp(ts, timezone.utc)
+
+
+class MetricCache:
+    """带缺口补齐的 GetMetricData 缓存，get_metric_data() 与 metrics.get_metric_data 用法一致"""
+
+    def __init__(self, path=None):
+        self.path = path or get_output_path('metric_cache.db')
+        self.conn = sqlite3.connect(self.path)
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    def _coverage(self, key):
+        row = self.conn.execute('SELECT start_ts, end_ts FROM coverage WHERE series_key = ?', (key,)).fetchone()
+        return row if row else None
+
+    def get_metric_data(self, cloudwatch, stats, start_time, end_time):
+        """
+        获取指标数据，已缓存的时间段直接读本地，只请求缺口部分。
+
+        Args:
+            cloudwatch: CloudWatch 客户端
+            stats: {key: MetricStat} 字典
+            start_time / end_time: 查询时间范围（datetime）
+
+        Returns:
+            dict: {key: MetricSeries}
+        """
+        start = start_time.timestamp()
+        end = end_time.timestamp()
+        keys = {key: series_key(stat) for key, stat in stats.items()}
+
+        # 1. 计算每条序列缺失的时间段，缺口相同的序列归为一组
+        #    起点按粒度对齐，保证每次运行得到的数据点时间戳一致
+        gaps = defaultdict(list)
+        aligned_start = {}
+        stable_end = {}
+        for key, stat in stats.items():
+            period = stat['Period']
+            aligned_start[key] = start // period * period
+            # 只有完整且已稳定的周期才写入缓存
+            stable_end[key] = max(aligned_start[key], (end - SETTLE_SECONDS) // period * period)
+            coverage = self._coverage(keys[key])
+            if coverage is None or coverage[1] < aligned_start[key] or coverage[0] > stable_end[key]:
+                gaps[(aligned_start[key], end)].append(key)
+                continue
+            if aligned_start[key] < coverage[0]:
+                gaps[(aligned_start[key], coverage[0])].append(key)
+            gaps[(coverage[1], end)].append(key)
+
+        # 2. 按组批量请求缺口数据
+        fresh = defaultdict(list)
+        for (gap_start, gap_end), group in gaps.items():
+            if gap_end <= gap_start:
+                continue
+            fetched = get_metric_data(
+                cloudwatch, {key: stats[key] for key in group}, _to_datetime(gap_start), _to_datetime(gap_end)
+            )
+            for key, series in fetched.items():
+                fresh[key].extend(zip(series.timestamps, series.values))
+
+        # 3. 写入已稳定的数据点并扩展覆盖范围
+        with self.conn:
+            for key in stats:
+                key_start, limit = aligned_start[key], stable_end[key]
+                self.conn.executemany(
+                    'INSERT OR REPLACE INTO datapoints (series_key, ts, value) VALUES (?, ?, ?)',
+                    [(keys[key], ts, value) for ts, value in fresh.get(key, []) if ts < limit]
+                )
+                coverage = self._coverage(keys[key])
+                if coverage is None or coverage[1] < key_start or coverage[0] > limit:
+                    new_start, new_end = key_start, limit
+                else:
+                    new_start, new_end = min(key_start, coverage[0]), max(limit, coverage[1])
+                self.conn.execute(
+                    'INSERT OR REPLACE INTO coverage (series_key, start_ts, end_ts) VALUES (?, ?, ?)',
+                    (keys[key], new_start, new_end)
+                )
+
+        # 4. 合并缓存数据点和尚未稳定的新数据点
+        result = {}
+        for key in stats:
+            points = dict(self.conn.execute(
+                'SELECT ts, value FROM datapoints WHERE series_key = ? AND ts >= ? AND ts < ? ORDER BY ts',
+                (keys[key], start, end)
+            ).fetchall())
+            for ts, value in fresh.get(key, []):
+                if start <= ts < end:
+                    points[ts] = value
+            ordered = sorted(points.items())
+            result[key] = MetricSeries(array('d', (ts for ts, _ in ordered)), array('d', (v for _, v in ordered)))
+        return result
+
+    def prune(self, retention=RETENTION_SECONDS):
+        """删除超过保留期的数据点，并收缩覆盖范围"""
+        cutoff = time.time() - retention
+        with self.conn:
+            self.conn.execute('DELETE FROM datapoints WHERE ts < ?', (cutoff,))
+            self.conn.execute('DELETE FROM coverage WHERE end_ts < ?', (cutoff,))
+            self.conn.execute('UPDATE coverage SET start_ts = ? WHERE start_ts < ?', (cutoff, cutoff))
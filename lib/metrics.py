@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+CloudWatch GetMetricData 批量读取
+
+把大量指标查询按每请求 500 条打包，分页读取，结果以紧凑的 array('d') 保存，
+替代逐个实例调用 get_metric_statistics。
+"""
+
+import math
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+
+# 单次 GetMetricData 请求最多包含的查询数
+MAX_QUERIES_PER_REQUEST = 500
+
+# 单条指标的时间序列：timestamps 为 UTC 时间戳（秒），与 values 一一对应并按时间升序
+MetricSeries = namedtuple('MetricSeries', ['timestamps', 'values'])
+
+
+def metric_stat(namespace, metric_name, dimensions, stat, period):
+    """构造 GetMetricData 的 MetricStat；dimensions 为 {名称: 值} 字典"""
+    return {
+        'Metric': {
+            'Namespace': namespace,
+            'MetricName': metric_name,
+            'Dimensions': [{'Name': name, 'Value': value} for name, value in dimensions.items()]
+        },
+        'Period': period,
+        'Stat': stat
+    }
+
+
+def get_metric_data(cloudwatch, stats, start_time, end_time):
+    """
+    批量获取指标数据。
+
+    Args:
+        cloudwatch: CloudWatch 客户端
+        stats: {key: MetricStat} 字典，key 可以是任意可哈希对象（如 (实例ID, 指标名)）
+        start_time / end_time: 查询时间范围（datetime）
+
+    Returns:
+        dict: {key: MetricSeries}，没有数据点的 key 对应空序列
+    """
+    keys = list(stats)
+    series = {key: MetricSeries(array('d'), array('d')) for key in keys}
+    paginator = cloudwatch.get_paginator('get_metric_data')
+
+    for start in range(0, len(keys), MAX_QUERIES_PER_REQUEST):
+        chunk = keys[start:start + MAX_QUERIES_PER_REQUEST]
+        # 查询 ID 只允许字母数字，按序号生成并映射回调用方的 key
+        id_to_key = {f'q{i}': key for i, key in enumerate(chunk)}
+        queries = [
+            {'Id': query_id, 'MetricStat': stats[key], 'ReturnData': True}
+            for query_id, key in id_to_key.items()
+        ]
+        for page in paginator.paginate(
+                MetricDataQueries=queries,
+                StartTime=start_time,
+                EndTime=end_time,
+                ScanBy='TimestampAscending'):
+            for result in page['MetricDataResults']:
+                target = series[id_to_key[result['Id']]]
+                target.timestamps.extend(ts.timestamp() for ts in result['Timestamps'])
+                target.values.extend(result['Values'])
+    return series
+
+
+def series_mean(values):
+    """序列均值，没有数据点时返回 None"""
+    return sum(values) / len(values) if values else None
+
+
+def window_values(series, since):
+    """取序列中时间戳 >= since 的部分（序列按时间升序，二分定位后切片）"""
+    return series.values[bisect_left(series.timestamps, since):]
+
+
+def percentile(sorted_values, pct):
+    """已排序序列的百分位数（线性插值），没有数据点时返回 None"""
+    if not sorted_values:
+        return None
+    rank = (len(sorted_values) - 1) * pct / 100.0
+    low = math.floor(rank)
+    high = min(low + 1, len(sorted_values) - 1)
+    return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (rank - low)
+
+
+def summarize(values, percentiles=(50, 95, 99)):
+    """一次排序后计算多个百分位数和最大值，返回 {'p50': ..., 'p95': ..., 'max': ...}"""
+    ordered = sorted(values)
+    summary = {f'p{pct}': percentile(ordered, pct) for pct in percentiles}
+    summary['max'] = ordered[-1] if ordered else None
+    return summary
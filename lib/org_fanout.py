@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+组织内多账号 × 多区域并发扫描
+
+- list_organization_accounts(): 通过 Organizations 列出所有 ACTIVE 账号
+- get_account_profile(): 在目标账号中 AssumeRole，得到自动续期的会话并注册到 config 的客户端缓存，
+  返回的名称可以像 profile 一样传给 get_client 及各脚本中接受 profile 参数的函数
+- fan_out_accounts(): 在 账号 × 区域 上并发执行回调，按完成顺序产出结果
+
+同一进程内每个账号只 AssumeRole 一次，临时凭证到期前由 botocore 自动刷新。
+"""
+
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import boto3
+import botocore.session
+from botocore.credentials import RefreshableCredentials
+
+from config import get_client, get_partition, get_session, register_session
+from region_fanout import AdaptiveLimiter, call_with_backoff, get_enabled_regions
+
+# 各成员账号中被扫描脚本扮演的角色（Organizations 创建账号时默认生成此角色）
+DEFAULT_ROLE_NAME = os.getenv('ORG_ROLE_NAME', 'OrganizationAccountAccessRole')
+
+# AssumeRole 会话名称和有效期（秒）
+ROLE_SESSION_NAME = 'aws-tool-scripts'
+ROLE_SESSION_DURATION = 3600
+
+_account_profiles = {}
+_caller_accounts = {}
+_account_lock = threading.Lock()
+
+
+def list_organization_accounts(profile=None):
+    """列出组织内所有 ACTIVE 状态的账号，返回 [{'id', 'name'}, ...]（需在管理账号或委派管理员账号中执行）"""
+    organizations = get_client('organizations', None, profile)
+    accounts = []
+    for page in organizations.get_paginator('list_accounts').paginate():
+        for account in page['Accounts']:
+            if account['Status'] == 'ACTIVE':
+                accounts.append({'id': account['Id'], 'name': account['Name']})
+    return sorted(accounts, key=lambda account: account['id'])
+
+
+def get_caller_account(profile=None):
+    """当前凭证所属的账号 ID（按 profile 缓存）"""
+    if profile not in _caller_accounts:
+        _caller_accounts[profile] = get_client('sts', None, profile).get_caller_identity()['Account']
+    return _caller_accounts[profile]
+
+
+def _assume_role_refresher(role_arn, profile=None):
+    """返回给 RefreshableCredentials 使用的刷新函数，每次调用重新 AssumeRole"""
+    def refresh():
+        credentials = get_client('sts', None, profile).assume_role(
+            RoleArn=role_arn,
+            RoleSessionName=ROLE_SESSION_NAME,
+            DurationSeconds=ROLE_SESSION_DURATION
+        )['Credentials']
+        return {
+            'access_key': credentials['AccessKeyId'],
+            'secret_key': credentials['SecretAccessKey'],
+            'token': credentials['SessionToken'],
+            'expiry_time': credentials['Expiration'].isoformat()
+        }
+    return refresh
+
+
+def get_account_profile(account_id, role_name=DEFAULT_ROLE_NAME, profile=None):
+    """
+    获取目标账号的会话名称（可作为 profile 传给 get_client）。
+
+    目标账号就是当前账号时直接返回 profile；否则 AssumeRole 一次并缓存，
+    凭证在到期前 15 分钟内由 botocore 自动刷新，长时间运行也不会过期。
+    """
+    if account_id == get_caller_account(profile):
+        return profile
+
+    name = f"{profile or 'default'}:{account_id}:{role_name}"
+    with _account_lock:
+        if name in _account_profiles:
+            return name
+
+        base_session = get_session(profile)
+        partition = get_partition(base_session.region_name)
+        refresh = _assume_role_refresher(f"arn:{partition}:iam::{account_id}:role/{role_name}", profile)
+        credentials = RefreshableCredentials.create_from_metadata(
+            metadata=refresh(),
+            refresh_using=refresh,
+            method='sts-assume-role'
+        )
+        core_session = botocore.session.get_session()
+        core_session._credentials = credentials
+        core_session.set_config_variable('region', base_session.region_name)
+
+        register_session(name, boto3.Session(botocore_session=core_session))
+        _account_profiles[name] = account_id
+        return name
+
+
+def fan_out_accounts(func, accounts, regions=None, role_name=DEFAULT_ROLE_NAME, max_workers=32,
+                     initial_concurrency=8, max_attempts=5, profile=None):
+    """
+    在 账号 × 区域 上并发执行 func(region, account_profile)，按完成顺序产出结果。
+
+    所有任务共用一个大小为 max_workers 的线程池；每个账号有独立的自适应限流器
+    （API 限流按账号和区域计算，一个账号被限流不会拖慢其他账号）。
+
+    Args:
+        func: 针对单个区域的回调，第二个参数是 get_account_profile() 返回的会话名称
+        accounts: 账号 ID 列表
+        regions: 区域列表，默认在每个账号中分别获取已启用的区域
+        role_name: 在成员账号中扮演的角色名
+        max_workers: 线程池大小
+        initial_concurrency: 每个账号的初始并发度
+        max_attempts: 遇到限流时的最大尝试次数
+        profile: 调用 AssumeRole 使用的 AWS profile
+
+    Yields:
+        tuple: (account_id, region, result, error)；AssumeRole 或获取区域列表失败时 region 为 None
+    """
+    if not accounts:
+        return
+
+    def prepare(account_id):
+        account_profile = get_account_profile(account_id, role_name, profile)
+        account_regions = regions or get_enabled_regions(profile=account_profile)
+        return account_profile, account_regions
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        pending = {executor.submit(prepare, account_id): (account_id, None) for account_id in accounts}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                account_id, region = pending.pop(future)
+                if region is None:
+                    # 账号准备完成：为该账号的每个区域提交任务
+                    try:
+                        account_profile, account_regions = future.result()
+                    except Exception as e:
+                        yield account_id, None, None, e
+                        continue
+                    limiter = AdaptiveLimiter(initial=initial_concurrency, maximum=max_workers)
+                    for account_region in account_regions:
+                        task = executor.submit(
+                            call_with_backoff, func, account_region, account_profile,
+                            limiter=limiter, max_attempts=max_attempts
+                        )
+                        pending[task] = (account_id, account_region)
+                    continue
+                try:
+                    yield account_id, region, future.result(), None
+                except Exception as e:
+                    yield account_id, region, None, e
+    finally:
+        # 调用方提前结束迭代时取消尚未开始的任务
+        executor.shutdown(wait=False, cancel_futures=True)
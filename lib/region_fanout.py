@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+多区域并发扫描工具
+
+- get_enabled_regions(): 通过 describe_regions 的 OptInStatus 预先跳过未启用的区域
+- AdaptiveLimiter: 根据限流情况动态调整并发度（AIMD：成功缓慢加，限流减半）
+- fan_out(): 在所有区域上并发执行回调，按完成顺序逐个产出结果
+"""
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from botocore.exceptions import ClientError
+
+from config import get_client
+
+# 视为限流的错误码
+THROTTLING_ERROR_CODES = {
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestThrottled',
+    'RequestThrottledException',
+    'TooManyRequestsException',
+    'RequestLimitExceeded',
+    'SlowDown',
+    'PriorRequestNotComplete',
+    'ProvisionedThroughputExceededException',
+}
+
+# 区域 OptInStatus 中表示已启用的值
+ENABLED_OPT_IN_STATUSES = ('opt-in-not-required', 'opted-in')
+
+
+def is_throttling_error(error):
+    """判断异常是否为 AWS 限流错误"""
+    if isinstance(error, ClientError):
+        return error.response.get('Error', {}).get('Code') in THROTTLING_ERROR_CODES
+    return False
+
+
+def get_enabled_regions(service='ec2', profile=None, region=None):
+    """
+    获取当前账号已启用的区域列表。
+
+    使用 AllRegions=True 拉取全部区域，再按 OptInStatus 过滤掉 not-opted-in 的区域，
+    避免后续对这些区域发起注定失败（OptInRequired / AuthFailure）的调用。
+    """
+    ec2 = get_client(service, region, profile)
+    response = ec2.describe_regions(AllRegions=True)
+    return sorted(
+        item['RegionName'] for item in response['Regions']
+        if item.get('OptInStatus', 'opt-in-not-required') in ENABLED_OPT_IN_STATUSES
+    )
+
+
+class AdaptiveLimiter:
+    """
+    动态并发限制器。
+
+    每次成功调用后累计信用，满 limit 次成功则 limit + 1；遇到限流时 limit 减半。
+    limit 始终位于 [minimum, maximum] 区间内。
+    """
+
+    def __init__(self, initial=8, minimum=1, maximum=32):
+        self.minimum = minimum
+        self.maximum = maximum
+        self.limit = max(minimum, min(initial, maximum))
+        self._active = 0
+        self._credit = 0
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        with self._cond:
+            while self._active >= self.limit:
+                self._cond.wait()
+            self._active += 1
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def on_success(self):
+        with self._cond:
+            self._credit += 1
+            if self._credit >= self.limit and self.limit < self.maximum:
+                self.limit += 1
+                self._credit = 0
+                self._cond.notify_all()
+
+    def on_throttle(self):
+        with self._cond:
+            self.limit = max(self.minimum, self.limit // 2)
+            self._credit = 0
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+
+def call_with_backoff(func, *args, limiter=None, max_attempts=5, base_delay=0.5, max_delay=20.0, **kwargs):
+    """
+    调用 func，遇到限流错误时按指数退避（带抖动）重试。
+
+    传入 limiter 时，调用期间占用一个并发名额，并把成功/限流反馈给限制器；
+    退避等待期间不占用名额。非限流异常直接抛出。
+    """
+    attempt = 0
+    while True:
+        attempt += 1
+        if limiter is not None:
+            limiter.acquire()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            if not is_throttling_error(e) or attempt >= max_attempts:
+                raise
+            if limiter is not None:
+                limiter.on_throttle()
+        else:
+            if limiter is not None:
+                limiter.on_success()
+            return result
+        finally:
+            if limiter is not None:
+                limiter.release()
+        delay = min(max_delay, base_delay * (2 ** (attempt - 1)))
+        time.sleep(delay * random.uniform(0.5, 1.0))
+
+
+def fan_out(func, regions=None, max_workers=32, initial_concurrency=8, max_attempts=5, profile=None):
+    """
+    在多个区域上并发执行 func(region)，按完成顺序产出 (region, result, error)。
+
+    Args:
+        func: 针对单个区域的回调，限流错误应向上抛出以便调整并发度
+        regions: 区域列表，默认通过 get_enabled_regions() 获取
+        max_workers: 并发上限
+        initial_concurrency: 初始并发度，随后根据限流情况自适应调整
+        max_attempts: 单个区域遇到限流时的最大尝试次数
+        profile: 获取区域列表时使用的 AWS profile
+
+    Yields:
+        tuple: (region, result, error)，成功时 error 为 None，失败时 result 为 None
+    """
+    if regions is None:
+        regions = get_enabled_regions(profile=profile)
+    if not regions:
+        return
+
+    limiter = AdaptiveLimiter(initial=initial_concurrency, maximum=max_workers)
+    executor = ThreadPoolExecutor(max_workers=min(max_workers, len(regions)))
+    try:
+        future_to_region = {
+            executor.submit(call_with_backoff, func, region, limiter=limiter, max_attempts=max_attempts): region
+            for region in regions
+        }
+        for future in as_completed(future_to_region):
+            region = future_to_region[future]
+            try:
+                yield region, future.result(), None
+            except Exception as e:
+                yield region, None, e
+    finally:
+        # 调用方提前结束迭代（如 KeyboardInterrupt / break）时取消尚未开始的区域
+        executor.shutdown(wait=False, cancel_futures=True)
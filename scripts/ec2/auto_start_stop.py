@@ -3,10 +3,38 @@ author: RJ.Wang
 Date: 2025-03-13
 email: wangrenjun@gmail.com
 Description: auto start and stop some EC2 by Lambda.
+
+Schedule mode ({"action": "schedule"}, e.g. from a single 5-minute EventBridge rule):
+instances carry a schedule tag (SCHEDULE_TAG_KEY, default "schedule") in one of two forms:
+    office hours: "Mon-Fri 08:00-20:00 Asia/Shanghai"  (multiple windows separated by ";")
+    cron:         "start=0 8 * * 1-5; stop=0 20 * * 1-5; tz=Asia/Shanghai"
+All schedules are evaluated against one inventory pass per region, then the start set
+and stop set are issued as batched calls.
 """
 import boto3
 import os
+import sys
+import time
 import logging
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from botocore.exceptions import ClientError
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib'))
+try:
+    from config import INVENTORY_MAX_AGE, get_client
+    from inventory_store import get_instances
+except ImportError:
+    # Lambda 单文件部署时没有 lib/，退化为进程内缓存的客户端，且不使用本地库存快照
+    INVENTORY_MAX_AGE = 0
+    get_instances = None
+    _clients = {}
+
+    def get_client(service, region=None, profile=None):
+        key = (profile, region, service)
+        if key not in _clients:
+            _clients[key] = boto3.client(service, region_name=region)
+        return _clients[key]
 
 # 配置日志
 logging.basicConfig(level=logging.INFO)
@@ -15,86 +43,373 @@ logger = logging.getLogger()
 # 全局变量存储配置
 CONFIG = {}
 
+# 每次 start/stop 调用携带的实例数
+BATCH_SIZE = 100
+
+# 只影响部分实例的错误码：出现时拆分批次，定位并单独记录失败的实例
+PARTIAL_FAILURE_CODES = {
+    'IncorrectInstanceState',
+    'InvalidInstanceID.NotFound',
+    'InvalidInstanceID.Malformed',
+    'UnsupportedOperation',
+    'OperationNotPermitted',
+}
+
+# 各操作需要处理的实例状态，以及操作完成后的目标状态
+ACTION_SOURCE_STATES = {'start': ['stopped'], 'stop': ['pending', 'running']}
+ACTION_TARGET_STATE = {'start': 'running', 'stop': 'stopped'}
+
+# 等待目标状态时的轮询间隔，以及为 Lambda 超时预留的时间（秒）
+WAIT_POLL_INTERVAL = 15
+WAIT_TIME_MARGIN = 30
+
+# cron / 办公时间表达式中的星期名称（cron 约定：0 和 7 都表示周日）
+DAY_NAMES = {'sun': 0, 'mon': 1, 'tue': 2, 'wed': 3, 'thu': 4, 'fri': 5, 'sat': 6}
+
 def load_config():
     """
     加载环境变量配置。
     """
     global CONFIG
+    region = os.getenv('AWS_REGION', 'ap-southeast-1')
     CONFIG = {
-        "region": os.getenv('AWS_REGION', 'ap-southeast-1'),          # 区域
+        "region": region,          # 区域
+        "regions": [r.strip() for r in os.getenv('REGIONS', region).split(',') if r.strip()],  # 需要处理的区域列表
         "tag_key": os.getenv('TAG_KEY', 'autoStartStop'),          # 标签键
-        "tag_value": os.getenv('TAG_VALUE', 'T')             # 标签值
+        "tag_value": os.getenv('TAG_VALUE', 'T'),             # 标签值
+        "wait": os.getenv('WAIT_FOR_STATE', 'false').lower() == 'true',   # 是否等待实例到达目标状态
+        "schedule_tag_key": os.getenv('SCHEDULE_TAG_KEY', 'schedule'),   # 调度标签键
+        "schedule_timezone": os.getenv('SCHEDULE_TIMEZONE', 'UTC'),      # 调度表达式未指定时区时使用的时区
+        "schedule_interval": int(os.getenv('SCHEDULE_INTERVAL', '300'))  # 调度触发间隔（秒），cron 在该窗口内触发即执行
     }
     logger.info(f"Configuration loaded: {CONFIG}")
 
-def get_instance_ids():
+def get_instance_ids(region=None, states=None):
     """
-    获取具有特定标签的实例ID列表。
+    获取具有特定标签的实例ID列表（分页），可按实例状态过滤。
     """
-    ec2 = boto3.client('ec2', region_name=CONFIG["region"])
+    region = region or CONFIG["region"]
+    if INVENTORY_MAX_AGE > 0:
+        # 复用本地库存快照，只在快照过期时重新扫描
+        records = get_instances([region], tags={CONFIG["tag_key"]: CONFIG["tag_value"]}, states=states)
+        instance_ids = [record['instance_id'] for record in records]
+        logger.info(f"Found {len(instance_ids)} instances in {region} (from inventory snapshot): {instance_ids}")
+        return instance_ids
+
+    ec2 = get_client('ec2', region)
     filters = [{'Name': f'tag:{CONFIG["tag_key"]}', 'Values': [CONFIG["tag_value"]]}]
+    if states:
+        filters.append({'Name': 'instance-state-name', 'Values': states})
     logger.debug(f"Filters applied to search for instances: {filters}")
     
     try:
-        instances = ec2.describe_instances(Filters=filters)
-        instance_ids = [
-            instance['InstanceId']
-            for reservation in instances['Reservations']
-            for instance in reservation['Instances']
-        ]
-        logger.info(f"Found instances with IDs: {instance_ids}")
+        instance_ids = []
+        for page in ec2.get_paginator('describe_instances').paginate(Filters=filters):
+            for reservation in page['Reservations']:
+                for instance in reservation['Instances']:
+                    instance_ids.append(instance['InstanceId'])
+        logger.info(f"Found {len(instance_ids)} instances in {region}: {instance_ids}")
         return instance_ids
     except Exception as e:
-        logger.error(f"Failed to retrieve instances. Exception: {e}")
+        logger.error(f"Failed to retrieve instances in {region}. Exception: {e}")
         return []
 
-def manage_instances(instance_ids, action):
+def _apply_action(ec2, action, instance_ids, success, failed):
+    """
+    对一批实例执行 start/stop。整批因个别实例失败时二分拆分重试，
+    最终只把真正失败的实例记入 failed。
+    """
+    try:
+        if action == 'start':
+            ec2.start_instances(InstanceIds=instance_ids)
+        else:
+            ec2.stop_instances(InstanceIds=instance_ids)
+        success.extend(instance_ids)
+        logger.info(f"Successfully requested {action} for {len(instance_ids)} instances: {instance_ids}")
+    except ClientError as e:
+        code = e.response.get('Error', {}).get('Code')
+        if code in PARTIAL_FAILURE_CODES and len(instance_ids) > 1:
+            middle = len(instance_ids) // 2
+            _apply_action(ec2, action, instance_ids[:middle], success, failed)
+            _apply_action(ec2, action, instance_ids[middle:], success, failed)
+            return
+        logger.error(f"Failed to {action} instances {instance_ids}. Exception: {e}")
+        failed.extend(instance_ids)
+    except Exception as e:
+        logger.error(f"Failed to {action} instances {instance_ids}. Exception: {e}")
+        failed.extend(instance_ids)
+
+def manage_instances(instance_ids, action, region=None):
     """
-    启动或停止指定实例，记录成功和失败的实例。
+    批量启动或停止指定实例，记录成功和失败的实例。
     """
     if not instance_ids:
         logger.warning(f"No instances found to {action}. Skipping operation.")
         return {"success": [], "failed": []}
+    if action not in ACTION_TARGET_STATE:
+        logger.error(f"Invalid action: {action}. Must be 'start' or 'stop'.")
+        return {"success": [], "failed": list(instance_ids)}
 
-    ec2 = boto3.client('ec2', region_name=CONFIG["region"])
+    ec2 = get_client('ec2', region or CONFIG["region"])
     success, failed = [], []
     logger.debug(f"Performing '{action}' action on instances: {instance_ids}")
 
-    for instance_id in instance_ids:
-        try:
-            if action == 'start':
-                response = ec2.start_instances(InstanceIds=[instance_id])
-                logger.info(f"Successfully started instance: {instance_id}")
-            elif action == 'stop':
-                response = ec2.stop_instances(InstanceIds=[instance_id])
-                logger.info(f"Successfully stopped instance: {instance_id}")
-            else:
-                logger.error(f"Invalid action: {action}. Must be 'start' or 'stop'.")
-                failed.append(instance_id)
-                continue
-            success.append(instance_id)
-        except Exception as e:
-            logger.error(f"Failed to {action} instance {instance_id}. Exception: {e}")
-            failed.append(instance_id)
+    for start in range(0, len(instance_ids), BATCH_SIZE):
+        _apply_action(ec2, action, instance_ids[start:start + BATCH_SIZE], success, failed)
     
     logger.info(f"Action '{action}' completed. Success: {success}, Failed: {failed}")
     return {"success": success, "failed": failed}
 
+def wait_for_state(instance_ids, target_state, region=None, deadline=None):
+    """
+    轮询等待实例到达目标状态（每轮按 100 个一批调用 describe_instance_status），
+    返回截止时间前仍未到达目标状态的实例。
+    """
+    ec2 = get_client('ec2', region or CONFIG["region"])
+    remaining = set(instance_ids)
+    while remaining:
+        ids = sorted(remaining)
+        for start in range(0, len(ids), 100):
+            response = ec2.describe_instance_status(InstanceIds=ids[start:start + 100], IncludeAllInstances=True)
+            for status in response['InstanceStatuses']:
+                if status['InstanceState']['Name'] == target_state:
+                    remaining.discard(status['InstanceId'])
+        if not remaining:
+            break
+        if deadline is not None and time.time() + WAIT_POLL_INTERVAL > deadline:
+            logger.warning(f"Timed out waiting for {len(remaining)} instances to be {target_state}: {sorted(remaining)}")
+            break
+        time.sleep(WAIT_POLL_INTERVAL)
+    return sorted(remaining)
+
+def _parse_cron_field(field, low, high):
+    """
+    解析单个 cron 字段，支持 *、数字、星期名称、a-b、逗号列表和 /步长。
+    """
+    values = set()
+    for part in field.lower().split(','):
+        step = 1
+        if '/' in part:
+            part, step_text = part.split('/', 1)
+            step = int(step_text)
+        if part in ('*', ''):
+            start, end = low, high
+        elif '-' in part:
+            first, last = part.split('-', 1)
+            start, end = int(DAY_NAMES.get(first, first)), int(DAY_NAMES.get(last, last))
+        else:
+            start = int(DAY_NAMES.get(part, part))
+            end = high if step > 1 else start
+        if start < low or end > high or start > end or step < 1:
+            raise ValueError(f"Invalid cron field: {field}")
+        values.update(range(start, end + 1, step))
+    return values
+
+class CronSchedule:
+    """
+    标准 5 段 cron 表达式（分 时 日 月 星期）。日和星期都受限时按 cron 约定取并集。
+    """
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression must have 5 fields: {expression}")
+        self.minutes = _parse_cron_field(fields[0], 0, 59)
+        self.hours = _parse_cron_field(fields[1], 0, 23)
+        self.days = _parse_cron_field(fields[2], 1, 31)
+        self.months = _parse_cron_field(fields[3], 1, 12)
+        self.weekdays = {day % 7 for day in _parse_cron_field(fields[4], 0, 7)}
+        self.days_restricted = fields[2] != '*'
+        self.weekdays_restricted = fields[4] != '*'
+
+    def matches(self, moment):
+        if moment.minute not in self.minutes or moment.hour not in self.hours or moment.month not in self.months:
+            return False
+        day_ok = moment.day in self.days
+        weekday_ok = (moment.weekday() + 1) % 7 in self.weekdays
+        if self.days_restricted and self.weekdays_restricted:
+            return day_ok or weekday_ok
+        return day_ok and weekday_ok
+
+def _parse_clock(text):
+    hour, minute = text.split(':')
+    return int(hour) * 60 + int(minute)
+
+class Schedule:
+    """
+    实例调度规则，desired_action() 返回当前应执行的 'start' / 'stop' / None。
+
+    - 办公时间：窗口内应运行、窗口外应停止（每次触发都会校正实例状态）
+    - cron：start / stop 表达式在最近一个触发间隔内命中时执行对应操作
+    """
+
+    def __init__(self, value, default_timezone='UTC'):
+        self.value = value
+        self.timezone = ZoneInfo(default_timezone)
+        self.cron = {}
+        self.windows = []
+        if 'start=' in value or 'stop=' in value:
+            for part in value.split(';'):
+                if not part.strip():
+                    continue
+                name, expression = (item.strip() for item in part.split('=', 1))
+                if name == 'tz':
+                    self.timezone = ZoneInfo(expression)
+                elif name in ('start', 'stop'):
+                    self.cron[name] = CronSchedule(expression)
+                else:
+                    raise ValueError(f"Unknown schedule field: {name}")
+        else:
+            for part in value.split(';'):
+                tokens = part.split()
+                if not tokens:
+                    continue
+                if len(tokens) not in (2, 3):
+                    raise ValueError(f"Invalid office-hours window: {part}")
+                days = set(range(7)) if tokens[0].lower() in ('*', 'daily') else \
+                    {day % 7 for day in _parse_cron_field(tokens[0], 0, 7)}
+                begin, end = (_parse_clock(item) for item in tokens[1].split('-'))
+                if len(tokens) == 3:
+                    self.timezone = ZoneInfo(tokens[2])
+                self.windows.append((days, begin, end))
+        if not self.cron and not self.windows:
+            raise ValueError(f"Empty schedule: {value}")
+
+    def _in_window(self, moment):
+        weekday = (moment.weekday() + 1) % 7
+        previous_day = (weekday - 1) % 7
+        minute_of_day = moment.hour * 60 + moment.minute
+        for days, begin, end in self.windows:
+            if begin <= end:
+                if weekday in days and begin <= minute_of_day < end:
+                    return True
+            # 跨午夜的窗口（如 22:00-06:00），星期按窗口开始的那一天计算
+            elif (weekday in days and minute_of_day >= begin) or (previous_day in days and minute_of_day < end):
+                return True
+        return False
+
+    def desired_action(self, now, interval):
+        local_now = now.astimezone(self.timezone)
+        if self.windows:
+            return 'start' if self._in_window(local_now) else 'stop'
+        # 从旧到新检查触发窗口内的每一分钟，最后命中的操作生效
+        action = None
+        minute = local_now.replace(second=0, microsecond=0)
+        for offset in range(max(1, interval // 60) - 1, -1, -1):
+            moment = minute - timedelta(minutes=offset)
+            for name, cron in self.cron.items():
+                if cron.matches(moment):
+                    action = name
+        return action
+
+def get_scheduled_instances(region):
+    """
+    一次扫描获取区域内所有带调度标签的实例，返回 [(实例ID, 状态, 调度表达式), ...]。
+    """
+    tag_key = CONFIG["schedule_tag_key"]
+    if INVENTORY_MAX_AGE > 0:
+        records = get_instances([region], tags={tag_key: None})
+        return [(record['instance_id'], record['state'], record['tags'][tag_key]) for record in records]
+
+    ec2 = get_client('ec2', region)
+    filters = [
+        {'Name': 'tag-key', 'Values': [tag_key]},
+        {'Name': 'instance-state-name', 'Values': ['pending', 'running', 'stopped']}
+    ]
+    instances = []
+    for page in ec2.get_paginator('describe_instances').paginate(Filters=filters):
+        for reservation in page['Reservations']:
+            for instance in reservation['Instances']:
+                tags = {tag['Key']: tag['Value'] for tag in instance.get('Tags', [])}
+                instances.append((instance['InstanceId'], instance['State']['Name'], tags[tag_key]))
+    return instances
+
+def plan_schedules(instances, now, interval):
+    """
+    计算需要启动和停止的实例集合。相同的调度表达式只解析和求值一次。
+    """
+    to_start, to_stop, invalid = [], [], []
+    decisions = {}
+    for instance_id, state, value in instances:
+        if value not in decisions:
+            try:
+                decisions[value] = Schedule(value, CONFIG["schedule_timezone"]).desired_action(now, interval)
+            except (ValueError, KeyError) as e:
+                logger.warning(f"Invalid schedule '{value}': {e}")
+                decisions[value] = 'invalid'
+        action = decisions[value]
+        if action == 'invalid':
+            invalid.append(instance_id)
+        elif action == 'start' and state in ACTION_SOURCE_STATES['start']:
+            to_start.append(instance_id)
+        elif action == 'stop' and state in ACTION_SOURCE_STATES['stop']:
+            to_stop.append(instance_id)
+    return to_start, to_stop, invalid
+
+def run_schedules(regions, now=None):
+    """
+    按实例调度标签执行一次调度：每个区域一次库存扫描，批量启动/停止。
+    """
+    now = now or datetime.now(timezone.utc)
+    result = {"start": {"success": [], "failed": []}, "stop": {"success": [], "failed": []}, "invalid": []}
+    for region in regions:
+        try:
+            instances = get_scheduled_instances(region)
+        except Exception as e:
+            logger.error(f"Failed to retrieve scheduled instances in {region}. Exception: {e}")
+            continue
+        to_start, to_stop, invalid = plan_schedules(instances, now, CONFIG["schedule_interval"])
+        logger.info(f"{region}: {len(instances)} scheduled instances, start {to_start}, stop {to_stop}")
+        result["invalid"].extend(invalid)
+        for action, instance_ids in (('start', to_start), ('stop', to_stop)):
+            if instance_ids:
+                region_result = manage_instances(instance_ids, action, region)
+                result[action]["success"].extend(region_result["success"])
+                result[action]["failed"].extend(region_result["failed"])
+    return result
+
 def lambda_handler(event, context):
     """
     Lambda 函数入口。
+
+    event 示例: {"action": "stop", "regions": ["ap-southeast-1", "us-east-1"], "wait": true}
+    regions / wait 缺省时使用环境变量 REGIONS / WAIT_FOR_STATE。
     """
     logger.debug(f"Received event: {event}")
     if not CONFIG:
         load_config()
 
     action = event.get('action')
+    regions = event.get('regions') or CONFIG["regions"]
+    if action == 'schedule':
+        return run_schedules(regions)
     if action not in ['start', 'stop']:
-        logger.error(f"Invalid action '{action}' in event. Must be 'start' or 'stop'.")
+        logger.error(f"Invalid action '{action}' in event. Must be 'start', 'stop' or 'schedule'.")
         return {"success": [], "failed": []}
 
-    logger.info(f"Executing '{action}' operation.")
-    instance_ids = get_instance_ids()
-    if instance_ids:
-        logger.info(f"Instance IDs to {action}: {instance_ids}")
-    return manage_instances(instance_ids, action)
\ No newline at end of file
+    wait = event.get('wait', CONFIG["wait"])
+    deadline = None
+    if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+        deadline = time.time() + context.get_remaining_time_in_millis() / 1000.0 - WAIT_TIME_MARGIN
+
+    logger.info(f"Executing '{action}' operation in regions: {regions}")
+    result = {"success": [], "failed": []}
+    pending = {}
+    for region in regions:
+        # 只处理需要变更状态的实例，避免整批因 IncorrectInstanceState 失败
+        instance_ids = get_instance_ids(region, ACTION_SOURCE_STATES[action])
+        if instance_ids:
+            logger.info(f"Instance IDs to {action} in {region}: {instance_ids}")
+        region_result = manage_instances(instance_ids, action, region)
+        result["success"].extend(region_result["success"])
+        result["failed"].extend(region_result["failed"])
+        if region_result["success"]:
+            pending[region] = region_result["success"]
+
+    if wait:
+        result["not_reached"] = []
+        for region, instance_ids in pending.items():
+            result["not_reached"].extend(
+                wait_for_state(instance_ids, ACTION_TARGET_STATE[action], region, deadline)
+            )
+    return result
@@ -1,60 +1,184 @@
-import boto3
-
-# 创建 boto3 客户端
-ec2 = boto3.client('ec2', region_name='us-east-1')  # 替换为你的区域
-sts = boto3.client('sts')
-
-# 获取账户信息和区域
-account_id = sts.get_caller_identity()['Account']
-region = ec2.meta.region_name
-
-# 用户确认是否处理所有实例
-choice = input("是否取消所有 EC2 实例的终止保护？(yes/no, 默认 no): ").strip().lower()
-if choice != 'yes':
-    tag_key = input("请输入标签键 (例如 'Environment'): ").strip()
-    tag_value = input("请输入标签值 (例如 'dev'): ").strip()
-    filters = [{'Name': f'tag:{tag_key}', 'Values': [tag_value]}]
-    response = ec2.describe_instances(Filters=filters)
-    print(f"\n只会处理具有标签 {tag_key}={tag_value} 的实例\n")
-else:
-    response = ec2.describe_instances()
-    print("\n将处理所有实例\n")
-
-# 记录成功处理的实例 ARN
-successful_arns = []
-
-# 遍历实例
-for reservation in response['Reservations']:
-    for instance in reservation['Instances']:
-        instance_id = instance['InstanceId']
-        try:
-            # 查询终止保护状态
-            attr = ec2.describe_instance_attribute(
-                InstanceId=instance_id,
-                Attribute='disableApiTermination'
-            )
-            is_protected = attr['DisableApiTermination']['Value']
-            print(f"实例 {instance_id} 当前终止保护状态: {'开启' if is_protected else '关闭'}")
-
-            if is_protected:
-                ec2.modify_instance_attribute(
-                    InstanceId=instance_id,
-                    DisableApiTermination={'Value': False}
-                )
-                arn = f"arn:aws:ec2:{region}:{account_id}:instance/{instance_id}"
-                successful_arns.append(arn)
-                print(f"--> ✅ 已取消终止保护: {instance_id}")
-                print(f"    ARN: {arn}")
-            else:
-                print(f"--> ⚠️ 实例 {instance_id} 未开启终止保护，跳过")
-
-        except Exception as e:
-            print(f"❌ 处理实例 {instance_id} 时出错: {e}")
-
-# 打印汇总结果
-if successful_arns:
-    print("\n✅ 以下实例成功取消终止保护：")
-    for arn in successful_arns:
-        print(arn)
-else:
-    print("\n⚠️ 没有实例被修改。")
+#!/usr/bin/env python3
+"""
+author: RJ.Wang
+Date: 2026-10-18
+email: wangrenjun@gmail.com
+Description: 批量取消 EC2 实例的终止保护（支持多区域、标签筛选、dry-run、中国区 ARN）
+
+用法:
+    python batch_remove_termination_protection.py                                  # 交互式，处理 us-east-1
+    python batch_remove_termination_protection.py --regions cn-northwest-1 --tag Environment=dev --dry-run
+    python batch_remove_termination_protection.py --all-regions --all --yes --profile g0603
+"""
+import argparse
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib'))
+from config import get_client, get_partition
+from region_fanout import AdaptiveLimiter, call_with_backoff, fan_out, get_enabled_regions
+
+# 默认区域与实例属性检查/修改的并发数
+DEFAULT_REGION = 'us-east-1'
+DEFAULT_WORKERS = 16
+
+
+def list_instances(region, filters, profile=None):
+    """分页获取区域内（未终止的）实例 ID"""
+    ec2 = get_client('ec2', region, profile)
+    filters = filters + [{'Name': 'instance-state-name',
+                          'Values': ['pending', 'running', 'stopping', 'stopped']}]
+    instance_ids = []
+    for page in ec2.get_paginator('describe_instances').paginate(Filters=filters):
+        for reservation in page['Reservations']:
+            for instance in reservation['Instances']:
+                instance_ids.append(instance['InstanceId'])
+    return instance_ids
+
+
+def remove_protection(region, instance_id, limiter, dry_run=False, profile=None):
+    """
+    检查并取消单个实例的终止保护。
+
+    Returns:
+        tuple: (instance_id, 原来是否开启保护, 是否已修改)
+    """
+    ec2 = get_client('ec2', region, profile)
+    attr = call_with_backoff(
+        ec2.describe_instance_attribute, limiter=limiter,
+        InstanceId=instance_id, Attribute='disableApiTermination'
+    )
+    is_protected = attr['DisableApiTermination']['Value']
+    if not is_protected or dry_run:
+        return instance_id, is_protected, False
+
+    call_with_backoff(
+        ec2.modify_instance_attribute, limiter=limiter,
+        InstanceId=instance_id, DisableApiTermination={'Value': False}
+    )
+    return instance_id, True, True
+
+
+def process_instances(instances_by_region, account_id, dry_run=False, workers=DEFAULT_WORKERS, profile=None):
+    """
+    并发处理所有实例，每个区域独立的自适应限流器。
+
+    Returns:
+        tuple: (已取消/将取消保护的实例 ARN 列表, 失败的 (实例ID, 错误) 列表)
+    """
+    limiters = {region: AdaptiveLimiter(initial=workers, maximum=workers) for region in instances_by_region}
+    changed_arns, errors = [], []
+    print_lock = threading.Lock()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(remove_protection, region, instance_id, limiters[region], dry_run, profile):
+                (region, instance_id)
+            for region, instance_ids in instances_by_region.items()
+            for instance_id in instance_ids
+        }
+        for future in as_completed(futures):
+            region, instance_id = futures[future]
+            try:
+                _, is_protected, modified = future.result()
+            except Exception as e:
+                errors.append((instance_id, e))
+                with print_lock:
+                    print(f"❌ 处理实例 {instance_id} 时出错: {e}")
+                continue
+
+            arn = f"arn:{get_partition(region)}:ec2:{region}:{account_id}:instance/{instance_id}"
+            with print_lock:
+                if not is_protected:
+                    print(f"--> ⚠️ 实例 {instance_id} 未开启终止保护，跳过")
+                elif dry_run:
+                    changed_arns.append(arn)
+                    print(f"--> 🔍 [dry-run] 将取消终止保护: {arn}")
+                elif modified:
+                    changed_arns.append(arn)
+                    print(f"--> ✅ 已取消终止保护: {arn}")
+    return changed_arns, errors
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="批量取消 EC2 实例的终止保护")
+    parser.add_argument("--regions", nargs="+", help=f"要处理的区域（默认 {DEFAULT_REGION}）")
+    parser.add_argument("--all-regions", action="store_true", help="处理所有已启用的区域")
+    parser.add_argument("--tag", help="只处理带有该标签的实例，格式 KEY=VALUE")
+    parser.add_argument("--all", action="store_true", help="处理所有实例（不按标签筛选）")
+    parser.add_argument("--dry-run", action="store_true", help="只检查并列出将被修改的实例，不做修改")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help=f"并发数（默认 {DEFAULT_WORKERS}）")
+    parser.add_argument("--profile", help="AWS profile")
+    parser.add_argument("--yes", action="store_true", help="跳过确认")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    # 未通过参数指定范围时，保持原来的交互方式
+    filters = []
+    if args.tag:
+        tag_key, _, tag_value = args.tag.partition('=')
+        filters = [{'Name': f'tag:{tag_key}', 'Values': [tag_value]}]
+        print(f"\n只会处理具有标签 {tag_key}={tag_value} 的实例\n")
+    elif args.all:
+        print("\n将处理所有实例\n")
+    else:
+        choice = input("是否取消所有 EC2 实例的终止保护？(yes/no, 默认 no): ").strip().lower()
+        if choice != 'yes':
+            tag_key = input("请输入标签键 (例如 'Environment'): ").strip()
+            tag_value = input("请输入标签值 (例如 'dev'): ").strip()
+            filters = [{'Name': f'tag:{tag_key}', 'Values': [tag_value]}]
+            print(f"\n只会处理具有标签 {tag_key}={tag_value} 的实例\n")
+        else:
+            print("\n将处理所有实例\n")
+
+    home_region = (args.regions or [DEFAULT_REGION])[0]
+    if args.all_regions:
+        regions = get_enabled_regions(profile=args.profile, region=home_region)
+    else:
+        regions = args.regions or [DEFAULT_REGION]
+    account_id = get_client('sts', home_region, args.profile).get_caller_identity()['Account']
+    print(f"账号: {account_id}，区域: {', '.join(regions)}")
+
+    # 并发列出所有区域的实例
+    instances_by_region = {}
+    for region, instance_ids, error in fan_out(lambda r: list_instances(r, filters, args.profile), regions):
+        if error is not None:
+            print(f"❌ 区域 {region} 获取实例失败: {error}")
+            continue
+        if instance_ids:
+            instances_by_region[region] = instance_ids
+            print(f"区域 {region}: {len(instance_ids)} 个实例")
+
+    total = sum(len(ids) for ids in instances_by_region.values())
+    if not total:
+        print("\n⚠️ 没有找到符合条件的实例。")
+        return
+    if not args.dry_run and not args.yes:
+        confirm = input(f"\n将检查并取消 {total} 个实例的终止保护，确认继续？(yes/no): ").strip().lower()
+        if confirm != 'yes':
+            print("已取消操作")
+            return
+
+    changed_arns, errors = process_instances(
+        instances_by_region, account_id, args.dry_run, args.workers, args.profile
+    )
+
+    # 打印汇总结果
+    if changed_arns:
+        title = "以下实例将被取消终止保护（dry-run）" if args.dry_run else "以下实例成功取消终止保护"
+        print(f"\n✅ {title}：")
+        for arn in sorted(changed_arns):
+            print(arn)
+    else:
+        print("\n⚠️ 没有实例被修改。")
+    if errors:
+        print(f"\n❌ {len(errors)} 个实例处理失败")
+
+
+if __name__ == '__main__':
+    main()
@@ -4,14 +4,25 @@ author: RJ.Wang
 Date: 2025-03-13
 email: wangrenjun@gmail.com
 Description: 在 Cloudshell 中查找该 Region 所有平均 CPU 占用低于 30% 的 EC2 实例
+             --rightsizing 模式：一次批量拉取多窗口（默认 1/7/14 天）指标，计算 CPU p50/p95/p99/max、
+             网络和 EBS 负载，并按同系列降配可回收的 vCPU 对候选实例排序
 """
-import boto3
+import argparse
+import os
+import sys
 from datetime import datetime, timedelta, timezone
 import csv
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib'))
+from config import get_client
+from inventory_store import get_instances
+from instance_types import family_members, get_instance_type_table
+from metric_cache import MetricCache
+from metrics import get_metric_data, metric_stat, series_mean, summarize, window_values
+
 # 初始化 EC2 和 CloudWatch 客户端
-ec2_client = boto3.client('ec2')
-cloudwatch_client = boto3.client('cloudwatch')
+ec2_client = get_client('ec2')
+cloudwatch_client = get_client('cloudwatch')
 
 # 设置时间范围 - 过去 24 小时
 end_time = datetime.now(timezone.utc)  # 使用 timezone-aware 的当前 UTC 时间
@@ -20,48 +31,65 @@ start_time = end_time - timedelta(days=1)
 # 开关：是否输出到 CSV 文件
 output_to_csv = False  # 默认不输出到 CSV 文件
 
+# 开关：是否使用本地指标缓存（已拉取过的数据点不再重复请求，只补齐缺失的时间段）
+use_metric_cache = False
+
 # 定义 CPU 使用率阈值
 cpu_threshold = 30.0
 
+# 右规格分析：统计窗口（天）、降配后期望的 CPU p95 上限（%）、数据点粒度（秒）
+RIGHTSIZING_WINDOWS = (1, 7, 14)
+TARGET_CPU_P95 = 60.0
+RIGHTSIZING_PERIOD = 3600
+
+# 右规格分析需要的指标：(名称, 指标名, 统计方式)，一次 GetMetricData 批量拉取
+RIGHTSIZING_METRICS = (
+    ('cpu', 'CPUUtilization', 'Average'),
+    ('cpu_max', 'CPUUtilization', 'Maximum'),
+    ('net_in', 'NetworkIn', 'Sum'),
+    ('net_out', 'NetworkOut', 'Sum'),
+    ('ebs_read', 'EBSReadOps', 'Sum'),
+    ('ebs_write', 'EBSWriteOps', 'Sum'),
+)
+
+# 获取指标数据（开启缓存时只请求本地缺失的时间段）
+def fetch_metric_data(stats, start, end):
+    if use_metric_cache:
+        with MetricCache() as cache:
+            return cache.get_metric_data(cloudwatch_client, stats, start, end)
+    return get_metric_data(cloudwatch_client, stats, start, end)
+
 # 获取所有运行中的 EC2 实例
+# 设置了 INVENTORY_MAX_AGE 时复用本地库存快照
 def get_running_instances():
-    instances = []
-    response = ec2_client.describe_instances(
-        Filters=[{'Name': 'instance-state-name', 'Values': ['running']}]
-    )
-    for reservation in response['Reservations']:
-        for instance in reservation['Instances']:
-            instance_id = instance['InstanceId']
-            # 查找实例名称
-            instance_name = next((tag['Value'] for tag in instance.get('Tags', []) if tag['Key'] == 'Name'), "N/A")
-            instances.append((instance_id, instance_name))
-    return instances
-
-# 获取实例的平均 CPU 使用率
+    records = get_instances([ec2_client.meta.region_name], states=['running'])
+    return [(record['instance_id'], record['name']) for record in records]
+
+# 批量获取实例的平均 CPU 使用率（GetMetricData，每请求最多 500 个实例）
+def get_average_cpu_utilizations(instance_ids):
+    stats = {
+        instance_id: metric_stat(
+            'AWS/EC2', 'CPUUtilization', {'InstanceId': instance_id},
+            'Average', 3600  # 每小时一个数据点
+        )
+        for instance_id in instance_ids
+    }
+    series = fetch_metric_data(stats, start_time, end_time)
+    # 计算一天内的平均 CPU 使用率，没有数据点时为 None
+    return {instance_id: series_mean(data.values) for instance_id, data in series.items()}
+
+# 获取单个实例的平均 CPU 使用率
 def get_average_cpu_utilization(instance_id):
-    response = cloudwatch_client.get_metric_statistics(
-        Namespace='AWS/EC2',
-        MetricName='CPUUtilization',
-        Dimensions=[{'Name': 'InstanceId', 'Value': instance_id}],
-        StartTime=start_time,
-        EndTime=end_time,
-        Period=3600,  # 每小时一个数据点
-        Statistics=['Average']
-    )
-    # 计算一天内的平均 CPU 使用率
-    data_points = response['Datapoints']
-    if not data_points:
-        return None  # 没有数据点的情况
-    average_cpu = sum(dp['Average'] for dp in data_points) / len(data_points)
-    return average_cpu
+    return get_average_cpu_utilizations([instance_id])[instance_id]
 
 # 查找 CPU 使用率低于阈值的实例并排序
 def find_low_cpu_instances():
     low_cpu_instances = []
     instances = get_running_instances()
+    averages = get_average_cpu_utilizations([instance_id for instance_id, _ in instances])
     
     for instance_id, instance_name in instances:
-        avg_cpu = get_average_cpu_utilization(instance_id)
+        avg_cpu = averages[instance_id]
         if avg_cpu is not None and avg_cpu < cpu_threshold:
             low_cpu_instances.append((instance_id, instance_name, avg_cpu))
     
@@ -69,6 +97,121 @@ def find_low_cpu_instances():
     low_cpu_instances.sort(key=lambda x: x[2])
     return low_cpu_instances
 
+# 批量拉取右规格分析需要的全部指标（覆盖最长窗口），返回 {(实例ID, 名称): MetricSeries}
+def fetch_rightsizing_series(instance_ids, days, end):
+    stats = {
+        (instance_id, name): metric_stat(
+            'AWS/EC2', metric_name, {'InstanceId': instance_id}, stat, RIGHTSIZING_PERIOD
+        )
+        for instance_id in instance_ids
+        for name, metric_name, stat in RIGHTSIZING_METRICS
+    }
+    return fetch_metric_data(stats, end - timedelta(days=days), end)
+
+# 按时间戳合并两条序列（如读 + 写），返回合并后的数值列表
+def combine_series(first, second):
+    totals = dict(zip(first.timestamps, first.values))
+    for ts, value in zip(second.timestamps, second.values):
+        totals[ts] = totals.get(ts, 0.0) + value
+    return list(totals.values())
+
+# 在同系列中寻找能承载当前 CPU p95 的最小规格
+def recommend_instance_type(instance_type, cpu_p95, table):
+    spec = table.get(instance_type)
+    if spec is None or cpu_p95 is None:
+        return None
+    needed_vcpus = spec['vcpus'] * cpu_p95 / TARGET_CPU_P95
+    for candidate, candidate_spec in family_members(table, spec['family']):
+        if candidate_spec['vcpus'] >= spec['vcpus']:
+            break
+        if candidate_spec['vcpus'] >= needed_vcpus and \
+                set(candidate_spec['architectures']) & set(spec['architectures']):
+            return candidate, candidate_spec
+    return None
+
+# 右规格分析：多窗口百分位 + 网络/EBS 负载 + 同系列降配建议，按可回收 vCPU 排序
+def analyze_rightsizing(windows=RIGHTSIZING_WINDOWS):
+    region = ec2_client.meta.region_name
+    records = get_instances([region], states=['running'])
+    table = get_instance_type_table(region)
+
+    end = datetime.now(timezone.utc)
+    series = fetch_rightsizing_series([record['instance_id'] for record in records], max(windows), end)
+    longest_since = (end - timedelta(days=max(windows))).timestamp()
+
+    results = []
+    for record in records:
+        instance_id = record['instance_id']
+        spec = table.get(record['instance_type'], {})
+        row = {
+            'instance_id': instance_id,
+            'name': record['name'],
+            'instance_type': record['instance_type'],
+            'vcpus': spec.get('vcpus'),
+            'memory_gib': spec['memory_mib'] / 1024 if spec else None
+        }
+        # 所有窗口都从同一条序列上切片计算，不额外调用 API
+        for days in windows:
+            since = (end - timedelta(days=days)).timestamp()
+            summary = summarize(window_values(series[(instance_id, 'cpu')], since))
+            peak = window_values(series[(instance_id, 'cpu_max')], since)
+            row[f'cpu_p50_{days}d'] = summary['p50']
+            row[f'cpu_p95_{days}d'] = summary['p95']
+            row[f'cpu_p99_{days}d'] = summary['p99']
+            row[f'cpu_max_{days}d'] = max(peak) if peak else summary['max']
+
+        # 网络（Mbps）和 EBS（IOPS）负载，取最长窗口的 p95
+        network = combine_series(series[(instance_id, 'net_in')], series[(instance_id, 'net_out')])
+        ebs_ops = combine_series(series[(instance_id, 'ebs_read')], series[(instance_id, 'ebs_write')])
+        row['network_p95_mbps'] = summarize(
+            [value * 8 / RIGHTSIZING_PERIOD / 1e6 for value in network], (95,))['p95']
+        row['ebs_p95_iops'] = summarize([value / RIGHTSIZING_PERIOD for value in ebs_ops], (95,))['p95']
+
+        # 同系列内价格与规格近似线性，按回收的 vCPU 比例估算节省
+        recommendation = recommend_instance_type(
+            record['instance_type'], row[f'cpu_p95_{max(windows)}d'], table
+        )
+        if recommendation:
+            suggested, suggested_spec = recommendation
+            row['suggested_type'] = suggested
+            row['reclaimable_vcpus'] = spec['vcpus'] - suggested_spec['vcpus']
+            row['estimated_savings_pct'] = 100.0 * row['reclaimable_vcpus'] / spec['vcpus']
+        else:
+            row['suggested_type'] = None
+            row['reclaimable_vcpus'] = 0
+            row['estimated_savings_pct'] = 0.0
+        results.append(row)
+
+    results.sort(key=lambda r: (r['reclaimable_vcpus'], r['estimated_savings_pct']), reverse=True)
+    return results
+
+# 将右规格分析结果写入 CSV 文件
+def write_rightsizing_csv(rows, filename="rightsizing_candidates.csv"):
+    if not rows:
+        return
+    with open(filename, mode='w', newline='') as file:
+        writer = csv.DictWriter(file, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows(rows)
+
+# 输出右规格分析结果
+def print_rightsizing(rows, windows):
+    def fmt(value):
+        return '-' if value is None else f"{value:.1f}"
+
+    header = f"{'Instance ID':<20} {'Instance Name':<24} {'Type':<14}"
+    header += ''.join(f" {f'p95 {days}d':>8}" for days in windows)
+    header += f" {'Max':>6} {'Net Mbps':>9} {'EBS IOPS':>9} {'Suggested':<14} {'Savings':>8}"
+    print(f"\n{header}")
+    print('-' * len(header))
+    for row in rows:
+        line = f"{row['instance_id']:<20} {row['name'][:24]:<24} {row['instance_type']:<14}"
+        line += ''.join(f" {fmt(row[f'cpu_p95_{days}d']):>8}" for days in windows)
+        line += f" {fmt(row[f'cpu_max_{max(windows)}d']):>6} {fmt(row['network_p95_mbps']):>9}"
+        line += f" {fmt(row['ebs_p95_iops']):>9} {row['suggested_type'] or '-':<14}"
+        line += f" {row['estimated_savings_pct']:>7.0f}%"
+        print(line)
+
 # 将结果写入 CSV 文件
 def write_to_csv(data, filename="low_cpu_instances.csv"):
     with open(filename, mode='w', newline='') as file:
@@ -81,6 +224,26 @@ def write_to_csv(data, filename="low_cpu_instances.csv"):
 
 # 主函数
 def main():
+    global use_metric_cache
+    parser = argparse.ArgumentParser(description="查找低 CPU 使用率的 EC2 实例")
+    parser.add_argument("--rightsizing", action="store_true", help="多窗口百分位右规格分析")
+    parser.add_argument("--windows", type=int, nargs="+", default=list(RIGHTSIZING_WINDOWS),
+                        help="右规格分析窗口（天），默认 1 7 14")
+    parser.add_argument("--csv", action="store_true", default=output_to_csv, help="同时输出到 CSV 文件")
+    parser.add_argument("--metric-cache", action="store_true", default=use_metric_cache,
+                        help="使用本地指标缓存，只拉取上次运行之后缺失的数据点")
+    args = parser.parse_args()
+    use_metric_cache = args.metric_cache
+
+    if args.rightsizing:
+        windows = tuple(sorted(args.windows))
+        rows = analyze_rightsizing(windows)
+        print_rightsizing(rows, windows)
+        if args.csv:
+            write_rightsizing_csv(rows)
+            print(f"\nResults have been saved to rightsizing_candidates.csv")
+        return
+
     low_cpu_instances = find_low_cpu_instances()
     
     # 默认将信息输出到屏幕
@@ -90,7 +253,7 @@ def main():
         print(f"{instance_id:<20} {instance_name:<30} {avg_cpu:<20.2f}")
     
     # 如果开关设置为 True，则输出到 CSV 文件
-    if output_to_csv:
+    if args.csv:
         write_to_csv(low_cpu_instances)
         print(f"\nResults have been saved to low_cpu_instances.csv")
 
@@ -2,18 +2,36 @@
 # -*- coding: utf-8 -*-
 """
 获取当前AWS账号的所有EC2实例信息
+
+各区域结果到达后立即写入 CSV/JSONL、累加汇总计数并输出该区域明细，不在内存中保留全部实例。
+
+用法:
+    python get_account_info.py
+    python get_account_info.py --output instances.jsonl --summary-only
+    python get_account_info.py --regions us-east-1 ap-southeast-1 --output instances.csv
+    python get_account_info.py --org --output org_instances.jsonl --summary-only   # 组织内所有账号
+    python get_account_info.py --accounts 111111111111 222222222222 --role-name ReadOnlyAuditRole
 """
 
+import argparse
+import csv
+import json
+import os
+import sys
 import boto3
-from datetime import datetime
-from collections import Counter, defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import Counter
 from botocore.exceptions import ClientError, NoCredentialsError
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib'))
+from config import INVENTORY_MAX_AGE, get_client
+from inventory_store import describe_region_instances, get_instances
+from org_fanout import DEFAULT_ROLE_NAME, fan_out_accounts, list_organization_accounts
+from region_fanout import fan_out, get_enabled_regions, is_throttling_error
+
 def get_current_account_info():
     """获取当前账号信息"""
     try:
-        sts = boto3.client('sts')
+        sts = get_client('sts')
         identity = sts.get_caller_identity()
         return {
             'account_id': identity['Account'],
@@ -25,50 +43,21 @@ def get_current_account_info():
         return None
 
 def get_all_regions():
-    """获取所有可用区域"""
+    """获取所有已启用的区域（跳过需要 opt-in 但未启用的区域）"""
     try:
-        ec2 = boto3.client('ec2')
-        regions = ec2.describe_regions()
-        return [region['RegionName'] for region in regions['Regions']]
+        return get_enabled_regions()
     except Exception as e:
         print(f"警告: 无法获取区域列表，使用默认区域 - {e}")
         return [boto3.Session().region_name or 'us-east-1']
 
-def get_ec2_instances_in_region(region_name):
-    """获取指定区域的EC2实例（支持分页）"""
+def get_ec2_instances_in_region(region_name, profile=None):
+    """获取指定区域的EC2实例（支持分页）；profile 可以是 org_fanout 返回的跨账号会话名称"""
     try:
-        ec2 = boto3.client('ec2', region_name=region_name)
-        paginator = ec2.get_paginator('describe_instances')
-        
-        instances = []
-        for page in paginator.paginate():
-            for reservation in page['Reservations']:
-                for instance in reservation['Instances']:
-                    # 获取实例名称
-                    name = next((tag['Value'] for tag in instance.get('Tags', []) 
-                               if tag['Key'] == 'Name'), 'N/A')
-                    
-                    # 修复LaunchTime处理
-                    launch_time = 'N/A'
-                    if instance.get('LaunchTime'):
-                        launch_time = instance['LaunchTime'].strftime('%Y-%m-%d %H:%M:%S')
-                    
-                    instances.append({
-                        'name': name,
-                        'instance_id': instance['InstanceId'],
-                        'instance_type': instance['InstanceType'],
-                        'state': instance['State']['Name'],
-                        'private_ip': instance.get('PrivateIpAddress', 'N/A'),
-                        'public_ip': instance.get('PublicIpAddress', 'N/A'),
-                        'vpc_id': instance.get('VpcId', 'N/A'),
-                        'subnet_id': instance.get('SubnetId', 'N/A'),
-                        'availability_zone': instance.get('Placement', {}).get('AvailabilityZone', 'N/A'),
-                        'launch_time': launch_time,
-                        'region': region_name
-                    })
-        
-        return instances
+        return describe_region_instances(region_name, profile)
     except ClientError as e:
+        # 限流错误交给 fan_out 退避重试并降低并发
+        if is_throttling_error(e):
+            raise
         error_code = e.response['Error']['Code']
         if error_code in ['UnauthorizedOperation', 'AccessDenied']:
             print(f"警告: 无权限访问区域 {region_name}")
@@ -76,89 +65,213 @@ def get_ec2_instances_in_region(region_name):
             print(f"错误: 访问区域 {region_name} 失败 - {e}")
         return []
 
-def collect_instances_parallel(regions, max_workers=10):
-    """并行收集所有区域的实例信息"""
+class InstanceRecord:
+    """紧凑的实例记录（__slots__，只保留输出需要的字段）"""
+
+    FIELDS = ('account_id', 'region', 'instance_id', 'name', 'instance_type', 'state', 'private_ip', 'public_ip',
+              'availability_zone', 'launch_time', 'vpc_id', 'subnet_id')
+    __slots__ = FIELDS
+
+    def __init__(self, **values):
+        for field in self.FIELDS:
+            setattr(self, field, values.get(field, 'N/A'))
+
+    @classmethod
+    def from_dict(cls, instance):
+        return cls(**{field: instance.get(field, 'N/A') for field in cls.FIELDS})
+
+    def as_row(self):
+        return [getattr(self, field) for field in self.FIELDS]
+
+    def as_dict(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+
+class InstanceSummary:
+    """增量汇总计数"""
+
+    def __init__(self):
+        self.total = 0
+        self.account_count = Counter()
+        self.state_count = Counter()
+        self.region_count = Counter()
+        self.type_count = Counter()
+
+    def add(self, record):
+        self.total += 1
+        self.account_count[record.account_id] += 1
+        self.state_count[record.state] += 1
+        self.region_count[record.region] += 1
+        self.type_count[record.instance_type] += 1
+
+
+class RecordWriter:
+    """按扩展名把实例记录流式写入 CSV 或 JSONL 文件"""
+
+    def __init__(self, path):
+        self.path = path
+        self.format = 'jsonl' if path.endswith(('.jsonl', '.json')) else 'csv'
+        self.file = open(path, 'w', newline='', encoding='utf-8')
+        if self.format == 'csv':
+            self.csv_writer = csv.writer(self.file)
+            self.csv_writer.writerow(InstanceRecord.FIELDS)
+
+    def write(self, records):
+        if self.format == 'csv':
+            self.csv_writer.writerows(record.as_row() for record in records)
+        else:
+            self.file.writelines(json.dumps(record.as_dict(), ensure_ascii=False) + '\n' for record in records)
+        # 每个区域写完即落盘，中途中断也保留已完成区域的结果
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def _tag_account(instances, account_id):
+    for instance in instances:
+        instance['account_id'] = account_id
+    return instances
+
+
+def iter_region_instances(regions, max_workers=32, account_id='N/A'):
+    """并行收集各区域实例（并发度根据限流情况自适应调整），按完成顺序逐个区域产出 (区域, 记录列表)"""
+    for region, instances, error in fan_out(get_ec2_instances_in_region, regions, max_workers=max_workers):
+        if error is not None:
+            print(f"区域 {region} 处理失败: {error}")
+            continue
+        if instances:
+            print(f"区域 {region}: 找到 {len(instances)} 个实例")
+        yield region, _tag_account(instances, account_id)
+
+
+def iter_snapshot_instances(regions, max_age, account_id='N/A'):
+    """从本地库存快照读取实例（只刷新过期区域），按区域产出 (区域, 记录列表)"""
+    by_region = {}
+    for instance in get_instances(regions, max_age):
+        by_region.setdefault(instance['region'], []).append(instance)
+    for region in sorted(by_region):
+        yield region, _tag_account(by_region.pop(region), account_id)
+
+
+def iter_org_instances(accounts, regions=None, role_name=DEFAULT_ROLE_NAME, max_workers=32):
+    """
+    在多个账号中 AssumeRole 后并行收集实例，按完成顺序产出 ("账号 / 区域", 记录列表)。
+
+    regions 为 None 时使用每个账号各自已启用的区域。
+    """
+    for account_id, region, instances, error in fan_out_accounts(
+            get_ec2_instances_in_region, accounts, regions, role_name, max_workers=max_workers):
+        if error is not None:
+            target = f"账号 {account_id} 区域 {region}" if region else f"账号 {account_id}"
+            print(f"{target} 处理失败: {error}")
+            continue
+        if instances:
+            print(f"账号 {account_id} 区域 {region}: 找到 {len(instances)} 个实例")
+        yield f"{account_id} / {region}", _tag_account(instances, account_id)
+
+
+def collect_instances_parallel(regions, max_workers=32):
+    """并行收集所有区域的实例信息，返回完整列表（少量实例时使用）"""
     all_instances = []
-    
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_region = {
-            executor.submit(get_ec2_instances_in_region, region): region 
-            for region in regions
-        }
-        
-        for future in as_completed(future_to_region):
-            region = future_to_region[future]
-            try:
-                instances = future.result()
-                if instances:
-                    print(f"区域 {region}: 找到 {len(instances)} 个实例")
-                all_instances.extend(instances)
-            except Exception as e:
-                print(f"区域 {region} 处理失败: {e}")
-    
+    for _, instances in iter_region_instances(regions, max_workers):
+        all_instances.extend(instances)
     return all_instances
 
-def print_summary(all_instances):
+
+def format_region_details(region, records):
+    """生成单个区域的明细文本"""
+    lines = [f"\n[区域: {region}]", "-" * 50]
+    for record in records:
+        lines.extend([
+            f"名称: {record.name}",
+            f"实例ID: {record.instance_id}",
+            f"类型: {record.instance_type}",
+            f"状态: {record.state}",
+            f"私有IP: {record.private_ip}",
+            f"公网IP: {record.public_ip}",
+            f"可用区: {record.availability_zone}",
+            f"启动时间: {record.launch_time}",
+            f"VPC: {record.vpc_id}",
+            f"子网: {record.subnet_id}",
+            ""
+        ])
+    return "\n".join(lines) + "\n"
+
+
+def stream_instances(region_batches, writer=None, detail=True):
+    """
+    逐个区域处理实例：更新汇总、写入输出文件、输出明细，处理完即释放该区域的记录。
+
+    Args:
+        region_batches: 产出 (区域, 实例字典列表) 的可迭代对象
+        writer: RecordWriter，为 None 时不写文件
+        detail: 是否输出每个实例的明细
+
+    Returns:
+        InstanceSummary
+    """
+    summary = InstanceSummary()
+    for region, instances in region_batches:
+        records = [InstanceRecord.from_dict(instance) for instance in instances]
+        for record in records:
+            summary.add(record)
+        if writer is not None:
+            writer.write(records)
+        if detail and records:
+            sys.stdout.write(format_region_details(region, records))
+    return summary
+
+
+def print_summary(summary):
     """打印汇总信息"""
-    if not all_instances:
+    if not summary.total:
         print("未找到任何EC2实例")
         return
     
-    # 使用Counter进行统计
-    state_count = Counter(instance['state'] for instance in all_instances)
-    region_count = Counter(instance['region'] for instance in all_instances)
-    type_count = Counter(instance['instance_type'] for instance in all_instances)
-    
     print(f"\n{'='*60}")
     print("EC2 实例汇总")
     print(f"{'='*60}")
-    print(f"总实例数: {len(all_instances)}")
+    print(f"总实例数: {summary.total}")
+    
+    if len(summary.account_count) > 1:
+        print(f"\n按账号统计:")
+        for account_id, count in sorted(summary.account_count.items()):
+            print(f"  {account_id}: {count}")
     
     print(f"\n按状态统计:")
-    for state, count in sorted(state_count.items()):
+    for state, count in sorted(summary.state_count.items()):
         print(f"  {state}: {count}")
     
     print(f"\n按区域统计:")
-    for region, count in sorted(region_count.items()):
+    for region, count in sorted(summary.region_count.items()):
         print(f"  {region}: {count}")
     
     print(f"\n按实例类型统计:")
-    for itype, count in sorted(type_count.items()):
+    for itype, count in sorted(summary.type_count.items()):
         print(f"  {itype}: {count}")
 
-def print_detailed_info(all_instances):
-    """打印详细信息"""
-    if not all_instances:
-        return
-    
-    print(f"\n{'='*60}")
-    print("EC2 实例详细信息")
-    print(f"{'='*60}")
-    
-    # 使用defaultdict按区域分组
-    regions = defaultdict(list)
-    for instance in all_instances:
-        regions[instance['region']].append(instance)
-    
-    for region, instances in sorted(regions.items()):
-        print(f"\n[区域: {region}]")
-        print("-" * 50)
-        
-        for instance in instances:
-            print(f"名称: {instance['name']}")
-            print(f"实例ID: {instance['instance_id']}")
-            print(f"类型: {instance['instance_type']}")
-            print(f"状态: {instance['state']}")
-            print(f"私有IP: {instance['private_ip']}")
-            print(f"公网IP: {instance['public_ip']}")
-            print(f"可用区: {instance['availability_zone']}")
-            print(f"启动时间: {instance['launch_time']}")
-            print(f"VPC: {instance['vpc_id']}")
-            print(f"子网: {instance['subnet_id']}")
-            print()
+def parse_args():
+    parser = argparse.ArgumentParser(description="获取当前AWS账号的所有EC2实例信息")
+    parser.add_argument("--regions", nargs="+", help="要扫描的区域（默认所有已启用区域）")
+    parser.add_argument("--output", help="把实例记录流式写入文件，扩展名 .csv 或 .jsonl")
+    parser.add_argument("--summary-only", action="store_true", help="只输出汇总，不打印每个实例的明细")
+    parser.add_argument("--max-workers", type=int, default=32, help="区域并发上限（默认 32）")
+    parser.add_argument("--org", action="store_true", help="扫描组织内所有 ACTIVE 账号（需管理账号权限）")
+    parser.add_argument("--accounts", nargs="+", help="只扫描指定的账号 ID（通过 AssumeRole 访问）")
+    parser.add_argument("--role-name", default=DEFAULT_ROLE_NAME, help=f"在成员账号中扮演的角色（默认 {DEFAULT_ROLE_NAME}）")
+    return parser.parse_args()
 
 def main():
     """主函数"""
+    args = parse_args()
     print("正在获取AWS账号EC2信息...\n")
     
     # 获取账号信息
@@ -170,16 +283,31 @@ def main():
     print(f"用户ARN: {account_info['user_arn']}")
     print()
     
-    # 获取所有区域
-    regions = get_all_regions()
-    print(f"正在扫描 {len(regions)} 个区域...")
+    if args.org or args.accounts:
+        # 多账号：每个账号 AssumeRole 一次，所有 账号 × 区域 共用一个线程池
+        accounts = args.accounts or [account['id'] for account in list_organization_accounts()]
+        print(f"正在扫描 {len(accounts)} 个账号...")
+        region_batches = iter_org_instances(accounts, args.regions, args.role_name, args.max_workers)
+    else:
+        # 获取所有区域
+        regions = args.regions or get_all_regions()
+        print(f"正在扫描 {len(regions)} 个区域...")
+        
+        # 并行收集实例信息（设置了 INVENTORY_MAX_AGE 时复用本地快照，只刷新过期区域）
+        if INVENTORY_MAX_AGE > 0:
+            region_batches = iter_snapshot_instances(regions, INVENTORY_MAX_AGE, account_info['account_id'])
+        else:
+            region_batches = iter_region_instances(regions, args.max_workers, account_info['account_id'])
     
-    # 并行收集所有实例信息
-    all_instances = collect_instances_parallel(regions)
+    if args.output:
+        with RecordWriter(args.output) as writer:
+            summary = stream_instances(region_batches, writer, detail=not args.summary_only)
+        print(f"\n实例记录已写入: {args.output}")
+    else:
+        summary = stream_instances(region_batches, detail=not args.summary_only)
     
-    # 显示结果
-    print_summary(all_instances)
-    print_detailed_info(all_instances)
+    # 显示汇总
+    print_summary(summary)
     
     print(f"\n扫描完成！")
 
@@ -1,12 +1,56 @@
 import os
 import json
-import subprocess
+import time
+import argparse
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from requests.adapters import HTTPAdapter
 
 # 配置开关
 EXPORT_YAML = False  # 设置为True时导出YAML文件，False时只打印到屏幕
 
+# 实例元数据服务（IMDS），与 AWS SDK 一样支持通过环境变量修改地址或禁用
+IMDS_BASE_URL = os.getenv('AWS_EC2_METADATA_SERVICE_ENDPOINT', 'http://169.254.169.254').rstrip('/') + '/latest/'
+IMDS_DISABLED = os.getenv('AWS_EC2_METADATA_DISABLED', '').lower() == 'true'
+IMDS_TOKEN_TTL = 21600  # IMDSv2 令牌有效期（秒）
+IMDS_TIMEOUT = 2
+IMDS_CONNECT_TIMEOUT = 0.3  # EC2 上连接 IMDS 通常不到 1 毫秒，连不上即视为不在 EC2 上
+
+# 本地 IMDS 替身（--local-imds）默认返回的数据
+LOCAL_IMDS_METADATA = {
+    'dynamic/instance-identity/document': {
+        'accountId': '123456789012',
+        'architecture': 'x86_64',
+        'availabilityZone': 'us-east-1a',
+        'imageId': 'ami-0123456789abcdef0',
+        'instanceId': 'i-0123456789abcdef0',
+        'instanceType': 't3.micro',
+        'privateIp': '10.0.0.10',
+        'region': 'us-east-1'
+    },
+    'meta-data/public-ipv4': '203.0.113.10',
+    'meta-data/mac': '0a:1b:2c:3d:4e:5f',
+    'meta-data/security-groups': 'default'
+}
+
+# 身份文档中没有、需要单独读取的元数据路径
+METADATA_PATHS = {
+    'public_ip': 'public-ipv4',
+    'mac_address': 'mac',
+    'security_groups': 'security-groups'
+}
+
+# 复用连接的 HTTP 会话，令牌在有效期内缓存
+_http = requests.Session()
+_http.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=len(METADATA_PATHS)))
+_token = {'value': None, 'expires_at': 0}
+_token_lock = threading.Lock()
+# IMDS 探测结果（None 表示尚未探测），进程内只探测一次
+_imds_state = {'available': None}
+
 try:
     import boto3
     HAS_BOTO3 = True
@@ -19,24 +63,55 @@ try:
 except ImportError:
     HAS_YAML = False
 
-def get_imdsv2_token():
-    """获取IMDSv2令牌"""
-    try:
-        response = requests.put(
-            'http://169.254.169.254/latest/api/token',
-            headers={'X-aws-ec2-metadata-token-ttl-seconds': '21600'},
-            timeout=2
-        )
-        if response.status_code == 200:
-            return response.text
-    except requests.exceptions.RequestException:
-        return None
+def _request_token():
+    """请求新的 IMDSv2 令牌（调用方持有 _token_lock），连接失败时抛出 RequestException"""
+    response = _http.put(
+        IMDS_BASE_URL + 'api/token',
+        headers={'X-aws-ec2-metadata-token-ttl-seconds': str(IMDS_TOKEN_TTL)},
+        timeout=(IMDS_CONNECT_TIMEOUT, IMDS_TIMEOUT)
+    )
+    if response.status_code == 200:
+        _token['value'] = response.text
+        _token['expires_at'] = time.time() + IMDS_TOKEN_TTL
+    return response
 
-def get_instance_metadata(path='', use_imdsv2=True):
-    """获取EC2实例元数据（支持IMDSv2）"""
-    base_url = 'http://169.254.169.254/latest/meta-data/'
-    headers = {}
+def imds_available():
+    """
+    探测 IMDS 是否可达：一次短连接超时的令牌请求，成功时顺便缓存令牌。
+
+    结果在进程内缓存，不在 EC2 上（笔记本、容器、IMDS 跳数限制）时只付出一次探测的时间。
+    """
+    with _token_lock:
+        if _imds_state['available'] is None:
+            if IMDS_DISABLED:
+                _imds_state['available'] = False
+            else:
+                try:
+                    _request_token()
+                    # 任何 HTTP 响应都说明服务可达（仅支持 IMDSv1 时令牌请求可能返回非 200）
+                    _imds_state['available'] = True
+                except requests.exceptions.RequestException:
+                    _imds_state['available'] = False
+        return _imds_state['available']
+
+def get_imdsv2_token(refresh=False):
+    """获取IMDSv2令牌（有效期内复用，提前 60 秒刷新）"""
+    with _token_lock:
+        if not refresh and _token['value'] and time.time() < _token['expires_at'] - 60:
+            return _token['value']
+        try:
+            response = _request_token()
+        except requests.exceptions.RequestException:
+            return None
+        if response.status_code != 200:
+            return None
+        return _token['value']
+
+def _imds_get(path, use_imdsv2=True):
+    if not imds_available():
+        return None
     
+    headers = {}
     if use_imdsv2:
         token = get_imdsv2_token()
         if token:
@@ -45,7 +120,11 @@ def get_instance_metadata(path='', use_imdsv2=True):
             print("警告: 无法获取IMDSv2令牌，尝试使用IMDSv1")
     
     try:
-        response = requests.get(base_url + path, headers=headers, timeout=2)
+        response = _http.get(IMDS_BASE_URL + path, headers=headers, timeout=IMDS_TIMEOUT)
+        # 令牌失效（如实例元数据服务重启）时刷新一次
+        if response.status_code == 401 and use_imdsv2:
+            headers['X-aws-ec2-metadata-token'] = get_imdsv2_token(refresh=True)
+            response = _http.get(IMDS_BASE_URL + path, headers=headers, timeout=IMDS_TIMEOUT)
         if response.status_code == 200:
             return response.text
         return None
@@ -53,6 +132,111 @@ def get_instance_metadata(path='', use_imdsv2=True):
         print(f"元数据请求失败: {str(e)}")
         return None
 
+def get_instance_metadata(path='', use_imdsv2=True):
+    """获取EC2实例元数据（支持IMDSv2）"""
+    return _imds_get('meta-data/' + path, use_imdsv2)
+
+def get_instance_identity_document(use_imdsv2=True):
+    """一次请求获取实例身份文档（实例ID、类型、区域、可用区、私有IP、账号等）"""
+    document = _imds_get('dynamic/instance-identity/document', use_imdsv2)
+    if not document:
+        return None
+    try:
+        return json.loads(document)
+    except ValueError:
+        return None
+
+def get_dmi_info():
+    """
+    离线回退：从 DMI 读取虚拟化平台信息，不依赖网络。
+
+    Nitro 实例的 board_asset_tag 就是实例 ID，IMDS 被禁用或受跳数限制时仍可识别所在实例。
+    """
+    info = {}
+    for key, name in (('vendor', 'sys_vendor'), ('product', 'product_name'), ('asset_tag', 'board_asset_tag')):
+        try:
+            with open(f'/sys/devices/virtual/dmi/id/{name}') as f:
+                info[key] = f.read().strip()
+        except OSError:
+            pass
+    dmi_info = {'on_ec2': info.get('vendor') == 'Amazon EC2'}
+    if info.get('asset_tag', '').startswith('i-'):
+        dmi_info['instance_id'] = info['asset_tag']
+    return dmi_info
+
+def start_local_imds(metadata=None):
+    """
+    在本机随机端口启动一个 IMDS 替身（支持 IMDSv2 令牌），并把后续请求指向它，用于测试。
+
+    Args:
+        metadata: {路径: 值} 字典，路径相对于 /latest/，值为字典时按 JSON 返回；默认使用 LOCAL_IMDS_METADATA
+
+    Returns:
+        ThreadingHTTPServer: 可调用 shutdown() 停止
+    """
+    global IMDS_BASE_URL
+    metadata = metadata or LOCAL_IMDS_METADATA
+    token = 'local-imds-token'
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, status, body=''):
+            data = body.encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_PUT(self):
+            if self.path == '/latest/api/token':
+                self._reply(200, token)
+            else:
+                self._reply(404)
+
+        def do_GET(self):
+            if self.headers.get('X-aws-ec2-metadata-token') != token:
+                self._reply(401)
+                return
+            value = metadata.get(self.path[len('/latest/'):])
+            if value is None:
+                self._reply(404)
+            else:
+                self._reply(200, json.dumps(value) if isinstance(value, dict) else str(value))
+
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    IMDS_BASE_URL = f'http://127.0.0.1:{server.server_port}/latest/'
+    with _token_lock:
+        _token.update(value=None, expires_at=0)
+        _imds_state['available'] = None
+    return server
+
+def get_metadata_paths(paths):
+    """并发读取多个元数据路径，paths 为 {字段名: 路径}，返回 {字段名: 值}"""
+    with ThreadPoolExecutor(max_workers=len(paths)) as executor:
+        futures = {key: executor.submit(get_instance_metadata, path) for key, path in paths.items()}
+        return {key: future.result() for key, future in futures.items()}
+
+def _format_bytes(size):
+    """按 free -h / df -h 的风格格式化字节数"""
+    for unit in ('B', 'Ki', 'Mi', 'Gi', 'Ti'):
+        if size < 1024 or unit == 'Ti':
+            return f"{size:.1f}{unit}" if unit != 'B' else f"{size}B"
+        size /= 1024
+
+def _read_key_values(path, separator=':'):
+    """读取 /proc/cpuinfo、/proc/meminfo 这类 "键: 值" 格式的文件"""
+    values = {}
+    with open(path) as f:
+        for line in f:
+            key, sep, value = line.partition(separator)
+            if sep and key.strip() not in values:
+                values[key.strip()] = value.strip()
+    return values
+
 def get_system_info():
     """获取系统信息"""
     info = {}
@@ -65,68 +249,81 @@ def get_system_info():
                     info['os_version'] = line.split('=')[1].strip().strip('"')
                     break
     except FileNotFoundError:
-        info['os_version'] = subprocess.getoutput('uname -a')
-    
-    # 获取内核版本
-    info['kernel'] = subprocess.getoutput('uname -r')
+        pass
     
-    # 获取系统架构
-    info['architecture'] = subprocess.getoutput('uname -m')
+    # 获取内核版本和系统架构
+    uname = os.uname()
+    info.setdefault('os_version', f"{uname.sysname} {uname.release} {uname.machine}")
+    info['kernel'] = uname.release
+    info['architecture'] = uname.machine
     
-    # 获取CPU信息
+    # 获取CPU信息（ARM 实例的 /proc/cpuinfo 没有 model name）
     try:
-        cpu_info = subprocess.getoutput('lscpu | grep "Model name"')
-        info['cpu_info'] = cpu_info.split(':')[-1].strip() if cpu_info else '未知'
-    except:
+        cpu_info = _read_key_values('/proc/cpuinfo')
+        info['cpu_info'] = cpu_info.get('model name') or cpu_info.get('Model') or '未知'
+    except OSError:
         info['cpu_info'] = '未知'
     
-    info['cpu_cores'] = subprocess.getoutput('nproc')
+    # 与 nproc 一致：当前进程可用的 CPU 数
+    try:
+        info['cpu_cores'] = str(len(os.sched_getaffinity(0)))
+    except AttributeError:
+        info['cpu_cores'] = str(os.cpu_count())
     
-    # 获取内存信息
+    # 获取内存信息（已用 = 总量 - 可用）
     try:
-        mem_output = subprocess.getoutput('free -h').split('\n')[1].split()
-        info['memory_total'] = mem_output[1] if len(mem_output) > 1 else '未知'
-        info['memory_used'] = mem_output[2] if len(mem_output) > 2 else '未知'
-        info['memory_free'] = mem_output[3] if len(mem_output) > 3 else '未知'
-    except:
+        meminfo = _read_key_values('/proc/meminfo')
+        total = int(meminfo['MemTotal'].split()[0]) * 1024
+        available = int(meminfo.get('MemAvailable', meminfo['MemFree']).split()[0]) * 1024
+        info['memory_total'] = _format_bytes(total)
+        info['memory_used'] = _format_bytes(total - available)
+        info['memory_free'] = _format_bytes(available)
+    except (OSError, KeyError, ValueError):
         info['memory_total'] = '未知'
         info['memory_used'] = '未知'
         info['memory_free'] = '未知'
     
-    # 获取磁盘信息
-    info['disk_info'] = subprocess.getoutput('df -h /')
+    # 获取根分区磁盘信息
+    disk = os.statvfs('/')
+    size = disk.f_blocks * disk.f_frsize
+    avail = disk.f_bavail * disk.f_frsize
+    used = size - disk.f_bfree * disk.f_frsize
+    usage = used * 100 / (used + avail) if used + avail else 0
+    info['disk_info'] = (f"{'Size':>8} {'Used':>8} {'Avail':>8} {'Use%':>5} Mounted on\n"
+                         f"{_format_bytes(size):>8} {_format_bytes(used):>8} {_format_bytes(avail):>8} {usage:>4.0f}% /")
     
     return info
 
-def get_aws_info():
-    """获取AWS信息"""
+def get_aws_info(describe=True):
+    """获取AWS信息（describe=False 时不调用 EC2 API 补充 VPC/标签等信息）"""
     aws_info = {'metadata_available': False}
     
-    # 测试元数据服务是否可用
-    test_path = 'instance-id'
-    instance_id = get_instance_metadata(test_path)
+    # 先快速探测，不可达时直接走离线回退，不再逐个请求等待超时
+    if not imds_available():
+        aws_info.update(get_dmi_info())
+        print("提示: 实例元数据服务不可达（非 EC2 环境、IMDS 已禁用或跳数限制），跳过 AWS 信息")
+        return aws_info
+    
+    # 身份文档一次返回实例ID、类型、区域等，同时也用来测试元数据服务是否可用
+    document = get_instance_identity_document()
     
-    if not instance_id:
+    if not document:
         print("警告: 无法访问实例元数据服务，AWS信息将不可用")
         return aws_info
     
     aws_info.update({
         'metadata_available': True,
-        'instance_id': instance_id,
-        'instance_type': get_instance_metadata('instance-type'),
-        'availability_zone': get_instance_metadata('placement/availability-zone'),
-        'private_ip': get_instance_metadata('local-ipv4'),
-        'public_ip': get_instance_metadata('public-ipv4'),
-        'mac_address': get_instance_metadata('mac'),
-        'security_groups': get_instance_metadata('security-groups')
+        'instance_id': document.get('instanceId'),
+        'instance_type': document.get('instanceType'),
+        'region': document.get('region'),
+        'availability_zone': document.get('availabilityZone'),
+        'private_ip': document.get('privateIp'),
+        'account_id': document.get('accountId')
     })
-    
-    # 设置区域（如果可用区存在）
-    if aws_info['availability_zone']:
-        aws_info['region'] = aws_info['availability_zone'][:-1]
+    aws_info.update(get_metadata_paths(METADATA_PATHS))
     
     # 尝试使用boto3获取更多信息
-    if HAS_BOTO3 and aws_info.get('instance_id'):
+    if describe and HAS_BOTO3 and aws_info.get('instance_id'):
         try:
             region = aws_info.get('region', 'us-east-1')  # 默认区域
             ec2 = boto3.client('ec2', region_name=region)
@@ -163,13 +360,32 @@ def save_yaml_file(data):
         print(f"保存YAML文件失败: {str(e)}")
         return False
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="收集当前 EC2 实例的系统信息和元数据")
+    parser.add_argument("--offline", action="store_true", help="不访问实例元数据服务，只收集本机信息")
+    parser.add_argument("--local-imds", nargs="?", const="", metavar="JSON_FILE",
+                        help="启动本地 IMDS 替身（用于测试），可指定 {路径: 值} 格式的 JSON 文件")
+    return parser.parse_args()
+
 def main():
+    global IMDS_DISABLED
+    args = parse_args()
     print("正在收集EC2实例信息...\n")
     
+    if args.offline:
+        IMDS_DISABLED = True
+    elif args.local_imds is not None:
+        metadata = None
+        if args.local_imds:
+            with open(args.local_imds) as f:
+                metadata = json.load(f)
+        start_local_imds(metadata)
+    
     data = {
         'timestamp': datetime.now(timezone.utc).isoformat(),
         'system_info': get_system_info(),
-        'aws_info': get_aws_info()
+        # 本地替身返回的实例 ID 不存在，不调用 EC2 API
+        'aws_info': get_aws_info(describe=args.local_imds is None)
     }
     
     # 打印信息
@@ -193,6 +409,7 @@ def main():
     if data['aws_info']['metadata_available']:
         print(f"实例ID: {data['aws_info']['instance_id']}")
         print(f"实例类型: {data['aws_info']['instance_type']}")
+        print(f"账号ID: {data['aws_info'].get('account_id', '未知')}")
         print(f"区域: {data['aws_info'].get('region', '未知')}")
         print(f"可用区: {data['aws_info'].get('availability_zone', '未知')}")
         print(f"私有IP: {data['aws_info'].get('private_ip', '未知')}")
@@ -213,6 +430,10 @@ def main():
                 print(f"  {key}: {value}")
     else:
         print("AWS元数据不可用")
+        if data['aws_info'].get('instance_id'):
+            print(f"实例ID（来自 DMI）: {data['aws_info']['instance_id']}")
+        elif data['aws_info'].get('on_ec2'):
+            print("DMI 显示运行在 EC2 上，但无法访问实例元数据服务")
     
     # 根据开关决定是否保存文件
     if EXPORT_YAML:
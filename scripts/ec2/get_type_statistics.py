@@ -1,55 +1,166 @@
-import boto3
+#!/usr/bin/env python3
+"""
+author: RJ.Wang
+Date: 2026-10-18
+email: wangrenjun@gmail.com
+Description: 统计所有区域 EC2 实例的类型、状态、系列和架构分布，并结合实例类型规格
+             汇总每个系列运行中实例的 vCPU 和内存总量（用于容量和 Savings Plan 规划）
+
+用法:
+    python get_type_statistics.py                       # 所有已启用区域
+    python get_type_statistics.py --regions ap-southeast-1 us-east-1 --csv
+"""
+import argparse
+import os
+import sys
 import csv
 from collections import Counter
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib'))
+from config import INVENTORY_MAX_AGE, get_client
+from instance_types import get_instance_type_table, instance_family
+from inventory_store import get_instances
+from region_fanout import fan_out, get_enabled_regions
+
 # 是否导出为 CSV 文件
 EXPORT_TO_CSV = False
 
-# 创建 EC2 客户端
-ec2_client = boto3.client('ec2')
-
-# 获取所有实例信息
-response = ec2_client.describe_instances()
-
-# 提取所有实例类型
-instance_types = []
-for reservation in response['Reservations']:
-    for instance in reservation['Instances']:
-        instance_types.append(instance['InstanceType'])
-
-# 统计运行中的和非运行中的实例数量
-running_count = 0
-non_running_count = 0
-
-for reservation in response['Reservations']:
-    for instance in reservation['Instances']:
-        if instance['State']['Name'] == 'running':
-            running_count += 1
-        else:
-            non_running_count += 1
-
-# 统计各个实例类型的数量
-type_counts = Counter(instance_types)
-
-# 如果没有找到任何实例
-if not type_counts:
-    print("未发现 EC2 实例。")
-else:
-    print("\nEC2 实例类型数量统计：")
+
+class TypeStatistics:
+    """实例分布统计，逐个实例累加，各区域的结果可合并"""
+
+    def __init__(self):
+        self.by_type = Counter()
+        self.by_state = Counter()
+        self.by_family = Counter()
+        self.by_architecture = Counter()
+        self.by_region = Counter()
+        # 运行中实例按 (区域, 类型) 计数，用于关联规格表
+        self.running = Counter()
+
+    def add(self, region, instance_type, state, architecture):
+        self.by_type[instance_type] += 1
+        self.by_state[state] += 1
+        self.by_family[instance_family(instance_type)] += 1
+        self.by_architecture[architecture] += 1
+        self.by_region[region] += 1
+        if state == 'running':
+            self.running[(region, instance_type)] += 1
+
+    def merge(self, other):
+        for name in ('by_type', 'by_state', 'by_family', 'by_architecture', 'by_region', 'running'):
+            getattr(self, name).update(getattr(other, name))
+
+    @property
+    def total(self):
+        return sum(self.by_type.values())
+
+    def family_capacity(self, profile=None):
+        """
+        按系列汇总运行中实例的数量、vCPU 和内存（GiB），返回 {系列: {'count', 'vcpus', 'memory_gib'}}。
+        """
+        capacity = {}
+        for (region, instance_type), count in self.running.items():
+            spec = get_instance_type_table(region, profile).get(instance_type)
+            family = capacity.setdefault(instance_family(instance_type), {'count': 0, 'vcpus': 0, 'memory_gib': 0.0})
+            family['count'] += count
+            if spec:
+                family['vcpus'] += spec['vcpus'] * count
+                family['memory_gib'] += spec['memory_mib'] / 1024 * count
+        return capacity
+
+
+def collect_region_statistics(region, profile=None):
+    """分页扫描单个区域，边读边统计，不保留实例列表"""
+    stats = TypeStatistics()
+    ec2 = get_client('ec2', region, profile)
+    for page in ec2.get_paginator('describe_instances').paginate():
+        for reservation in page['Reservations']:
+            for instance in reservation['Instances']:
+                stats.add(region, instance['InstanceType'], instance['State']['Name'],
+                          instance.get('Architecture', 'N/A'))
+    return stats
+
+
+def collect_statistics(regions, profile=None):
+    """并发统计所有区域（设置了 INVENTORY_MAX_AGE 时复用本地库存快照）"""
+    stats = TypeStatistics()
+    if INVENTORY_MAX_AGE > 0:
+        for record in get_instances(regions, profile=profile):
+            stats.add(record['region'], record['instance_type'], record['state'], record['architecture'])
+        return stats
+
+    for region, region_stats, error in fan_out(lambda r: collect_region_statistics(r, profile), regions):
+        if error is not None:
+            print(f"区域 {region} 统计失败: {error}")
+            continue
+        stats.merge(region_stats)
+    return stats
+
+
+def print_counter(title, counter, width=30):
+    print(f"\n{title}：")
     print("-" * 40)
-    for instance_type, count in type_counts.items():
-        print(f"{instance_type:<30} : {count:>3}")
+    for key, count in counter.most_common():
+        print(f"{key:<{width}} : {count:>5}")
     print("-" * 40)
 
-# 输出运行中和非运行中的实例数量
-print(f"\n运行中的 EC2 实例数量: {running_count}")
-print(f"非运行中的 EC2 实例数量: {non_running_count}")
 
-# 将结果写入 CSV 文件
-if EXPORT_TO_CSV:
+def print_statistics(stats, capacity):
+    if not stats.total:
+        print("未发现 EC2 实例。")
+        return
+
+    print_counter("EC2 实例类型数量统计", stats.by_type)
+    print_counter("按系列统计", stats.by_family)
+    print_counter("按架构统计", stats.by_architecture)
+    print_counter("按区域统计", stats.by_region)
+
+    print("\n运行中实例容量（按系列）：")
+    print("-" * 56)
+    print(f"{'系列':<12} {'实例数':>8} {'vCPU':>10} {'内存(GiB)':>14}")
+    for family, item in sorted(capacity.items(), key=lambda kv: kv[1]['vcpus'], reverse=True):
+        print(f"{family:<12} {item['count']:>8} {item['vcpus']:>10} {item['memory_gib']:>14.1f}")
+    print("-" * 56)
+    print(f"{'合计':<12} {sum(i['count'] for i in capacity.values()):>8} "
+          f"{sum(i['vcpus'] for i in capacity.values()):>10} "
+          f"{sum(i['memory_gib'] for i in capacity.values()):>14.1f}")
+
+    running_count = stats.by_state.get('running', 0)
+    print(f"\n运行中的 EC2 实例数量: {running_count}")
+    print(f"非运行中的 EC2 实例数量: {stats.total - running_count}")
+
+
+def export_csv(stats, capacity):
     with open('ec2_instance_types_count.csv', 'w', newline='') as csvfile:
         writer = csv.writer(csvfile)
         writer.writerow(['InstanceType', 'Count'])
-        for instance_type, count in type_counts.items():
+        for instance_type, count in stats.by_type.most_common():
             writer.writerow([instance_type, count])
-    print("EC2 实例类型数量已导出至 ec2_instance_types_count.csv")
+    with open('ec2_instance_family_capacity.csv', 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['Family', 'RunningCount', 'RunningVCpus', 'RunningMemoryGiB'])
+        for family, item in sorted(capacity.items()):
+            writer.writerow([family, item['count'], item['vcpus'], f"{item['memory_gib']:.1f}"])
+    print("EC2 实例类型数量已导出至 ec2_instance_types_count.csv，系列容量已导出至 ec2_instance_family_capacity.csv")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="统计 EC2 实例类型、系列和容量")
+    parser.add_argument("--regions", nargs="+", help="要统计的区域（默认所有已启用区域）")
+    parser.add_argument("--profile", help="AWS profile")
+    parser.add_argument("--csv", action="store_true", default=EXPORT_TO_CSV, help="导出为 CSV 文件")
+    args = parser.parse_args()
+
+    regions = args.regions or get_enabled_regions(profile=args.profile)
+    print(f"正在统计 {len(regions)} 个区域...")
+    stats = collect_statistics(regions, args.profile)
+    capacity = stats.family_capacity(args.profile)
+
+    print_statistics(stats, capacity)
+    if args.csv and stats.total:
+        export_csv(stats, capacity)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+author: RJ.Wang
+Date: 2026-10-18
+email: wangrenjun@gmail.com
+Description: 增量同步本地 EC2 库存快照。消费 SQS 队列中的实例状态变更事件并应用到快照，
+             只对快照中还不存在的新实例按 ID 定向 describe，全量扫描仅用于定期对账。
+
+前置条件：在每个区域创建 EventBridge 规则，把以下事件投递到同一个 SQS 队列
+（或让队列订阅 ec2_alarm_creator 使用的 SNS 主题）:
+    {"source": ["aws.ec2"], "detail-type": ["EC2 Instance State-change Notification"]}
+
+用法:
+    python sync_inventory.py --queue-url https://sqs.ap-southeast-1.amazonaws.com/123456789012/ec2-state
+    python sync_inventory.py --queue-url ... --regions ap-southeast-1 us-east-1 --reconcile-age 86400
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib'))
+from inventory_store import InventoryStore, sync_from_queue
+from region_fanout import get_enabled_regions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="根据实例状态变更事件增量同步本地 EC2 库存快照")
+    parser.add_argument("--queue-url", required=True, help="接收 EC2 状态变更事件的 SQS 队列 URL")
+    parser.add_argument("--queue-region", help="SQS 队列所在区域（默认从 URL 解析）")
+    parser.add_argument("--regions", nargs="+", help="快照覆盖的区域（默认所有已启用区域）")
+    parser.add_argument("--profile", help="AWS profile")
+    parser.add_argument("--reconcile-age", type=int, default=86400,
+                        help="距上次全量扫描超过该秒数的区域执行全量对账（默认 86400）")
+    args = parser.parse_args()
+
+    # 队列 URL 形如 https://sqs.<region>.amazonaws.com/... 或旧格式 https://<region>.queue.amazonaws.com/...
+    host_parts = args.queue_url.split("//", 1)[-1].split("/", 1)[0].split(".")
+    queue_region = args.queue_region or (host_parts[1] if host_parts[0] == "sqs" else host_parts[0])
+    regions = args.regions or get_enabled_regions(profile=args.profile)
+
+    with InventoryStore(profile=args.profile) as store:
+        # 1. 消费事件队列
+        synced_at = time.time()
+        received, applied = sync_from_queue(store, args.queue_url, queue_region)
+        print(f"收到事件 {received} 条，应用状态变更 {applied} 条")
+
+        # 2. 快照中不存在的新实例按 ID 定向补充
+        for region, instance_ids in store.pending_instances().items():
+            count = store.refresh_instances(region, instance_ids)
+            print(f"区域 {region}: 补充新实例 {count} 个")
+        store.mark_synced(regions, synced_at)
+
+        # 3. 定期全量对账
+        reconciled = store.reconcile(regions, args.reconcile_age)
+        if reconciled:
+            print(f"全量对账区域: {', '.join(sorted(reconciled))}")
+
+    print("库存快照同步完成")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,11 +4,15 @@ Date: 2024-03-14
 Description: 获取 AWS EKS 集群相关信息
 """
 
-import boto3
+import os
+import sys
 import logging
 from botocore.exceptions import ClientError
 from typing import Dict, List, Any
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib'))
+from config import get_client
+
 # 配置日志
 logging.basicConfig(
     level=logging.INFO,
@@ -22,8 +26,8 @@ class EKSClusterInfo:
         初始化 EKS 客户端
         :param region: AWS 区域，如果不指定则使用默认区域
         """
-        self.eks_client = boto3.client('eks', region_name=region)
-        self.ec2_client = boto3.client('ec2', region_name=region)
+        self.eks_client = get_client('eks', region)
+        self.ec2_client = get_client('ec2', region)
 
     def get_all_clusters(self) -> List[str]:
         """
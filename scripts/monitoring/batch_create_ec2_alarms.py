@@ -5,10 +5,15 @@ Date: 2025-03-13
 email: wangrenjun@gmail.com
 Description: Batch creation of AWS EC2 CPU utilization alarms with TAG filtering
 """
-import boto3
+import os
+import sys
 import logging
 from botocore.exceptions import ClientError
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib'))
+from config import INVENTORY_MAX_AGE, get_client
+from inventory_store import get_instances
+
 # 配置日志记录
 logging.basicConfig(
     level=logging.INFO,
@@ -26,9 +31,9 @@ TAG_VALUE = None
 #TAG_KEY = "Monitor"  # TAG 的 Key
 #TAG_VALUE = "yes"  # TAG 的 Value
 
-ec2_client = boto3.client("ec2", region_name=AWS_REGION)
-cw_client = boto3.client("cloudwatch", region_name=AWS_REGION)
-sts_client = boto3.client("sts")
+ec2_client = get_client("ec2", AWS_REGION)
+cw_client = get_client("cloudwatch", AWS_REGION)
+sts_client = get_client("sts")
 
 # 获取账号ID并缓存
 account_id = sts_client.get_caller_identity()["Account"]
@@ -37,6 +42,12 @@ def get_instance_ids():
     """
     获取所有运行的EC2实例ID，并根据TAG进行筛选
     """
+    if INVENTORY_MAX_AGE > 0:
+        # 复用本地库存快照，只在快照过期时重新扫描
+        tags = {TAG_KEY: TAG_VALUE} if TAG_KEY and TAG_VALUE else None
+        records = get_instances([AWS_REGION], states=["running"], tags=tags)
+        return [record["instance_id"] for record in records]
+
     paginator = ec2_client.get_paginator("describe_instances")
     instance_ids = []
     try:
@@ -3,12 +3,59 @@ author: RJ.Wang
 Date: 2025-03-13
 email: wangrenjun@gmail.com
 Description: A Python tool for subnetting a given CIDR and number of subnets, outputting relevant details like CIDR, IP count, gateway, and broadcast address.
+
+子网按整数运算逐个生成，不构造 ipaddress 对象列表，拆分 /8 为 /30 这类大规模划分也可以分页
+（--offset / --limit）或流式输出（--format csv / jsonl）。
+
+--vlsm 按需求（主机数或 /前缀）做可变长子网划分：从大到小依次分配，用伙伴算法拆分空闲块，
+最后列出剩余的空闲块，例如:
+    python cidr_calculator.py 10.0.0.0/16 --vlsm app=/20 db=/24 web=500 mgmt=/28
+
+--aws 按 AWS 规则规划：每个子网保留 5 个地址（网络地址、VPC 路由器、DNS、预留、广播），子网大小
+限制为 /16 ~ /28；--azs 把每个层级在各可用区各分配一个子网，--ipv6 从 VPC 的 IPv6 /56 依次分配 /64，例如:
+    python cidr_calculator.py 10.0.0.0/16 --aws --vlsm public=/24 app=/20 db=200 --azs us-east-1a us-east-1b us-east-1c \
+        --ipv6 2600:1f18:1234:5600::/56
 """
 import ipaddress
 import argparse
+import csv
+import heapq
+import json
+import socket
 import sys
+from itertools import chain
+
+# AWS 每个子网保留的地址数（网络地址、VPC 路由器、DNS、预留、广播），以及子网允许的前缀范围
+AWS_RESERVED_ADDRESSES = 5
+AWS_MIN_PREFIX = 16
+AWS_MAX_PREFIX = 28
+
+def _ipv4_str(value):
+    """整数形式的 IPv4 地址转为点分十进制字符串"""
+    return socket.inet_ntoa(value.to_bytes(4, 'big'))
+
+def iter_ipv6_subnets(cidr, new_prefix=64, offset=0, limit=None):
+    """按整数运算依次生成 IPv6 子网 CIDR（默认从 /56 等父网络切分 /64）"""
+    network = ipaddress.IPv6Network(cidr, strict=False)
+    if new_prefix < network.prefixlen or new_prefix > 128:
+        raise ValueError(f"无法从 {network.with_prefixlen} 切分 /{new_prefix}")
+    count = 1 << (new_prefix - network.prefixlen)
+    end = count if limit is None else min(count, offset + limit)
+    base = int(network.network_address)
+    step = 1 << (128 - new_prefix)
+    for index in range(max(offset, 0), end):
+        yield f"{ipaddress.IPv6Address(base + index * step)}/{new_prefix}"
 
-def subnet_division(cidr, subnets):
+def division_prefix(cidr, subnets):
+    """
+    校验子网数量并计算划分后的前缀长度。
+
+    Returns:
+        tuple: (IPv4Network, 新的前缀长度)
+
+    Raises:
+        ValueError: 子网数量超过可划分的最大数量，或不是 2 的幂
+    """
     # 将 CIDR 转换为网络对象
     network = ipaddress.IPv4Network(cidr, strict=False)
 
@@ -18,62 +65,289 @@ def subnet_division(cidr, subnets):
     # 检查请求的子网数是否超过了最大子网数
     if subnets > max_subnets:
         raise ValueError(f"子网数量需求太大。最多可划分 {max_subnets} 个子网。")
-    
+
     # 检查子网数量是否是 2 的幂
-    if (subnets & (subnets - 1)) != 0:
+    if subnets < 1 or (subnets & (subnets - 1)) != 0:
         raise ValueError("子网数量必须是 2 的幂（例如 1, 2, 4, 8, 16 等）。")
 
-    # 计算每个子网的大小（子网数目）
-    new_prefix = network.prefixlen + (subnets.bit_length() - 1)  # 计算新的子网前缀长度
-    
-    # 划分子网
-    subnets_list = list(network.subnets(new_prefix=new_prefix))
-
-    # 输出每个子网的详细信息
-    subnet_details = []
-    for i, subnet in enumerate(subnets_list, 1):  # 给每个子网加上序号
-        subnet_info = {
-            'subnet_index': i,
-            'subnet_cidr': subnet.with_prefixlen,
-            'ip_count': subnet.num_addresses,
-            'network_address': subnet.network_address,
-            'gateway_address': str(subnet.network_address + 1),
-            'broadcast_address': subnet.broadcast_address
-        }
-        subnet_details.append(subnet_info)
-    
-    return subnet_details
+    # 计算新的子网前缀长度
+    return network, network.prefixlen + (subnets.bit_length() - 1)
+
+def iter_subnets(cidr, subnets, offset=0, limit=None, aws=False, ipv6_cidr=None):
+    """
+    逐个生成子网详细信息（生成器），只做整数运算，内存占用与划分规模无关。
+
+    Args:
+        cidr (str): 原始网络，如 10.0.0.0/8
+        subnets (int): 子网数量（2 的幂）
+        offset (int): 从第几个子网开始（0 起）
+        limit (int): 最多生成多少个子网，None 表示到末尾
+        aws (bool): 按 AWS 规则输出可用主机数等信息（子网不能小于 /28）
+        ipv6_cidr (str): 同时为第 N 个子网分配 IPv6 父网络中的第 N 个 /64
+
+    Yields:
+        dict: subnet_index（1 起）、subnet_cidr、ip_count、network_address、gateway_address、broadcast_address，
+              aws 时另含 usable_hosts、first_usable、last_usable、dns_address
+    """
+    network, new_prefix = division_prefix(cidr, subnets)
+    if aws and new_prefix > AWS_MAX_PREFIX:
+        raise ValueError(f"AWS 子网最小为 /{AWS_MAX_PREFIX}，{network.with_prefixlen} 最多划分 "
+                         f"{1 << (AWS_MAX_PREFIX - network.prefixlen)} 个子网。")
+    size = 1 << (32 - new_prefix)
+    base = int(network.network_address)
+    end = subnets if limit is None else min(subnets, offset + limit)
+    ipv6_blocks = iter_ipv6_subnets(ipv6_cidr, 64, offset, limit) if ipv6_cidr else None
+    if ipv6_cidr and 1 << (64 - ipaddress.IPv6Network(ipv6_cidr, strict=False).prefixlen) < subnets:
+        raise ValueError(f"IPv6 网络 {ipv6_cidr} 的 /64 数量不足 {subnets} 个。")
+
+    for index in range(max(offset, 0), end):
+        detail = _subnet_detail(base + index * size, new_prefix, index + 1, aws)
+        if ipv6_blocks is not None:
+            detail['ipv6_cidr'] = next(ipv6_blocks)
+        yield detail
+
+def subnet_division(cidr, subnets, offset=0, limit=None, aws=False, ipv6_cidr=None):
+    """划分子网并返回详细信息列表（大规模划分请用 iter_subnets 或指定 offset / limit 分页）"""
+    return list(iter_subnets(cidr, subnets, offset, limit, aws, ipv6_cidr))
+
+def _subnet_detail(start, prefix, index, aws=False):
+    """单个 IPv4 子网（整数起始地址 + 前缀长度）的详细信息"""
+    size = 1 << (32 - prefix)
+    network_address = _ipv4_str(start)
+    detail = {
+        'subnet_index': index,
+        'subnet_cidr': f"{network_address}/{prefix}",
+        'ip_count': size,
+        'network_address': network_address,
+        'gateway_address': _ipv4_str(start + 1) if size > 1 else network_address,
+        'broadcast_address': _ipv4_str(start + size - 1)
+    }
+    if aws:
+        # 网关即 VPC 路由器（+1），+2 为 DNS，+3 保留，广播地址也不可用
+        detail.update(
+            usable_hosts=size - AWS_RESERVED_ADDRESSES,
+            first_usable=_ipv4_str(start + 4),
+            last_usable=_ipv4_str(start + size - 2),
+            dns_address=_ipv4_str(start + 2)
+        )
+    return detail
+
+def prefix_for_hosts(hosts, reserved=2):
+    """容纳 hosts 个主机所需的最长前缀（每个子网保留 reserved 个地址，默认网络地址和广播地址）"""
+    needed = hosts + reserved
+    if needed > 1 << 32:
+        raise ValueError(f"主机数 {hosts} 超出 IPv4 地址空间")
+    return 32 - max(0, (needed - 1).bit_length())
+
+def parse_requirement(text, reserved=2):
+    """
+    解析子网需求：'/24' 表示前缀长度，'500' 表示主机数，可带名称前缀 'web=500'。
+
+    Returns:
+        tuple: (名称, 原始需求, 前缀长度)
+    """
+    name, sep, spec = text.partition('=')
+    if not sep:
+        name, spec = '', text
+    spec = spec.strip()
+    try:
+        if spec.startswith('/'):
+            prefix = int(spec[1:])
+            if not 0 <= prefix <= 32:
+                raise ValueError
+        else:
+            prefix = prefix_for_hosts(int(spec), reserved)
+    except ValueError:
+        raise ValueError(f"无法解析子网需求: {text}（应为主机数或 /前缀，如 500、/24、web=/24）")
+    return name.strip(), spec, prefix
+
+def vlsm_allocate(cidr, requirements, reserved=2):
+    """
+    可变长子网划分（伙伴分配）。
+
+    需求按所需块从大到小依次分配：每次取能容纳需求的最小空闲块（同样大小时取地址最低的），
+    不够小就对半拆分，另一半放回空闲表。分配完成后空闲表中剩下的就是未使用的地址块。
+
+    Args:
+        cidr (str): 父网络
+        requirements (list): 需求列表，元素为主机数（int）、'/前缀' 或 '名称=需求' 字符串
+        reserved (int): 每个子网不可分配给主机的地址数
+
+    Returns:
+        tuple: (分配结果列表（按需求顺序，含 name / requested / usable_hosts）, 剩余空闲块 CIDR 列表（按地址排序）)
+
+    Raises:
+        ValueError: 需求无法解析或父网络空间不足
+    """
+    network = ipaddress.IPv4Network(cidr, strict=False)
+    parsed = [parse_requirement(str(item), reserved) for item in requirements]
+    starts, free_blocks = _buddy_allocate(network, [prefix for _, _, prefix in parsed],
+                                          [requested for _, requested, _ in parsed])
+
+    allocated = []
+    for position, ((name, requested, prefix), start) in enumerate(zip(parsed, starts)):
+        detail = _subnet_detail(start, prefix, position + 1)
+        detail.update(name=name, requested=requested, usable_hosts=max(0, detail['ip_count'] - reserved))
+        allocated.append(detail)
+    return allocated, free_blocks
+
+def _buddy_allocate(network, prefixes, labels):
+    """
+    伙伴分配：按前缀从短到长（块从大到小）依次分配，返回 (按输入顺序的起始地址列表, 剩余空闲块 CIDR 列表)。
+    """
+    # 空闲表：前缀长度 -> 起始地址的最小堆
+    free = {network.prefixlen: [int(network.network_address)]}
+    starts = [None] * len(prefixes)
+
+    for position in sorted(range(len(prefixes)), key=lambda i: (prefixes[i], i)):
+        prefix = prefixes[position]
+        if prefix < network.prefixlen:
+            raise ValueError(f"需求 {labels[position]} 大于父网络 {network.with_prefixlen}")
+        # 找能容纳需求的最小空闲块
+        block_prefix = next((p for p in range(prefix, network.prefixlen - 1, -1) if free.get(p)), None)
+        if block_prefix is None:
+            raise ValueError(f"父网络 {network.with_prefixlen} 剩余空间不足，无法分配 {labels[position]}（/{prefix}）")
+        start = heapq.heappop(free[block_prefix])
+        # 逐级对半拆分，高地址的一半放回空闲表
+        while block_prefix < prefix:
+            block_prefix += 1
+            heapq.heappush(free.setdefault(block_prefix, []), start + (1 << (32 - block_prefix)))
+        starts[position] = start
+
+    free_blocks = sorted((start, prefix) for prefix, starts_ in free.items() for start in starts_)
+    return starts, [f"{_ipv4_str(start)}/{prefix}" for start, prefix in free_blocks]
+
+def aws_plan(vpc_cidr, tiers, azs=None, ipv6_cidr=None):
+    """
+    按 AWS 规则规划 VPC 子网。
+
+    每个层级（主机数或 /前缀，可带名称，如 app=/20、db=200）在每个可用区各分配一个子网，
+    主机数按每个子网保留 5 个地址换算，不足 /28 的按 /28 分配；指定 ipv6_cidr（通常为 /56）时
+    按输出顺序为每个子网分配一个 /64。
+
+    Returns:
+        tuple: (子网列表（按层级、可用区顺序，含 name / az / requested / usable_hosts / first_usable /
+                last_usable / dns_address / ipv6_cidr）, 剩余空闲块 CIDR 列表)
+
+    Raises:
+        ValueError: VPC 或子网大小超出 AWS 限制、空间不足或 IPv6 /64 数量不足
+    """
+    network = ipaddress.IPv4Network(vpc_cidr, strict=False)
+    if not AWS_MIN_PREFIX <= network.prefixlen <= AWS_MAX_PREFIX:
+        raise ValueError(f"AWS VPC 的 CIDR 必须在 /{AWS_MIN_PREFIX} ~ /{AWS_MAX_PREFIX} 之间")
+    azs = azs or [None]
+
+    planned = []
+    for tier in tiers:
+        name, requested, prefix = parse_requirement(str(tier), AWS_RESERVED_ADDRESSES)
+        if prefix < AWS_MIN_PREFIX:
+            raise ValueError(f"需求 {requested} 超过 AWS 子网上限 /{AWS_MIN_PREFIX}")
+        prefix = min(prefix, AWS_MAX_PREFIX)
+        planned.extend((name, az, requested, prefix) for az in azs)
+
+    ipv6_blocks = []
+    if ipv6_cidr:
+        ipv6_blocks = list(iter_ipv6_subnets(ipv6_cidr, 64, 0, len(planned)))
+        if len(ipv6_blocks) < len(planned):
+            raise ValueError(f"IPv6 网络 {ipv6_cidr} 只能切分 {len(ipv6_blocks)} 个 /64，需要 {len(planned)} 个")
+
+    starts, free_blocks = _buddy_allocate(network, [item[3] for item in planned],
+                                          [f"{item[0] or item[2]}@{item[1]}" if item[1] else item[2]
+                                           for item in planned])
+    subnets = []
+    for position, ((name, az, requested, prefix), start) in enumerate(zip(planned, starts)):
+        detail = _subnet_detail(start, prefix, position + 1, aws=True)
+        detail.update(name=name, az=az or '', requested=requested)
+        if ipv6_blocks:
+            detail['ipv6_cidr'] = ipv6_blocks[position]
+        subnets.append(detail)
+    return subnets, free_blocks
+
+def write_subnets(details, output_format='text', out=sys.stdout):
+    """把子网详细信息逐条写出：text（原来的格式）、csv 或 jsonl"""
+    if output_format == 'csv':
+        writer = csv.writer(out)
+        header = False
+        for detail in details:
+            if not header:
+                writer.writerow(detail.keys())
+                header = True
+            writer.writerow(detail.values())
+    elif output_format == 'jsonl':
+        for detail in details:
+            out.write(json.dumps(detail) + '\n')
+    else:
+        for detail in details:
+            label = ''
+            if 'requested' in detail:
+                az = f"，{detail['az']}" if detail.get('az') else ''
+                label = f"（{detail['name'] or '-'}{az}，需求 {detail['requested']}，可用主机 {detail['usable_hosts']}）"
+            lines = [
+                f"子网 {detail['subnet_index']}: {detail['subnet_cidr']}{label}",
+                f"  包含 IP 数量: {detail['ip_count']}",
+                f"  网络地址: {detail['network_address']}",
+                f"  默认网关: {detail['gateway_address']}",
+                f"  广播地址: {detail['broadcast_address']}"
+            ]
+            if 'first_usable' in detail:
+                lines.insert(2, f"  可用主机: {detail['usable_hosts']}（{detail['first_usable']} - {detail['last_usable']}）")
+                lines.insert(5, f"  DNS 地址: {detail['dns_address']}")
+            if 'ipv6_cidr' in detail:
+                lines.append(f"  IPv6 CIDR: {detail['ipv6_cidr']}")
+            out.write("\n".join(lines) + "\n\n")
+
 def main():
     # 设置命令行参数解析
     parser = argparse.ArgumentParser(description="根据 CIDR 和子网数量划分子网")
     parser.add_argument("cidr", help="CIDR 地址 (例如：192.168.123.0/24)")
-    parser.add_argument("subnets", type=int, help="需要划分的子网数量")
-    
+    parser.add_argument("subnets", type=int, nargs="?", help="需要划分的子网数量（2 的幂）")
+    parser.add_argument("--vlsm", nargs="+", metavar="REQ",
+                        help="可变长划分：每项为主机数或 /前缀，可带名称，如 app=/20 web=500 /28")
+    parser.add_argument("--aws", action="store_true", help="按 AWS 规则规划（每个子网保留 5 个地址，/16 ~ /28）")
+    parser.add_argument("--azs", nargs="+", help="与 --aws --vlsm 一起使用：每个层级在每个可用区各分配一个子网")
+    parser.add_argument("--ipv6", help="VPC 的 IPv6 CIDR（如 /56），为每个子网依次分配一个 /64")
+    parser.add_argument("--offset", type=int, default=0, help="从第几个子网开始输出（0 起）")
+    parser.add_argument("--limit", type=int, help="最多输出多少个子网")
+    parser.add_argument("--format", choices=["text", "csv", "jsonl"], default="text", help="输出格式（默认 text）")
+
     # 检查是否需要显示帮助信息
     if len(sys.argv) == 1:
         parser.print_help()
         sys.exit(1)
-    
+
     # 解析命令行参数
     args = parser.parse_args()
-    
+
+    if args.subnets is None and not args.vlsm:
+        parser.error("需要指定子网数量或 --vlsm")
+
     try:
-        # 调用 subnet_division 函数
-        subnet_details = subnet_division(args.cidr, args.subnets)
-
-        # 打印输出
-        for detail in subnet_details:
-            print(f"子网 {detail['subnet_index']}: {detail['subnet_cidr']}")
-            print(f"  包含 IP 数量: {detail['ip_count']}")
-            print(f"  网络地址: {detail['network_address']}")
-            print(f"  默认网关: {detail['gateway_address']}")
-            print(f"  广播地址: {detail['broadcast_address']}")
-            print()
-    
+        if args.vlsm:
+            if args.aws:
+                allocated, free_blocks = aws_plan(args.cidr, args.vlsm, args.azs, args.ipv6)
+            else:
+                allocated, free_blocks = vlsm_allocate(args.cidr, args.vlsm)
+            write_subnets(allocated, args.format)
+            if args.format == 'text':
+                print(f"剩余空闲块（{len(free_blocks)} 个）:")
+                for block in free_blocks:
+                    print(f"  {block}")
+            else:
+                print(f"剩余空闲块: {' '.join(free_blocks) or '无'}", file=sys.stderr)
+            return
+
+        # 先校验参数，再边生成边输出
+        details = iter_subnets(args.cidr, args.subnets, args.offset, args.limit, args.aws, args.ipv6)
+        first = next(details, None)
+        write_subnets(chain([first], details) if first else [], args.format)
+
     except ValueError as e:
         # 输出错误信息
         print(f"错误: {e}")
         sys.exit(1)
+    except BrokenPipeError:
+        # 输出通过管道交给 head 等命令时提前结束
+        sys.stderr.close()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,297 @@
+#!/usr/bin/env python3
+"""
+author: RJ.Wang
+Date: 2026-10-18
+email: wangrenjun@gmail.com
+Description: 收集各区域（可选组织内多个账号）所有 VPC / 子网的 CIDR，建立按起始地址排序的区间索引，
+用于 Transit Gateway / Peering 规划时的冲突检查和地址空间查找，不再需要在表格里两两比较。
+
+CIDR 块要么互相包含、要么互不相交，因此:
+- 与 X 重叠的块 = X 内部的块（bisect 定位起止区间）+ 包含 X 的块（按前缀逐级查表，最多 32 / 128 次）
+- 列出所有重叠 = 排序后一次扫描，用栈维护当前仍"打开"的块
+- 下一个空闲 /N = 从超网起点按 /N 对齐尝试，遇到冲突直接跳到冲突块末尾之后
+
+用法:
+    python cidr_index.py --check 10.1.0.0/16 172.16.0.0/12
+    python cidr_index.py --overlaps
+    python cidr_index.py --next-free 20 --supernet 10.0.0.0/8 --count 4
+    python cidr_index.py --org --output cidrs.jsonl            # 扫描组织内所有账号并保存
+    python cidr_index.py --input cidrs.jsonl --next-free 24 --supernet 10.20.0.0/16
+"""
+import argparse
+import ipaddress
+import json
+import os
+import sys
+from bisect import bisect_left, bisect_right
+from itertools import islice
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib'))
+from config import get_client
+from org_fanout import DEFAULT_ROLE_NAME, fan_out_accounts, list_organization_accounts
+from region_fanout import fan_out
+
+# 保存 / 读取的记录字段
+FIELDS = ['cidr', 'kind', 'account_id', 'region', 'vpc_id', 'subnet_id', 'name']
+
+
+def _name_tag(resource):
+    """从 Tags 中取 Name 标签"""
+    for tag in resource.get('Tags', []):
+        if tag['Key'] == 'Name':
+            return tag['Value']
+    return ''
+
+
+def load_region_cidrs(region, profile=None):
+    """
+    读取单个区域内所有 VPC（含附加 CIDR 和 IPv6）与子网的 CIDR；profile 可以是 org_fanout 返回的跨账号会话名称。
+
+    Returns:
+        list: 记录字典列表，字段见 FIELDS，kind 为 vpc 或 subnet
+    """
+    ec2 = get_client('ec2', region, profile)
+    records = []
+
+    for page in ec2.get_paginator('describe_vpcs').paginate():
+        for vpc in page['Vpcs']:
+            base = {'kind': 'vpc', 'account_id': vpc.get('OwnerId', ''), 'region': region,
+                    'vpc_id': vpc['VpcId'], 'subnet_id': '', 'name': _name_tag(vpc)}
+            for association in vpc.get('CidrBlockAssociationSet', []):
+                if association.get('CidrBlockState', {}).get('State') == 'associated':
+                    records.append(dict(base, cidr=association['CidrBlock']))
+            for association in vpc.get('Ipv6CidrBlockAssociationSet', []):
+                if association.get('Ipv6CidrBlockState', {}).get('State') == 'associated':
+                    records.append(dict(base, cidr=association['Ipv6CidrBlock']))
+
+    for page in ec2.get_paginator('describe_subnets').paginate():
+        for subnet in page['Subnets']:
+            base = {'kind': 'subnet', 'account_id': subnet.get('OwnerId', ''), 'region': region,
+                    'vpc_id': subnet['VpcId'], 'subnet_id': subnet['SubnetId'], 'name': _name_tag(subnet)}
+            records.append(dict(base, cidr=subnet['CidrBlock']))
+            for association in subnet.get('Ipv6CidrBlockAssociationSet', []):
+                if association.get('Ipv6CidrBlockState', {}).get('State') == 'associated':
+                    records.append(dict(base, cidr=association['Ipv6CidrBlock']))
+    return records
+
+
+def iter_region_cidrs(regions=None, max_workers=32):
+    """并发读取当前账号各区域的 CIDR，按完成顺序产出记录"""
+    for region, records, error in fan_out(load_region_cidrs, regions, max_workers=max_workers):
+        if error is not None:
+            print(f"区域 {region} 处理失败: {error}", file=sys.stderr)
+            continue
+        yield from records
+
+
+def iter_org_cidrs(accounts, regions=None, role_name=DEFAULT_ROLE_NAME, max_workers=32):
+    """在多个账号中 AssumeRole 后并发读取各区域的 CIDR，按完成顺序产出记录"""
+    for account_id, region, records, error in fan_out_accounts(
+            load_region_cidrs, accounts, regions, role_name, max_workers=max_workers):
+        if error is not None:
+            target = f"账号 {account_id} 区域 {region}" if region else f"账号 {account_id}"
+            print(f"{target} 处理失败: {error}", file=sys.stderr)
+            continue
+        yield from records
+
+
+def _span(cidr):
+    """CIDR 转为 (IP 版本, 起始地址整数, 结束地址整数, 前缀长度)"""
+    network = ipaddress.ip_network(cidr, strict=False)
+    start = int(network.network_address)
+    return network.version, start, start + network.num_addresses - 1, network.prefixlen
+
+
+class CidrIndex:
+    """
+    CIDR 区间索引：按 (IP 版本, 起始地址) 排序，另按 (版本, 起始地址, 前缀) 建立哈希表查找包含关系。
+
+    同一资源的同一 CIDR（如通过 RAM 共享、在多个账号中都能看到的子网）只保留一条。
+    """
+
+    def __init__(self, records):
+        seen = set()
+        items = []
+        for record in records:
+            key = (record['kind'], record['subnet_id'] or record['vpc_id'], record['cidr'])
+            if key in seen:
+                continue
+            seen.add(key)
+            items.append(_span(record['cidr']) + (record,))
+        items.sort(key=lambda item: item[:2] + (item[3],))
+
+        self._items = items
+        self._keys = [item[:2] for item in items]
+        self._blocks = {}
+        for item in items:
+            self._blocks.setdefault((item[0], item[1], item[3]), []).append(item)
+
+    def __len__(self):
+        return len(self._items)
+
+    def _overlapping(self, version, start, end, prefix):
+        """与给定块重叠的索引项：先查包含它的祖先块，再用 bisect 取出它内部的块"""
+        bits = 32 if version == 4 else 128
+        result = []
+        for parent_prefix in range(prefix):
+            parent_start = start & ~((1 << (bits - parent_prefix)) - 1)
+            # 起点相同的祖先块会出现在下面的 bisect 区间里，这里跳过以免重复
+            if parent_start < start:
+                result.extend(self._blocks.get((version, parent_start, parent_prefix), ()))
+        low = bisect_left(self._keys, (version, start))
+        high = bisect_right(self._keys, (version, end))
+        result.extend(self._items[low:high])
+        return result
+
+    def overlapping(self, cidr):
+        """返回与 cidr 重叠（包含、被包含或相同）的所有记录"""
+        return [item[4] for item in self._overlapping(*_span(cidr))]
+
+    def overlaps(self, kind='vpc'):
+        """
+        列出不同 VPC 之间的 CIDR 重叠，产出 (记录 A, 记录 B)，A 为较大（或相同）的块。
+
+        默认只比较 VPC 的 CIDR（子网必然落在所属 VPC 内，重复报告没有意义）。
+        """
+        stack = []
+        for item in self._items:
+            if kind and item[4]['kind'] != kind:
+                continue
+            version, start = item[0], item[1]
+            # 弹出已结束的块，栈中剩下的都包含当前块
+            while stack and (stack[-1][0] != version or stack[-1][2] < start):
+                stack.pop()
+            record = item[4]
+            owner = (record['account_id'], record['region'], record['vpc_id'])
+            for open_item in stack:
+                other = open_item[4]
+                if (other['account_id'], other['region'], other['vpc_id']) != owner:
+                    yield other, record
+            stack.append(item)
+
+    def iter_free(self, supernet, prefix):
+        """
+        在 supernet 内按地址顺序产出未被占用的 /prefix 块。
+
+        包含整个 supernet 的记录（如在某个 VPC 内规划子网时的 VPC 本身）不算占用。
+
+        Raises:
+            ValueError: prefix 比 supernet 的前缀更短或超出地址位数
+        """
+        version, super_start, super_end, super_prefix = _span(supernet)
+        bits = 32 if version == 4 else 128
+        if not super_prefix <= prefix <= bits:
+            raise ValueError(f"无法在 {supernet} 中查找 /{prefix}")
+        size = 1 << (bits - prefix)
+
+        candidate = super_start
+        while candidate + size - 1 <= super_end:
+            conflicts = [
+                item for item in self._overlapping(version, candidate, candidate + size - 1, prefix)
+                if not (item[1] <= super_start and item[2] >= super_end)
+            ]
+            if not conflicts:
+                yield f"{ipaddress.ip_address(candidate)}/{prefix}"
+                candidate += size
+                continue
+            # 跳到冲突块之后，再按 /prefix 对齐
+            candidate = max(item[2] for item in conflicts) + 1
+            candidate = (candidate + size - 1) & ~(size - 1)
+
+    def next_free(self, supernet, prefix, count=1):
+        """返回 supernet 内前 count 个空闲的 /prefix 块"""
+        return list(islice(self.iter_free(supernet, prefix), count))
+
+
+def read_records(path):
+    """读取 --output 保存的 JSONL 记录"""
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def write_records(records, path):
+    """把记录保存为 JSONL，供 --input 离线查询"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps({field: record.get(field, '') for field in FIELDS}, ensure_ascii=False) + "\n")
+
+
+def format_record(record):
+    """单条记录的一行描述"""
+    resource = record['subnet_id'] or record['vpc_id']
+    name = f" ({record['name']})" if record['name'] else ''
+    return f"{record['cidr']:<20} {record['kind']:<7} {resource}{name}  账号 {record['account_id']}  {record['region']}"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="VPC / 子网 CIDR 重叠检查与空闲地址查找")
+    parser.add_argument("--regions", nargs="+", help="要扫描的区域（默认所有已启用区域）")
+    parser.add_argument("--org", action="store_true", help="扫描组织内所有 ACTIVE 账号（需管理账号权限）")
+    parser.add_argument("--accounts", nargs="+", help="只扫描指定的账号 ID（通过 AssumeRole 访问）")
+    parser.add_argument("--role-name", default=DEFAULT_ROLE_NAME, help=f"在成员账号中扮演的角色（默认 {DEFAULT_ROLE_NAME}）")
+    parser.add_argument("--max-workers", type=int, default=32, help="并发上限（默认 32）")
+    parser.add_argument("--input", help="从 --output 保存的 JSONL 文件加载，不调用 AWS API")
+    parser.add_argument("--output", help="把收集到的 CIDR 记录保存为 JSONL")
+    parser.add_argument("--check", nargs="+", metavar="CIDR", help="检查这些 CIDR 是否与已有 VPC / 子网重叠")
+    parser.add_argument("--overlaps", action="store_true", help="列出不同 VPC 之间的 CIDR 重叠")
+    parser.add_argument("--next-free", type=int, metavar="PREFIX", help="在 --supernet 中查找空闲的 /PREFIX 块")
+    parser.add_argument("--supernet", help="与 --next-free 一起使用的超网，如 10.0.0.0/8")
+    parser.add_argument("--count", type=int, default=1, help="--next-free 返回的块数（默认 1）")
+    args = parser.parse_args()
+    if args.next_free is not None and not args.supernet:
+        parser.error("--next-free 需要同时指定 --supernet")
+    return args
+
+
+def main():
+    args = parse_args()
+
+    if args.input:
+        records = read_records(args.input)
+    elif args.org or args.accounts:
+        accounts = args.accounts or [account['id'] for account in list_organization_accounts()]
+        print(f"正在扫描 {len(accounts)} 个账号...", file=sys.stderr)
+        records = list(iter_org_cidrs(accounts, args.regions, args.role_name, args.max_workers))
+    else:
+        records = list(iter_region_cidrs(args.regions, args.max_workers))
+
+    if args.output:
+        write_records(records, args.output)
+        print(f"已保存 {len(records)} 条记录到 {args.output}", file=sys.stderr)
+
+    index = CidrIndex(records)
+    print(f"索引中共有 {len(index)} 个 CIDR 块", file=sys.stderr)
+    exit_code = 0
+
+    try:
+        for cidr in args.check or []:
+            matches = index.overlapping(cidr)
+            print(f"\n{cidr}: {'与 %d 个块重叠' % len(matches) if matches else '无重叠'}")
+            for record in matches:
+                print(f"  {format_record(record)}")
+            if matches:
+                exit_code = 2
+
+        if args.overlaps:
+            pairs = list(index.overlaps())
+            print(f"\nVPC CIDR 重叠: {len(pairs)} 组")
+            for outer, inner in pairs:
+                print(f"  {format_record(outer)}\n    <-> {format_record(inner)}")
+            if pairs:
+                exit_code = 2
+
+        if args.next_free is not None:
+            blocks = index.next_free(args.supernet, args.next_free, args.count)
+            print(f"\n{args.supernet} 中空闲的 /{args.next_free}:")
+            for block in blocks:
+                print(f"  {block}")
+            if len(blocks) < args.count:
+                print(f"  （只找到 {len(blocks)} 个）")
+    except ValueError as e:
+        print(f"错误: {e}")
+        return 1
+    return exit_code
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,74 +4,136 @@ Date: 2025-03-13
 email: wangrenjun@gmail.com
 Description: This tool helps users automatically calculate and output detailed information for each subnet based on a given CIDR network address and the required number of subnets. The details include the subnet’s CIDR address, IP address count, network address, gateway address, and broadcast address. Users simply need to enter the CIDR address and subnet number on the web page, and the tool will perform the subnet division and display the results. If the subnet number is not a power of 2 or exceeds the maximum number of subnets that can be divided, the tool will prompt an error message.
 """
-from flask import Flask, render_template, request, redirect, url_for
+from flask import Flask, Response, jsonify, render_template, request, redirect, stream_with_context, url_for
+from functools import lru_cache
+import csv
+import io
+from itertools import chain
 import ipaddress
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from cidr_calculator import aws_plan, division_prefix, iter_subnets, vlsm_allocate
 
 app = Flask(__name__)
 
-def subnet_division(cidr, subnets):
+# 网页和 JSON API 每页默认 / 最多返回的子网数；更大的结果请用 /api/subnets/stream 流式获取
+PAGE_SIZE = 256
+MAX_PAGE_SIZE = 10000
+# 流式输出时每次写出的行数
+STREAM_CHUNK_ROWS = 1000
+
+def _split_list(value):
+    """逗号或空格分隔的字符串（或 JSON 数组）转为列表"""
+    if isinstance(value, (list, tuple)):
+        return [str(item) for item in value]
+    return str(value or "").replace(",", " ").split()
+
+def _read_params():
+    """
+    读取请求参数（表单、查询字符串或 JSON 请求体），统一规范化，便于作为缓存键。
+
+    Returns:
+        dict: cidr、subnets、requirements、aws、azs、ipv6_cidr
+    """
+    values = request.get_json(silent=True) or request.values
+    cidr = str(values.get("cidr", "")).strip()
+    if not cidr:
+        raise ValueError("请填写 CIDR 地址。")
+    try:
+        # 规范化为网络地址，10.0.0.5/16 与 10.0.0.0/16 共用缓存
+        cidr = ipaddress.IPv4Network(cidr, strict=False).with_prefixlen
+    except ValueError:
+        raise ValueError(f"无效的 CIDR 地址: {cidr}")
+
+    subnets = str(values.get("subnets", "")).strip()
+    ipv6_cidr = str(values.get("ipv6", "") or "").strip() or None
+    return {
+        'cidr': cidr,
+        'subnets': int(subnets) if subnets.isdigit() else None,
+        # 可变长划分需求（逗号或空格分隔的主机数 / 前缀），填写后忽略子网数量
+        'requirements': tuple(_split_list(values.get("requirements"))),
+        # AWS 模式：每个子网保留 5 个地址，可按可用区分布层级、分配 IPv6 /64
+        'aws': str(values.get("aws", "")).lower() in ("on", "1", "true"),
+        'azs': tuple(_split_list(values.get("azs"))),
+        'ipv6_cidr': ipaddress.IPv6Network(ipv6_cidr, strict=False).with_prefixlen if ipv6_cidr else None
+    }
+
+def _read_page(values):
+    """读取分页参数 offset / limit（limit 不超过 MAX_PAGE_SIZE）"""
+    try:
+        offset = max(int(values.get("offset", 0)), 0)
+        limit = min(max(int(values.get("limit", PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+    except (TypeError, ValueError):
+        raise ValueError("offset 和 limit 必须是整数。")
+    return offset, limit
+
+@lru_cache(maxsize=256)
+def cached_division_page(cidr, subnets, offset, limit, aws=False, ipv6_cidr=None):
     """
-    该函数接受 CIDR 和子网数量，计算出所有子网的 CIDR、IP 数量、网络地址、网关地址和广播地址。
-    
-    参数:
-    cidr (str): 原始的网络地址，采用 CIDR 格式（如 192.168.123.0/24）
-    subnets (int): 需要划分的子网数量
-    
-    返回:
-    list: 包含每个子网详细信息的列表，包括子网 CIDR、IP 数量、网络地址、网关地址和广播地址。
-    
-    异常:
-    ValueError: 如果请求的子网数目超过了可以划分的最大子网数，或子网数目不是 2 的幂次方，抛出此异常。
+    缓存最近计算过的划分结果页，键为 (cidr, 子网数量, offset, limit, AWS 模式, IPv6 CIDR)。
+
+    只缓存单页（最多 MAX_PAGE_SIZE 个子网），大规模划分不会占满内存；返回元组，调用方不要修改其中的字典。
     """
-    # 检查子网数量是否是 2 的幂次方
-    if (subnets & (subnets - 1)) != 0:
-        raise ValueError("子网数量必须是 2 的幂次方。")
-
-    # 将 CIDR 转换为网络对象
-    network = ipaddress.IPv4Network(cidr, strict=False)
-
-    # 计算最大可以划分的子网数
-    max_subnets = 2 ** (32 - network.prefixlen)
-
-    # 检查请求的子网数是否超过了最大子网数
-    if subnets > max_subnets:
-        raise ValueError(f"子网数量需求太大。最多可划分 {max_subnets} 个子网。")
-
-    # 计算每个子网的大小（子网数目）
-    new_prefix = network.prefixlen + (subnets.bit_length() - 1)  # 计算新的子网前缀长度
-    
-    # 划分子网
-    subnets_list = list(network.subnets(new_prefix=new_prefix))
-
-    # 输出每个子网的详细信息
-    subnet_details = []
-    for i, subnet in enumerate(subnets_list, 1):  # 给每个子网加上序号
-        subnet_info = {
-            'subnet_index': i,
-            'subnet_cidr': subnet.with_prefixlen,
-            'ip_count': subnet.num_addresses,
-            'network_address': subnet.network_address,
-            'gateway_address': str(subnet.network_address + 1),
-            'broadcast_address': subnet.broadcast_address
-        }
-        subnet_details.append(subnet_info)
-    
-    return subnet_details
+    return tuple(iter_subnets(cidr, subnets, offset, limit, aws, ipv6_cidr))
+
+@lru_cache(maxsize=256)
+def cached_plan(cidr, requirements, aws=False, azs=(), ipv6_cidr=None):
+    """缓存最近计算过的可变长划分 / AWS 规划结果，返回 (子网元组, 空闲块元组)"""
+    if aws:
+        allocated, free_blocks = aws_plan(cidr, list(requirements), list(azs), ipv6_cidr)
+    else:
+        allocated, free_blocks = vlsm_allocate(cidr, list(requirements))
+    return tuple(allocated), tuple(free_blocks)
+
+def _division_page(params, offset, limit):
+    """按参数计算一页划分结果，返回 (子网列表, 子网总数)"""
+    if params['subnets'] is None:
+        raise ValueError("请填写子网数量，或填写可变长划分需求。")
+    # 先校验参数，错误不会进入缓存
+    division_prefix(params['cidr'], params['subnets'])
+    details = cached_division_page(params['cidr'], params['subnets'], offset, limit,
+                                   params['aws'], params['ipv6_cidr'])
+    return details, params['subnets']
+
+def _page_query(params, limit):
+    """结果页链接的查询参数"""
+    query = {'cidr': params['cidr'], 'subnets': params['subnets'], 'limit': limit}
+    if params['aws']:
+        query['aws'] = 'on'
+    if params['ipv6_cidr']:
+        query['ipv6'] = params['ipv6_cidr']
+    return query
+
+def _page_links(params, offset, limit, total):
+    """结果页的上一页 / 下一页链接"""
+    query = _page_query(params, limit)
+    links = {}
+    if offset > 0:
+        links['prev_url'] = url_for("subnets_page", offset=max(offset - limit, 0), **query)
+    if offset + limit < total:
+        links['next_url'] = url_for("subnets_page", offset=offset + limit, **query)
+    return links
 
 @app.route("/", methods=["GET", "POST"])
 def index():
     """
     主页路由，处理用户输入和展示计算结果。
-    用户可以输入 CIDR 和子网数量，提交后进行子网划分计算，结果将展示在新页面中。
+    用户可以输入 CIDR 和子网数量，提交后跳转到分页的结果页；填写可变长划分需求时直接展示规划结果。
     """
     if request.method == "POST":
-        cidr = request.form["cidr"]  # 获取用户输入的 CIDR 地址
-        subnets = int(request.form["subnets"])  # 获取用户输入的子网数量
-
         try:
-            # 调用子网划分函数进行计算
-            subnet_details = subnet_division(cidr, subnets)
-            return render_template("result.html", subnet_details=subnet_details)
+            params = _read_params()
+            if params['requirements']:
+                subnet_details, free_blocks = cached_plan(params['cidr'], params['requirements'], params['aws'],
+                                                          params['azs'], params['ipv6_cidr'])
+                return render_template("result.html", subnet_details=subnet_details, free_blocks=free_blocks)
+
+            # 先校验，再跳转到可分页、可收藏的 GET 结果页
+            _division_page(params, 0, 1)
+            return redirect(url_for("subnets_page", offset=0, **_page_query(params, PAGE_SIZE)))
         except ValueError as e:
             # 如果计算出错（如子网数量过多或不是 2 的幂次方），显示错误信息
             return render_template("index.html", error=str(e))
@@ -79,11 +141,99 @@ def index():
     # 如果是 GET 请求，返回首页，用户可以输入 CIDR 和子网数量
     return render_template("index.html")
 
+@app.route("/subnets")
+def subnets_page():
+    """分页展示子网划分结果（每页默认 PAGE_SIZE 个）"""
+    try:
+        params = _read_params()
+        offset, limit = _read_page(request.args)
+        subnet_details, total = _division_page(params, offset, limit)
+    except ValueError as e:
+        return render_template("index.html", error=str(e))
+    return render_template("result.html", subnet_details=subnet_details, total=total, offset=offset,
+                           stream_url=url_for("api_subnets_stream", **_page_query(params, None)),
+                           **_page_links(params, offset, limit, total))
+
+@app.route("/api/subnets", methods=["GET", "POST"])
+def api_subnets():
+    """
+    JSON API：子网划分（分页）或可变长划分 / AWS 规划。
+
+    参数（查询字符串、表单或 JSON）：cidr、subnets 或 requirements、aws、azs、ipv6、offset、limit。
+    划分结果返回 {cidr, total, offset, limit, next_offset, subnets}，next_offset 为 null 表示已到末尾；
+    规划结果返回 {cidr, subnets, free_blocks}。
+    """
+    try:
+        params = _read_params()
+        if params['requirements']:
+            allocated, free_blocks = cached_plan(params['cidr'], params['requirements'], params['aws'],
+                                                 params['azs'], params['ipv6_cidr'])
+            return jsonify(cidr=params['cidr'], subnets=list(allocated), free_blocks=list(free_blocks))
+
+        offset, limit = _read_page(request.get_json(silent=True) or request.values)
+        details, total = _division_page(params, offset, limit)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(
+        cidr=params['cidr'],
+        total=total,
+        offset=offset,
+        limit=limit,
+        next_offset=offset + limit if offset + limit < total else None,
+        subnets=list(details)
+    )
+
+@app.route("/api/subnets/stream", methods=["GET", "POST"])
+def api_subnets_stream():
+    """
+    流式输出完整（或从 offset 开始、最多 limit 个）的子网划分结果，format=jsonl（默认）或 csv。
+
+    边计算边发送，不在内存中保留结果，也不受 MAX_PAGE_SIZE 限制，适合大规模划分。
+    """
+    values = request.get_json(silent=True) or request.values
+    try:
+        params = _read_params()
+        if params['subnets'] is None:
+            raise ValueError("请填写子网数量。")
+        division_prefix(params['cidr'], params['subnets'])
+        offset = max(int(values.get("offset", 0)), 0)
+        limit = int(values["limit"]) if values.get("limit") else None
+        output_format = values.get("format", "jsonl")
+        if output_format not in ("jsonl", "csv"):
+            raise ValueError("format 只支持 jsonl 或 csv。")
+        details = iter_subnets(params['cidr'], params['subnets'], offset, limit, params['aws'], params['ipv6_cidr'])
+        # 取出第一行，参数错误（如 IPv6 /64 不足）在开始发送前返回 400
+        first = next(details, None)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    def generate():
+        if first is None:
+            return
+        buffer = io.StringIO()
+        writer = csv.writer(buffer) if output_format == "csv" else None
+        if writer:
+            writer.writerow(first.keys())
+        rows = 0
+        for detail in chain([first], details):
+            if writer:
+                writer.writerow(detail.values())
+            else:
+                buffer.write(json.dumps(detail) + "\n")
+            rows += 1
+            if rows % STREAM_CHUNK_ROWS == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+
+    mimetype = "text/csv" if output_format == "csv" else "application/x-ndjson"
+    return Response(stream_with_context(generate()), mimetype=mimetype)
+
 if __name__ == "__main__":
     """
-    启动 Flask 应用：
-    1. 默认情况下，Flask 运行在 http://127.0.0.1:5000/ 上。
-    2. 使用此开发服务器进行测试和调试，适合开发环境，不适合生产环境。
-    3. 若在生产环境中运行，请使用 WSGI 服务器（如 Gunicorn）和反向代理服务器（如 Nginx）。
+    启动 Flask 开发服务器（http://127.0.0.1:5000/），仅用于本地测试，FLASK_DEBUG=1 时开启调试模式。
+    生产环境请通过 wsgi.py 使用 WSGI 服务器（如 Gunicorn）运行，并放在反向代理（如 Nginx）之后。
     """
-    app.run(debug=True)
\ No newline at end of file
+    app.run(debug=os.getenv("FLASK_DEBUG") == "1")
@@ -0,0 +1,17 @@
+"""
+author: RJ.Wang
+Date: 2026-10-18
+email: wangrenjun@gmail.com
+Description: WSGI entry point for the CIDR subnet web tool, for running under a production WSGI server
+instead of the Flask development server.
+
+用法（在本目录下执行）:
+    gunicorn -w 4 -b 0.0.0.0:8000 wsgi:application
+"""
+from cidr_subnet import app as application
+
+if __name__ == "__main__":
+    # 未安装 Gunicorn 时可用标准库 WSGI 服务器临时运行（单线程，仅用于验证）
+    from wsgiref.simple_server import make_server
+
+    make_server("0.0.0.0", 8000, application).serve_forever()
@@ -3,38 +3,225 @@
 author: RJ.Wang
 Date: 2025-03-13
 email: wangrenjun@gmail.com
-Description: 在 Cloudshell 中查询当前资源配额
+Description: 在 Cloudshell 中查询当前资源配额；支持所有服务 × 多区域并发查询，输出为一张表，
+             并可通过配额的 UsageMetric 批量读取 CloudWatch 用量，计算使用率并标记接近上限的配额
+
+用法:
+    python list_service_quotas.py                                   # ec2 @ us-west-2
+    python list_service_quotas.py --services ec2 lambda --regions us-east-1 ap-southeast-1
+    python list_service_quotas.py --all-services --all-regions --output quotas.csv
+    python list_service_quotas.py --all-services --regions us-east-1 --utilization --threshold 80
 """
-import boto3
+import argparse
+import csv
+import json
+import os
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+
+from botocore.exceptions import ClientError
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib'))
+from config import get_client
+from metrics import get_metric_data, metric_stat
+from region_fanout import AdaptiveLimiter, call_with_backoff, fan_out, get_enabled_regions
+
+# 默认查询的服务和区域
+DEFAULT_SERVICE = 'ec2'
+DEFAULT_REGION = 'us-west-2'
+DEFAULT_WORKERS = 32
+
+# 输出表格的列
+QUOTA_FIELDS = ['Region', 'ServiceCode', 'ServiceName', 'QuotaName', 'QuotaCode', 'Value', 'Unit',
+                'Adjustable', 'GlobalQuota']
+
+# 使用率输出增加的列
+UTILIZATION_FIELDS = QUOTA_FIELDS + ['Usage', 'Utilization']
+
+# 用量取最近一段时间内各周期的最大值（秒）
+USAGE_LOOKBACK = 3600
+USAGE_PERIOD = 60
+# 默认告警阈值（使用率百分比）
+DEFAULT_THRESHOLD = 80.0
+
+# 服务在该区域不可用时返回的错误码
+UNAVAILABLE_ERROR_CODES = {'NoSuchResourceException', 'AccessDeniedException', 'IllegalArgumentException'}
 
-def list_service_quotas(service_code, region):
+
+def list_services(region=DEFAULT_REGION, profile=None):
+    """分页列出 Service Quotas 支持的所有服务，返回 [(ServiceCode, ServiceName), ...]"""
+    client = get_client('service-quotas', region, profile)
+    services = []
+    for page in client.get_paginator('list_services').paginate():
+        services.extend((item['ServiceCode'], item['ServiceName']) for item in page['Services'])
+    return services
+
+
+def list_service_quotas(service_code, region, profile=None, limiter=None):
     """
-    查询指定服务的所有配额项及其配额代码。
+    分页查询指定服务在指定区域的所有配额项。
 
     Args:
         service_code (str): AWS 服务代码（如 'ec2'）。
         region (str): AWS 区域代码（如 'us-west-2'）。
-    
+        profile (str): AWS profile。
+        limiter (AdaptiveLimiter): 并发限制器，遇到限流时退避重试。
+
     Returns:
-        list: 包含配额名称、配额代码和当前配额值的字典列表。
+        list: 配额记录字典列表（字段见 QUOTA_FIELDS，另含原始 UsageMetric）。
     """
-    client = boto3.client('service-quotas', region_name=region)
-    try:
-        print(f"正在查询服务 {service_code} 的配额项...")
-        response = client.list_service_quotas(ServiceCode=service_code)
-        
-        quotas = []
+    client = get_client('service-quotas', region, profile)
+    quotas = []
+    kwargs = {'ServiceCode': service_code}
+    while True:
+        response = call_with_backoff(client.list_service_quotas, limiter=limiter, **kwargs)
         for quota in response['Quotas']:
             quotas.append({
+                "Region": region,
+                "ServiceCode": quota['ServiceCode'],
+                "ServiceName": quota.get('ServiceName', ''),
                 "QuotaName": quota['QuotaName'],
                 "QuotaCode": quota['QuotaCode'],
-                "Value": quota['Value']
+                "Value": quota['Value'],
+                "Unit": quota.get('Unit', 'None'),
+                "Adjustable": quota.get('Adjustable', False),
+                "GlobalQuota": quota.get('GlobalQuota', False),
+                "UsageMetric": quota.get('UsageMetric')
             })
+        if not response.get('NextToken'):
+            return quotas
+        kwargs['NextToken'] = response['NextToken']
+
+
+def collect_quotas(services, regions, profile=None, workers=DEFAULT_WORKERS):
+    """
+    并发查询 服务 × 区域 的配额，每个区域独立的自适应限流器。
+
+    全局配额在每个区域都会返回，只保留第一次出现的记录。
+
+    Returns:
+        tuple: (配额记录列表（按服务、区域、配额名排序）, 失败的 (服务, 区域, 错误) 列表)
+    """
+    limiters = {region: AdaptiveLimiter(initial=8, maximum=workers) for region in regions}
+    quotas, errors = [], []
+    seen_global = set()
+    done = 0
+    total = len(services) * len(regions)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(list_service_quotas, service_code, region, profile, limiters[region]):
+                (service_code, region)
+            for service_code in services
+            for region in regions
+        }
+        for future in as_completed(futures):
+            service_code, region = futures[future]
+            done += 1
+            try:
+                result = future.result()
+            except ClientError as e:
+                # 服务在该区域不可用属于正常情况，不计为失败
+                if e.response['Error']['Code'] not in UNAVAILABLE_ERROR_CODES:
+                    errors.append((service_code, region, e))
+                continue
+            except Exception as e:
+                errors.append((service_code, region, e))
+                continue
+
+            for quota in result:
+                if quota['GlobalQuota']:
+                    key = (quota['ServiceCode'], quota['QuotaCode'])
+                    if key in seen_global:
+                        continue
+                    seen_global.add(key)
+                quotas.append(quota)
+            if done % 100 == 0 or done == total:
+                print(f"进度: {done}/{total}，已获取 {len(quotas)} 个配额项", file=sys.stderr)
+
+    quotas.sort(key=lambda q: (q['ServiceCode'], q['Region'], q['QuotaName']))
+    return quotas, errors
+
+
+def usage_metric_stat(usage_metric, period=USAGE_PERIOD):
+    """把配额的 UsageMetric 定义转换为 GetMetricData 的 MetricStat"""
+    return metric_stat(
+        usage_metric['MetricNamespace'],
+        usage_metric['MetricName'],
+        usage_metric.get('MetricDimensions', {}),
+        usage_metric.get('MetricStatisticRecommendation', 'Maximum'),
+        period
+    )
+
+
+def _region_usage(region, stats, profile=None, lookback=USAGE_LOOKBACK, period=USAGE_PERIOD):
+    """批量读取一个区域内所有配额的用量，返回 {(ServiceCode, QuotaCode): 用量}"""
+    end = datetime.now(timezone.utc)
+    series = get_metric_data(get_client('cloudwatch', region, profile), stats, end - timedelta(seconds=lookback), end)
+    usage = {}
+    for key, item in series.items():
+        if not item.values:
+            continue
+        peak = max(item.values)
+        # API 调用频率类配额按每秒计，CallCount 为每个周期的调用总数
+        if stats[key]['Metric']['MetricName'] == 'CallCount':
+            peak /= period
+        usage[key] = peak
+    return usage
+
+
+def add_utilization(quotas, profile=None, lookback=USAGE_LOOKBACK, period=USAGE_PERIOD):
+    """
+    为带 UsageMetric 的配额计算用量和使用率（百分比），写入 Usage / Utilization 字段。
+
+    每个区域的全部用量指标通过 GetMetricData 批量读取（每请求 500 条），各区域并发；
+    没有用量指标或没有数据点的配额两项为空。
+    """
+    stats_by_region = {}
+    for quota in quotas:
+        quota['Usage'] = quota['Utilization'] = None
+        if quota.get('UsageMetric'):
+            stats_by_region.setdefault(quota['Region'], {})[(quota['ServiceCode'], quota['QuotaCode'])] = \
+                usage_metric_stat(quota['UsageMetric'], period)
+    if not stats_by_region:
         return quotas
-    except Exception as e:
-        print(f"[错误] 查询服务配额失败: {e}")
-        sys.exit(1)
+
+    usage = {}
+    for region, region_usage, error in fan_out(
+            lambda r: _region_usage(r, stats_by_region[r], profile, lookback, period), list(stats_by_region)):
+        if error is not None:
+            print(f"[错误] 读取区域 {region} 的用量指标失败: {error}")
+            continue
+        usage.update({(region,) + key: value for key, value in region_usage.items()})
+
+    for quota in quotas:
+        value = usage.get((quota['Region'], quota['ServiceCode'], quota['QuotaCode']))
+        if value is None:
+            continue
+        quota['Usage'] = round(value, 2)
+        if quota['Value']:
+            quota['Utilization'] = round(value * 100 / quota['Value'], 1)
+    return quotas
+
+
+def display_utilization(quotas, threshold=DEFAULT_THRESHOLD):
+    """输出有用量数据的配额（按使用率从高到低），并列出超过阈值的配额"""
+    measured = sorted((q for q in quotas if q['Utilization'] is not None),
+                      key=lambda q: q['Utilization'], reverse=True)
+    print(f"\n=== 配额使用率（{len(measured)}/{len(quotas)} 个配额有用量数据）===")
+    display_table(measured, ['Region', 'ServiceCode', 'QuotaCode', 'Usage', 'Value', 'Utilization', 'QuotaName'])
+
+    flagged = [q for q in measured if q['Utilization'] >= threshold]
+    if flagged:
+        print(f"\n⚠️ {len(flagged)} 个配额使用率达到 {threshold}% 以上:")
+        for quota in flagged:
+            print(f"  {quota['Region']} {quota['ServiceCode']}/{quota['QuotaCode']} {quota['QuotaName']}: "
+                  f"{quota['Usage']}/{quota['Value']} ({quota['Utilization']}%)")
+    else:
+        print(f"\n✅ 没有配额使用率达到 {threshold}%")
+    return flagged
+
 
 def display_quotas(quotas):
     """
@@ -46,23 +233,96 @@ def display_quotas(quotas):
     if not quotas:
         print("未找到任何配额信息。")
         return
-    
+
     print("\n=== 查询结果 ===")
     for quota in quotas:
         print(f"- 配额名称: {quota['QuotaName']}")
         print(f"  配额代码: {quota['QuotaCode']}")
         print(f"  配额值: {quota['Value']}\n")
 
+
+def display_table(quotas, fields=None):
+    """以对齐的表格输出配额（多服务/多区域时使用）"""
+    if not quotas:
+        print("未找到任何配额信息。")
+        return
+    fields = fields or ['Region', 'ServiceCode', 'QuotaCode', 'Value', 'QuotaName']
+    widths = {field: max(len(field), *(len(str(q[field])) for q in quotas)) for field in fields[:-1]}
+    print("  ".join(f"{field:<{widths[field]}}" for field in fields[:-1]) + f"  {fields[-1]}")
+    for quota in quotas:
+        print("  ".join(f"{str(quota[field]):<{widths[field]}}" for field in fields[:-1]) + f"  {quota[fields[-1]]}")
+    print(f"\n共 {len(quotas)} 个配额项")
+
+
+def write_quotas(quotas, output, fields=QUOTA_FIELDS):
+    """把配额写入 CSV 或 JSONL 文件（按扩展名）"""
+    with open(output, 'w', newline='', encoding='utf-8') as f:
+        if output.endswith('.jsonl'):
+            for quota in quotas:
+                f.write(json.dumps({field: quota[field] for field in fields}, ensure_ascii=False) + '\n')
+        else:
+            writer = csv.DictWriter(f, fieldnames=fields, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(quotas)
+    print(f"配额已写入: {output}")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="查询 AWS 服务配额")
+    parser.add_argument("--services", nargs="+", help=f"服务代码（默认 {DEFAULT_SERVICE}）")
+    parser.add_argument("--all-services", action="store_true", help="查询 Service Quotas 支持的所有服务")
+    parser.add_argument("--regions", nargs="+", help=f"区域（默认 {DEFAULT_REGION}）")
+    parser.add_argument("--all-regions", action="store_true", help="查询所有已启用的区域")
+    parser.add_argument("--output", help="输出文件（.csv 或 .jsonl）")
+    parser.add_argument("--utilization", action="store_true", help="读取 CloudWatch 用量并计算配额使用率")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"使用率告警阈值（百分比，默认 {DEFAULT_THRESHOLD}）")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help=f"并发数（默认 {DEFAULT_WORKERS}）")
+    parser.add_argument("--profile", help="AWS profile")
+    return parser.parse_args()
+
+
 def main():
-    # 参数设置
-    service_code = 'ec2'  # AWS 服务代码（如 'ec2', 's3', 'lambda'）
-    region = 'us-west-2'  # 查询的区域
-
-    # 查询服务的配额代码
-    quotas = list_service_quotas(service_code, region)
-    
-    # 显示结果
-    display_quotas(quotas)
+    args = parse_args()
+
+    regions = args.regions or [DEFAULT_REGION]
+    if args.all_regions:
+        regions = get_enabled_regions(profile=args.profile, region=regions[0])
+    if args.all_services:
+        services = [code for code, _ in list_services(regions[0], args.profile)]
+    else:
+        services = args.services or [DEFAULT_SERVICE]
+
+    # 单个服务、单个区域：保持原来的输出格式
+    if len(services) == 1 and len(regions) == 1:
+        print(f"正在查询服务 {services[0]} 的配额项...")
+        try:
+            quotas = list_service_quotas(services[0], regions[0], args.profile)
+        except Exception as e:
+            print(f"[错误] 查询服务配额失败: {e}")
+            sys.exit(1)
+        if not args.utilization:
+            display_quotas(quotas)
+    else:
+        print(f"正在查询 {len(services)} 个服务 × {len(regions)} 个区域的配额...")
+        quotas, errors = collect_quotas(services, regions, args.profile, args.workers)
+        if not args.output and not args.utilization:
+            display_table(quotas)
+        for service_code, region, error in errors:
+            print(f"[错误] {service_code} @ {region}: {error}")
+
+    flagged = []
+    if args.utilization:
+        add_utilization(quotas, args.profile)
+        flagged = display_utilization(quotas, args.threshold)
+
+    if args.output:
+        write_quotas(quotas, args.output, UTILIZATION_FIELDS if args.utilization else QUOTA_FIELDS)
+
+    # 有配额超过阈值时以非零状态退出，便于定时任务告警
+    if flagged:
+        sys.exit(2)
+
 
 if __name__ == "__main__":
     main()
@@ -1,68 +1,494 @@
-import boto3
+#!/usr/bin/env python3
+"""
+S3 预签名 URL 生成
+
+签名在本地完成（纯 CPU 计算），每个存储桶只查询一次区域并复用同一个客户端，
+批量模式可以一次生成大量 GET/PUT 链接。
+
+用法:
+    python presigned_url.py single --bucket my-lambda01 --key uploads/example.txt
+    python presigned_url.py bulk --bucket my-bucket --prefix reports/2026/ --output urls.jsonl
+    python presigned_url.py bulk --bucket my-bucket --keys-file keys.txt --method put --output urls.csv
+    python presigned_url.py multipart --bucket my-bucket --key artifacts/image.tar --size 20G --output plan.json
+    python presigned_url.py complete --bucket my-bucket --key artifacts/image.tar --upload-id <ID> --etags etags.json
+    python presigned_url.py serve --port 8080
+        curl 'http://127.0.0.1:8080/presign?bucket=my-bucket&key=reports/a.csv&method=get&expires=3600'
+"""
+import argparse
+import csv
+import json
+import math
+import os
+import sys
+import threading
+import time
 import urllib.parse
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib'))
+from config import get_client
 
-# 配置 S3 Bucket 名称和上传文件路径
+# 默认 S3 Bucket 名称和上传文件路径
 BUCKET_NAME = "my-lambda01"
 OBJECT_KEY = "uploads/example.txt"
 EXPIRATION = 3600  # 预签名 URL 有效期（秒）
 
-# 创建 Boto3 会话，支持 IAM 临时凭证
-session = boto3.Session()
-credentials = session.get_credentials()
-
-# 获取当前身份信息
-sts_client = session.client("sts")
-identity = sts_client.get_caller_identity()
-
-# 获取 IAM 用户或角色信息
-iam_client = session.client("iam")
-try:
-    user = iam_client.get_user()
-    iam_identity = user["User"]["UserName"]
-    identity_type = "IAM User"
-except iam_client.exceptions.NoSuchEntityException:
-    iam_identity = identity["Arn"].split("/")[-1]  # 提取 Role 名称
-    identity_type = "IAM Role"
-
-# 获取存储桶所在的区域
-s3_client = session.client("s3")
-response = s3_client.get_bucket_location(Bucket=BUCKET_NAME)
-region = response.get("LocationConstraint", "us-east-1")  # 默认 us-east-1
-
-# 重新创建 S3 客户端，指定正确的区域
-s3_client = session.client("s3", region_name=region)
-
-# 生成 Pre-signed URL
-presigned_url = s3_client.generate_presigned_url(
-    "put_object",
-    Params={"Bucket": BUCKET_NAME, "Key": OBJECT_KEY},
-    ExpiresIn=EXPIRATION,
-)
-
-# 输出调试信息
-print("=" * 50)
-print("🔹 AWS Identity Information")
-print(f"  - AWS Account ID  : {identity['Account']}")
-print(f"  - Identity Type   : {identity_type}")
-print(f"  - Identity Name   : {iam_identity}")
-print(f"  - Identity ARN    : {identity['Arn']}")
-print("=" * 50)
-
-print("\n🔹 S3 Bucket Information")
-print(f"  - Bucket Name     : {BUCKET_NAME}")
-print(f"  - Object Key      : {OBJECT_KEY}")
-print(f"  - Bucket Region   : {region}")
-print("=" * 50)
-
-print("\n🔹 Generated Pre-signed URL")
-print(f"{presigned_url}")
-print("=" * 50)
-
-# 解析 URL，避免 URL 编码问题
-parsed_url = urllib.parse.urlparse(presigned_url)
-
-# 生成 curl 命令，方便调试
-curl_command = f'curl -X PUT -T "README.md" "{parsed_url.geturl()}"'
-print("\n🔹 Test with curl command:")
-print(curl_command)
-print("=" * 50)
\ No newline at end of file
+# 支持的操作及对应的 S3 API
+METHODS = {'get': 'get_object', 'put': 'put_object'}
+
+# 分段上传限制：每段 5 MiB ~ 5 GiB，最多 10000 段，对象最大 5 TiB
+MIB = 1024 * 1024
+MIN_PART_SIZE = 5 * MIB
+MAX_PART_SIZE = 5 * 1024 * MIB
+MAX_PARTS = 10000
+MAX_OBJECT_SIZE = 5 * 1024 * 1024 * MIB
+# 默认分段大小：段数适中，便于客户端并发上传和失败重传
+DEFAULT_PART_SIZE = 64 * MIB
+
+SIZE_UNITS = {'': 1, 'K': 1024, 'M': MIB, 'G': 1024 * MIB, 'T': 1024 * 1024 * MIB}
+
+# 服务模式签名缓存：有效期按分钟对齐后作为缓存键的一部分，剩余有效期不足请求有效期的
+# SIGN_CACHE_MIN_REMAINING 比例时重新签名；最多缓存 SIGN_CACHE_SIZE 条（LRU）
+SIGN_CACHE_EXPIRY_STEP = 60
+SIGN_CACHE_MIN_REMAINING = 0.5
+SIGN_CACHE_SIZE = 100000
+
+# 存储桶区域缓存
+_bucket_regions = {}
+_bucket_lock = threading.Lock()
+
+
+def get_bucket_region(bucket, profile=None):
+    """获取存储桶所在区域（进程内缓存，同一存储桶只调用一次 get_bucket_location）"""
+    key = (profile, bucket)
+    with _bucket_lock:
+        if key not in _bucket_regions:
+            response = get_client("s3", None, profile).get_bucket_location(Bucket=bucket)
+            # us-east-1 的 LocationConstraint 为 None，旧的 eu-west-1 存储桶返回 EU
+            region = response.get("LocationConstraint") or "us-east-1"
+            _bucket_regions[key] = "eu-west-1" if region == "EU" else region
+        return _bucket_regions[key]
+
+
+def get_bucket_client(bucket, profile=None):
+    """获取存储桶所在区域的 S3 客户端（按区域缓存，签名必须使用存储桶所在区域）"""
+    return get_client("s3", get_bucket_region(bucket, profile), profile)
+
+
+def presign(bucket, key, method='get', expires=EXPIRATION, profile=None):
+    """生成单个对象的预签名 URL"""
+    return get_bucket_client(bucket, profile).generate_presigned_url(
+        METHODS[method],
+        Params={"Bucket": bucket, "Key": key},
+        ExpiresIn=expires,
+    )
+
+
+def list_keys(bucket, prefix='', profile=None):
+    """按页流式列出前缀下的对象键"""
+    paginator = get_bucket_client(bucket, profile).get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for item in page.get('Contents', []):
+            yield item['Key']
+
+
+def read_keys(path):
+    """从文件（- 表示标准输入）逐行读取对象键，忽略空行"""
+    f = sys.stdin if path == '-' else open(path, encoding='utf-8')
+    try:
+        for line in f:
+            key = line.strip()
+            if key:
+                yield key
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def sign_keys(bucket, keys, method='get', expires=EXPIRATION, profile=None):
+    """为一批对象键生成预签名 URL，逐条产出 {'bucket', 'key', 'method', 'url', 'expires_at'}"""
+    client = get_bucket_client(bucket, profile)
+    operation = METHODS[method]
+    for key in keys:
+        # 每条 URL 的有效期从签名时刻算起
+        expires_at = int(time.time()) + expires
+        url = client.generate_presigned_url(operation, Params={"Bucket": bucket, "Key": key}, ExpiresIn=expires)
+        yield {'bucket': bucket, 'key': key, 'method': method.upper(), 'url': url, 'expires_at': expires_at}
+
+
+def write_rows(rows, output=None):
+    """把结果流式写入 JSONL（默认，含标准输出）或 CSV 文件（按扩展名），返回写入条数"""
+    f = open(output, 'w', newline='', encoding='utf-8') if output else sys.stdout
+    count = 0
+    try:
+        if output and output.endswith('.csv'):
+            writer = None
+            for row in rows:
+                if writer is None:
+                    writer = csv.DictWriter(f, fieldnames=list(row))
+                    writer.writeheader()
+                writer.writerow(row)
+                count += 1
+        else:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + '\n')
+                count += 1
+    finally:
+        if output:
+            f.close()
+    return count
+
+
+def parse_size(text):
+    """解析大小，如 1048576、512M、20G、1.5T（二进制单位，可带 iB/B 后缀）"""
+    value = text.strip().upper()
+    for suffix in ('IB', 'B'):
+        if value.endswith(suffix) and value[:-len(suffix)][-1:].isalpha():
+            value = value[:-len(suffix)]
+            break
+    unit = value[-1] if value and value[-1] in SIZE_UNITS else ''
+    number = value[:-1] if unit else value
+    return int(float(number) * SIZE_UNITS[unit])
+
+
+def compute_part_size(object_size, target=DEFAULT_PART_SIZE):
+    """
+    计算分段大小：不小于 target，且保证段数不超过 10000，按 MiB 向上取整。
+
+    Raises:
+        ValueError: 对象大小超过 S3 上限或分段大小超出范围
+    """
+    if object_size > MAX_OBJECT_SIZE:
+        raise ValueError(f"对象大小 {object_size} 超过 S3 上限 5 TiB")
+    part_size = max(target, MIN_PART_SIZE, math.ceil(object_size / MAX_PARTS))
+    part_size = math.ceil(part_size / MIB) * MIB
+    if part_size > MAX_PART_SIZE:
+        raise ValueError(f"分段大小 {part_size} 超过上限 5 GiB")
+    return part_size
+
+
+def plan_multipart_upload(bucket, key, object_size, part_size=None, expires=EXPIRATION,
+                          content_type=None, profile=None):
+    """
+    创建分段上传并一次性为所有分段生成预签名 upload_part URL。
+
+    客户端可以按 parts 中的 offset/size 切分文件并发 PUT，收集每个响应头中的 ETag，
+    再交给 complete_multipart_upload() 完成上传。
+
+    Returns:
+        dict: {'bucket', 'key', 'upload_id', 'object_size', 'part_size', 'part_count', 'expires_at',
+               'parts': [{'part_number', 'offset', 'size', 'url'}, ...]}
+    """
+    part_size = compute_part_size(object_size, part_size or DEFAULT_PART_SIZE)
+    part_count = max(1, math.ceil(object_size / part_size))
+
+    client = get_bucket_client(bucket, profile)
+    params = {'Bucket': bucket, 'Key': key}
+    if content_type:
+        params['ContentType'] = content_type
+    upload_id = client.create_multipart_upload(**params)['UploadId']
+
+    expires_at = int(time.time()) + expires
+    parts = []
+    for number in range(1, part_count + 1):
+        offset = (number - 1) * part_size
+        url = client.generate_presigned_url(
+            'upload_part',
+            Params={'Bucket': bucket, 'Key': key, 'UploadId': upload_id, 'PartNumber': number},
+            ExpiresIn=expires,
+        )
+        parts.append({'part_number': number, 'offset': offset,
+                      'size': min(part_size, object_size - offset), 'url': url})
+
+    return {
+        'bucket': bucket, 'key': key, 'upload_id': upload_id,
+        'object_size': object_size, 'part_size': part_size, 'part_count': part_count,
+        'expires_at': expires_at, 'parts': parts
+    }
+
+
+def _normalize_etags(etags):
+    """把 {分段号: ETag}、[ETag, ...]（按分段顺序）或 [{'PartNumber', 'ETag'}, ...] 统一为 Parts 列表"""
+    if isinstance(etags, dict):
+        items = [(int(number), etag) for number, etag in etags.items()]
+    elif etags and isinstance(etags[0], dict):
+        items = [(int(part['PartNumber']), part['ETag']) for part in etags]
+    else:
+        items = list(enumerate(etags, start=1))
+    # ETag 必须带双引号，客户端读取响应头时经常丢掉
+    return [{'PartNumber': number, 'ETag': etag if etag.startswith('"') else f'"{etag}"'}
+            for number, etag in sorted(items)]
+
+
+def complete_multipart_upload(bucket, key, upload_id, etags, profile=None):
+    """用客户端上传后返回的 ETag 完成分段上传，返回对象的 ETag"""
+    response = get_bucket_client(bucket, profile).complete_multipart_upload(
+        Bucket=bucket, Key=key, UploadId=upload_id,
+        MultipartUpload={'Parts': _normalize_etags(etags)}
+    )
+    return response['ETag']
+
+
+def abort_multipart_upload(bucket, key, upload_id, profile=None):
+    """放弃分段上传，释放已上传分段占用的存储"""
+    get_bucket_client(bucket, profile).abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+
+
+class SigningCache:
+    """
+    预签名 URL 缓存，键为 (bucket, key, method, 对齐后的有效期)。
+
+    相同对象和操作的请求在缓存 URL 剩余有效期充足时直接复用，不再重复签名。
+    """
+
+    def __init__(self, profile=None, max_size=SIGN_CACHE_SIZE):
+        self.profile = profile
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def presign(self, bucket, key, method='get', expires=EXPIRATION):
+        """返回 {'url', 'expires_at', 'cached'}；有效期向上对齐到整分钟"""
+        expires = max(SIGN_CACHE_EXPIRY_STEP, math.ceil(expires / SIGN_CACHE_EXPIRY_STEP) * SIGN_CACHE_EXPIRY_STEP)
+        cache_key = (bucket, key, method, expires)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is not None and entry[1] - now >= expires * SIGN_CACHE_MIN_REMAINING:
+                self._entries.move_to_end(cache_key)
+                self.hits += 1
+                return {'url': entry[0], 'expires_at': entry[1], 'cached': True}
+
+        url = presign(bucket, key, method, expires, self.profile)
+        expires_at = int(now) + expires
+        with self._lock:
+            self.misses += 1
+            self._entries[cache_key] = (url, expires_at)
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return {'url': url, 'expires_at': expires_at, 'cached': False}
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+def make_handler(cache):
+    """构造服务模式的请求处理类：GET /presign?bucket=&key=&method=&expires=，GET /healthz"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, status, body):
+            data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            parsed = urllib.parse.urlparse(self.path)
+            if parsed.path == '/healthz':
+                self._reply(200, dict(cache.stats(), status='ok'))
+                return
+            if parsed.path != '/presign':
+                self._reply(404, {'error': 'not found'})
+                return
+
+            query = urllib.parse.parse_qs(parsed.query)
+            bucket = query.get('bucket', [BUCKET_NAME])[0]
+            key = query.get('key', [None])[0]
+            method = query.get('method', ['get'])[0].lower()
+            try:
+                expires = int(query.get('expires', [EXPIRATION])[0])
+            except ValueError:
+                expires = 0
+            if not key or method not in METHODS or not 0 < expires <= 604800:
+                self._reply(400, {'error': 'key 必填，method 为 get/put，expires 为 1~604800 秒'})
+                return
+
+            try:
+                result = cache.presign(bucket, key, method, expires)
+            except Exception as e:
+                self._reply(502, {'error': str(e)})
+                return
+            self._reply(200, dict(result, bucket=bucket, key=key, method=method.upper()))
+
+    return Handler
+
+
+def serve(host='127.0.0.1', port=8080, profile=None):
+    """启动预签名 URL 服务（多线程），常驻进程避免每次请求都付出 Python + boto3 启动开销"""
+    server = ThreadingHTTPServer((host, port), make_handler(SigningCache(profile)))
+    print(f"预签名 URL 服务已启动: http://{host}:{port}/presign?bucket=<bucket>&key=<key>&method=get", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def print_identity(profile=None):
+    """输出当前调用身份（IAM 用户或角色）"""
+    identity = get_client("sts", None, profile).get_caller_identity()
+    iam_client = get_client("iam", None, profile)
+    try:
+        iam_identity = iam_client.get_user()["User"]["UserName"]
+        identity_type = "IAM User"
+    except Exception:
+        iam_identity = identity["Arn"].split("/")[-1]  # 提取 Role 名称
+        identity_type = "IAM Role"
+
+    print("=" * 50)
+    print("🔹 AWS Identity Information")
+    print(f"  - AWS Account ID  : {identity['Account']}")
+    print(f"  - Identity Type   : {identity_type}")
+    print(f"  - Identity Name   : {iam_identity}")
+    print(f"  - Identity ARN    : {identity['Arn']}")
+    print("=" * 50)
+
+
+def cmd_single(args):
+    """单个对象：输出身份和存储桶信息、预签名 URL 以及 curl 测试命令"""
+    print_identity(args.profile)
+    region = get_bucket_region(args.bucket, args.profile)
+    presigned_url = presign(args.bucket, args.key, args.method, args.expires, args.profile)
+
+    print("\n🔹 S3 Bucket Information")
+    print(f"  - Bucket Name     : {args.bucket}")
+    print(f"  - Object Key      : {args.key}")
+    print(f"  - Bucket Region   : {region}")
+    print("=" * 50)
+
+    print("\n🔹 Generated Pre-signed URL")
+    print(f"{presigned_url}")
+    print("=" * 50)
+
+    # 解析 URL，避免 URL 编码问题
+    parsed_url = urllib.parse.urlparse(presigned_url)
+
+    # 生成 curl 命令，方便调试
+    if args.method == 'put':
+        curl_command = f'curl -X PUT -T "README.md" "{parsed_url.geturl()}"'
+    else:
+        curl_command = f'curl -o "{os.path.basename(args.key)}" "{parsed_url.geturl()}"'
+    print("\n🔹 Test with curl command:")
+    print(curl_command)
+    print("=" * 50)
+
+
+def cmd_bulk(args):
+    """批量：从键列表文件或前缀列举中读取对象键，流式输出预签名 URL"""
+    if args.keys_file:
+        keys = read_keys(args.keys_file)
+    else:
+        keys = list_keys(args.bucket, args.prefix, args.profile)
+
+    start = time.time()
+    count = write_rows(sign_keys(args.bucket, keys, args.method, args.expires, args.profile), args.output)
+    # 结果可能写到标准输出，统计信息写到标准错误
+    print(f"已生成 {count} 个预签名 URL，耗时 {time.time() - start:.1f} 秒", file=sys.stderr)
+
+
+def cmd_multipart(args):
+    """分段上传：创建上传并输出包含所有分段预签名 URL 的计划（JSON）"""
+    plan = plan_multipart_upload(
+        args.bucket, args.key, parse_size(args.size),
+        parse_size(args.part_size) if args.part_size else None,
+        args.expires, args.content_type, args.profile
+    )
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(plan, f, ensure_ascii=False, indent=2)
+    else:
+        json.dump(plan, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    print(f"UploadId: {plan['upload_id']}，{plan['part_count']} 段，"
+          f"每段 {plan['part_size'] // MIB} MiB", file=sys.stderr)
+
+
+def cmd_complete(args):
+    """完成或放弃分段上传"""
+    if args.abort:
+        abort_multipart_upload(args.bucket, args.key, args.upload_id, args.profile)
+        print(f"已放弃分段上传 {args.upload_id}")
+        return
+    with open(args.etags, encoding='utf-8') as f:
+        etags = json.load(f)
+    etag = complete_multipart_upload(args.bucket, args.key, args.upload_id, etags, args.profile)
+    print(f"✅ 分段上传已完成: s3://{args.bucket}/{args.key} ETag={etag}")
+
+
+def cmd_serve(args):
+    """服务模式"""
+    serve(args.host, args.port, args.profile)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="生成 S3 预签名 URL")
+    parser.add_argument("--profile", help="AWS profile")
+    subparsers = parser.add_subparsers(dest="command")
+
+    def add_common(sub, default_method):
+        sub.add_argument("--bucket", default=BUCKET_NAME, help=f"存储桶名称（默认 {BUCKET_NAME}）")
+        sub.add_argument("--method", choices=sorted(METHODS), default=default_method, help="预签名的操作")
+        sub.add_argument("--expires", type=int, default=EXPIRATION, help=f"有效期（秒，默认 {EXPIRATION}）")
+
+    single = subparsers.add_parser("single", help="为单个对象生成预签名 URL")
+    add_common(single, 'put')
+    single.add_argument("--key", default=OBJECT_KEY, help=f"对象键（默认 {OBJECT_KEY}）")
+    single.set_defaults(func=cmd_single)
+
+    bulk = subparsers.add_parser("bulk", help="批量生成预签名 URL")
+    add_common(bulk, 'get')
+    source = bulk.add_mutually_exclusive_group(required=True)
+    source.add_argument("--keys-file", help="对象键列表文件，每行一个，- 表示标准输入")
+    source.add_argument("--prefix", help="列出该前缀下的所有对象")
+    bulk.add_argument("--output", help="输出文件（.jsonl 或 .csv），默认以 JSONL 写到标准输出")
+    bulk.set_defaults(func=cmd_bulk)
+
+    multipart = subparsers.add_parser("multipart", help="创建分段上传并预签名所有分段的 URL")
+    multipart.add_argument("--bucket", default=BUCKET_NAME, help=f"存储桶名称（默认 {BUCKET_NAME}）")
+    multipart.add_argument("--key", required=True, help="对象键")
+    multipart.add_argument("--size", required=True, help="对象大小，如 20G、1536M 或字节数")
+    multipart.add_argument("--part-size", help=f"期望的分段大小（默认 {DEFAULT_PART_SIZE // MIB}M，段数超过 10000 时自动调大）")
+    multipart.add_argument("--content-type", help="对象的 Content-Type")
+    multipart.add_argument("--expires", type=int, default=EXPIRATION, help=f"URL 有效期（秒，默认 {EXPIRATION}）")
+    multipart.add_argument("--output", help="计划输出文件（JSON），默认写到标准输出")
+    multipart.set_defaults(func=cmd_multipart)
+
+    complete = subparsers.add_parser("complete", help="用各分段的 ETag 完成分段上传")
+    complete.add_argument("--bucket", default=BUCKET_NAME, help=f"存储桶名称（默认 {BUCKET_NAME}）")
+    complete.add_argument("--key", required=True, help="对象键")
+    complete.add_argument("--upload-id", required=True, help="multipart 输出的 UploadId")
+    action = complete.add_mutually_exclusive_group(required=True)
+    action.add_argument("--etags", help="ETag 文件（JSON）：{分段号: ETag} 或按分段顺序的 ETag 列表")
+    action.add_argument("--abort", action="store_true", help="放弃该分段上传")
+    complete.set_defaults(func=cmd_complete)
+
+    server = subparsers.add_parser("serve", help="以 HTTP 服务方式按请求签发预签名 URL")
+    server.add_argument("--host", default="127.0.0.1", help="监听地址（默认 127.0.0.1，仅本机访问）")
+    server.add_argument("--port", type=int, default=8080, help="监听端口（默认 8080）")
+    server.set_defaults(func=cmd_serve)
+
+    args = parser.parse_args()
+    # 不带子命令时保持原来的行为：为默认对象生成 PUT URL
+    if args.command is None:
+        args = parser.parse_args(sys.argv[1:] + ["single"])
+    return args
+
+
+def main():
+    args = parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
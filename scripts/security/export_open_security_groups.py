@@ -5,18 +5,21 @@ Author: Assistant
 Date: 2025-01-07
 """
 
-import boto3
+import os
+import sys
 import csv
 import json
 from datetime import datetime
 from botocore.exceptions import ClientError, NoCredentialsError
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'lib'))
+from config import get_client
+from region_fanout import fan_out, get_enabled_regions, is_throttling_error
+
 def get_all_regions():
-    """获取所有可用的 AWS 区域"""
+    """获取所有已启用的 AWS 区域（跳过需要 opt-in 但未启用的区域）"""
     try:
-        ec2 = boto3.client('ec2', region_name='us-east-1')
-        response = ec2.describe_regions()
-        return [region['RegionName'] for region in response['Regions']]
+        return get_enabled_regions(region='us-east-1')
     except Exception as e:
         print(f"获取区域列表失败: {e}")
         return ['us-east-1']  # 默认返回一个区域
@@ -26,7 +29,7 @@ def analyze_security_groups_in_region(region_name):
     print(f"正在分析区域: {region_name}")
     
     try:
-        ec2 = boto3.client('ec2', region_name=region_name)
+        ec2 = get_client('ec2', region_name)
         
         # 获取所有安全组
         paginator = ec2.get_paginator('describe_security_groups')
@@ -85,6 +88,9 @@ def analyze_security_groups_in_region(region_name):
         return open_rules
         
     except ClientError as e:
+        # 限流错误交给 fan_out 退避重试并降低并发
+        if is_throttling_error(e):
+            raise
         error_code = e.response['Error']['Code']
         if error_code == 'UnauthorizedOperation':
             print(f"区域 {region_name}: 没有权限访问")
@@ -166,7 +172,7 @@ def main():
     
     try:
         # 检查 AWS 凭证
-        sts = boto3.client('sts')
+        sts = get_client('sts')
         identity = sts.get_caller_identity()
         account_id = identity['Account']
         print(f"当前 AWS 账号: {account_id}")
@@ -186,19 +192,17 @@ def main():
     print(f"将扫描 {len(regions)} 个区域")
     print("-" * 60)
     
-    # 收集所有开放规则
+    # 并发扫描所有区域，总耗时取决于最慢的区域
     all_open_rules = []
     
-    for region in regions:
-        try:
-            rules = analyze_security_groups_in_region(region)
+    try:
+        for region, rules, error in fan_out(analyze_security_groups_in_region, regions):
+            if error is not None:
+                print(f"处理区域 {region} 时出错: {error}")
+                continue
             all_open_rules.extend(rules)
-        except KeyboardInterrupt:
-            print("\n⚠️  用户中断操作")
-            break
-        except Exception as e:
-            print(f"处理区域 {region} 时出错: {e}")
-            continue
+    except KeyboardInterrupt:
+        print("\n⚠️  用户中断操作")
     
     print("-" * 60)
     
@@ -9,12 +9,14 @@ AWS 资源批量打标签工具（非交互式版本）
 功能: 批量为不合规资源添加指定的标签，无需交互式输入
 """
 
-import boto3
 import sys
 import json
 import os
 from typing import List, Dict, Tuple
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..', 'lib'))
+from config import get_client
+
 # ============================================================
 # 默认标签配置（可在此处修改默认值）
 # ============================================================
@@ -36,8 +38,8 @@ class BatchTagger:
         self.profile = profile
         self.region = region
         self.tags = tags
-        self.session = boto3.Session(profile_name=profile, region_name=region)
-        self.config_client = self.session.client('config')
+        self.config_client = self._client('config')
+        self._account_id = None
         
         # 判断是否为中国区
         self.is_china = region.startswith('cn-')
@@ -46,6 +48,16 @@ class BatchTagger:
         print(f"区域类型: {'中国区' if self.is_china else 'Global 区'}")
         print(f"ARN 前缀: arn:{self.arn_partition}:")
 
+    def _client(self, service: str):
+        """获取共享的服务客户端（按 profile/region/service 缓存）"""
+        return get_client(service, self.region, self.profile)
+
+    @property
+    def account_id(self) -> str:
+        """当前账号 ID（只查询一次）"""
+        if self._account_id is None:
+            self._account_id = self._client('sts').get_caller_identity()['Account']
+        return self._account_id
     
     def get_non_compliant_resources(self) -> List[Dict]:
         """获取不合规资源列表"""
@@ -92,21 +104,21 @@ class BatchTagger:
     
     def _tag_ec2_instance(self, instance_id: str) -> Tuple[bool, str]:
         """EC2 实例打标签"""
-        ec2 = self.session.client('ec2')
+        ec2 = self._client('ec2')
         tag_list = [{'Key': k, 'Value': v} for k, v in self.tags.items()]
         ec2.create_tags(Resources=[instance_id], Tags=tag_list)
         return True, "成功"
     
     def _tag_ec2_volume(self, volume_id: str) -> Tuple[bool, str]:
         """EBS 卷打标签"""
-        ec2 = self.session.client('ec2')
+        ec2 = self._client('ec2')
         tag_list = [{'Key': k, 'Value': v} for k, v in self.tags.items()]
         ec2.create_tags(Resources=[volume_id], Tags=tag_list)
         return True, "成功"
     
     def _tag_s3_bucket(self, bucket_name: str) -> Tuple[bool, str]:
         """S3 存储桶打标签"""
-        s3 = self.session.client('s3')
+        s3 = self._client('s3')
         
         # 获取现有标签
         try:
@@ -124,7 +136,7 @@ class BatchTagger:
     
     def _tag_lambda_function(self, function_name: str) -> Tuple[bool, str]:
         """Lambda 函数打标签"""
-        lambda_client = self.session.client('lambda')
+        lambda_client = self._client('lambda')
         response = lambda_client.get_function(FunctionName=function_name)
         function_arn = response['Configuration']['FunctionArn']
         lambda_client.tag_resource(Resource=function_arn, Tags=self.tags)
@@ -132,9 +144,8 @@ class BatchTagger:
     
     def _tag_rds_instance(self, db_instance_id: str) -> Tuple[bool, str]:
         """RDS 实例打标签"""
-        rds = self.session.client('rds')
-        account_id = self.session.client('sts').get_caller_identity()['Account']
-        arn = f"arn:{self.arn_partition}:rds:{self.region}:{account_id}:db:{db_instance_id}"
+        rds = self._client('rds')
+        arn = f"arn:{self.arn_partition}:rds:{self.region}:{self.account_id}:db:{db_instance_id}"
         tag_list = [{'Key': k, 'Value': v} for k, v in self.tags.items()]
         rds.add_tags_to_resource(ResourceName=arn, Tags=tag_list)
         return True, "成功"